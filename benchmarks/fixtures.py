@@ -0,0 +1,158 @@
+"""
+Generated stand-ins for the Letterboxd pages the scrapers parse, with the markup the extractors look at embedded in
+roughly a real page's worth of surrounding chrome (nav, sidebars, footers, scripts), so parse costs are realistic.
+
+Everything is seeded, so the same scale always produces byte-identical pages.
+"""
+import random
+
+
+USERNAME = "benchuser"
+FILMS_PER_PAGE = 72
+MEMBERS_PER_PAGE = 30
+FOLLOWS_PER_PAGE = 25
+DIARY_ENTRIES_PER_PAGE = 50
+
+STARS = ["½", "★", "★½", "★★", "★★½", "★★★", "★★★½", "★★★★", "★★★★½", "★★★★★"]
+GENRES = ["Horror", "Drama", "Comedy", "Science Fiction", "Thriller", "Animation", "Documentary", "Romance"]
+COUNTRIES = ["USA", "UK", "France", "Japan", "South Korea", "Germany"]
+LANGUAGES = ["English", "French", "Japanese", "Korean", "German"]
+
+
+def _chrome(rng: random.Random, body: str, title="Letterboxd") -> str:
+    """ Wrap body in a page's worth of unrelated markup """
+    nav = "".join(f'<li class="navitem"><a href="/section-{i}/" class="navlink">Section {i}</a></li>'
+                  for i in range(40))
+    sidebar = "".join(f'<section class="section"><h2 class="section-heading">'
+                      f'<a href="/list/{rng.randrange(10 ** 6)}/">List {i}</a></h2><ul class="avatar-list">'
+                      + "".join(f'<li><a class="avatar -a16" href="/user{rng.randrange(10 ** 5)}/"><img src="x.jpg" '
+                                f'alt="" width="16" height="16"/></a></li>' for _ in range(12))
+                      + "</ul></section>" for i in range(8))
+    script = "<script>" + "var x = {};".join(str(rng.random()) for _ in range(300)) + "</script>"
+    footer = "".join(f'<p class="footer-text"><a href="/about/{i}/">About {i}</a> &middot; text text text</p>'
+                     for i in range(30))
+    return (f'<!DOCTYPE html><html lang="en"><head><title>{title}</title>'
+            f'<meta charset="UTF-8"/><link rel="stylesheet" href="/static/css/main.css"/>{script}</head>'
+            f'<body class="page"><div id="header"><nav><ul class="navitems">{nav}</ul></nav></div>'
+            f'<div id="content" class="site-body"><div class="content-wrap">{body}'
+            f'<aside class="sidebar">{sidebar}</aside></div></div><footer id="page-footer">{footer}</footer>'
+            f'{script}</body></html>')
+
+
+def paginator(page_no: int, pages: int) -> str:
+    """ Letterboxd's pager: the first and last pages, and those around the current one, with gaps elided """
+    if pages <= 1:
+        return ""
+    items = []
+    for n in range(1, pages + 1):
+        if n == page_no:
+            items.append(f'<li class="paginate-page paginate-current"><span>{n}</span></li>')
+        elif n in (1, pages) or abs(n - page_no) <= 2:
+            items.append(f'<li class="paginate-page"><a href="page/{n}/">{n}</a></li>')
+        elif not items[-1].endswith("unseen-pages\">&hellip;</li>"):
+            items.append('<li class="paginate-page unseen-pages">&hellip;</li>')
+    return f'<div class="pagination"><div class="paginate-pages"><ul>{"".join(items)}</ul></div></div>'
+
+
+def film_slug(film_id: int) -> str:
+    return f"bench-film-{film_id}"
+
+
+def rated_films_page(page_no: int, n=FILMS_PER_PAGE, seed=0, pages=1) -> str:
+    """ One page of a user's /films/ grid, out of pages; n=0 gives the empty page past the last one """
+    rng = random.Random(seed * 100003 + page_no)
+    items = []
+    for i in range(n):
+        film_id = page_no * 1000 + i
+        rating = rng.choice(STARS + [""])
+        span = f'<span class="rating rated-{STARS.index(rating) + 1}">{rating}</span>' if rating else ""
+        items.append(f'<li class="poster-container"><div class="really-lazy-load poster film-poster '
+                     f'film-poster-{film_id} linked-film-poster" data-film-id="{film_id}" '
+                     f'data-film-slug="/film/{film_slug(film_id)}/" '
+                     f'data-poster-url="/film/{film_slug(film_id)}/image-150/" '
+                     f'data-linked="linked"><img class="image" src="empty-poster-70.png" alt="Bench Film {film_id}" '
+                     f'width="70" height="105"/><span class="frame"><span class="frame-title"></span></span></div>'
+                     f'<p class="poster-viewingdata">{span}</p></li>')
+    body = f'<ul class="poster-list -p70 -grid film-list clear">{"".join(items)}</ul>{paginator(page_no, pages)}'
+    return _chrome(rng, body, f"{USERNAME}'s films")
+
+
+def _person_rows(rng: random.Random, first: int, n: int) -> str:
+    """ Rows of the person table shared by members listings and follows pages """
+    rows = []
+    for i in range(n):
+        name = f"member{first + i}"
+        rows.append(f'<tr><td class="table-person"><div class="person-summary"><a class="avatar -a40" href="/{name}/">'
+                    f'<img src="avatar.jpg" alt="{name}" width="40" height="40"/></a><h3 class="title-3">'
+                    f'<a href="/{name}/" class="name">{name.title()}</a></h3><small class="metadata">'
+                    f'<a href="/{name}/films/">{rng.randrange(5000)} films</a></small></div></td>'
+                    f'<td class="table-stats"><a href="/{name}/films/reviews/">{rng.randrange(900)}</a></td></tr>')
+    return f'<table class="person-table film-table"><tbody>{"".join(rows)}</tbody></table>' if n else ""
+
+
+def members_page(page_no: int, n=MEMBERS_PER_PAGE, seed=0) -> str:
+    rng = random.Random(seed * 100003 + page_no + 50000)
+    return _chrome(rng, _person_rows(rng, page_no * 100, n), "Popular members")
+
+
+def follows_page(page_no: int, n=FOLLOWS_PER_PAGE, seed=0, pages=1, direction="following") -> str:
+    """ One page of a user's following/followers, out of pages: paged by newer/older links, with no page numbers """
+    rng = random.Random(seed * 100003 + page_no + 110000)
+    links = []
+    if page_no > 1:
+        links.append(f'<a class="previous" href="/{USERNAME}/{direction}/page/{page_no - 1}/">Newer</a>')
+    if page_no < pages:
+        links.append(f'<a class="next" href="/{USERNAME}/{direction}/page/{page_no + 1}/">Older</a>')
+    body = _person_rows(rng, page_no * 100, n) + f'<div class="pagination">{"".join(links)}</div>'
+    return _chrome(rng, body, f"Following {USERNAME}" if direction == "followers" else f"{USERNAME} follows")
+
+
+def diary_page(page_no: int, n=DIARY_ENTRIES_PER_PAGE, seed=0, pages=1) -> str:
+    rng = random.Random(seed * 100003 + page_no + 90000)
+    rows = []
+    for i in range(n):
+        film_id = page_no * 1000 + i
+        month = f"Nov {2000 + page_no}" if i % 10 == 0 else ""
+        rows.append(f'<tr class="diary-entry-row viewing-poster-container"><td class="td-calendar">'
+                    f'<div class="date">{month}</div></td><td class="td-day diary-day center">'
+                    f'<a href="/{USERNAME}/films/diary/for/2023/11/{i % 28 + 1}/">{i % 28 + 1}</a></td>'
+                    f'<td class="td-film-details"><h3 class="headline-3 prettify">'
+                    f'<a href="/{USERNAME}/film/{film_slug(film_id)}/">Bench Film {film_id}</a></h3></td>'
+                    f'<td class="td-released center"><span>{1950 + i}</span></td><td class="td-rating rating-green">'
+                    f'<span class="rating rated-8">{rng.choice(STARS)}</span></td></tr>')
+    body = (f'<table class="table film-table" id="diary-table"><tbody>{"".join(rows)}</tbody></table>'
+            f'{paginator(page_no, pages)}')
+    return _chrome(rng, body, f"{USERNAME}'s diary")
+
+
+def film_page(film_id: int, seed=0) -> str:
+    rng = random.Random(seed * 100003 + film_id)
+    year = 1950 + film_id % 70
+    genres = "".join(f'<a href="/films/genre/{g.lower().replace(" ", "-")}/" class="text-slug">{g}</a>'
+                     for g in rng.sample(GENRES, 3))
+    themes = "".join(f'<a href="/films/theme/theme-{i}/" class="text-slug">Theme {i}</a>' for i in range(6))
+    cast = "".join(f'<a href="/actor/actor-{rng.randrange(10 ** 5)}/" class="text-slug tooltip">Actor {i}</a>'
+                   for i in range(40))
+    body = (f'<section class="film-header"><h1 class="headline-1">Bench Film {film_id}</h1></section>'
+            f'<div id="tab-cast"><div class="cast-list text-sluglist"><p>{cast}</p></div></div>'
+            f'<div id="tab-crew"><h3><span>Director</span></h3><div class="text-sluglist"><p>'
+            f'<a href="/director/director-{film_id % 97}/" class="text-slug">Director {film_id % 97}</a>'
+            f'</p></div></div>'
+            f'<div id="tab-genres"><h3><span>Genres</span></h3><div class="text-sluglist capitalize"><p>{genres}</p>'
+            f'</div><h3><span>Themes</span></h3><div class="text-sluglist capitalize"><p>{themes}</p></div></div>')
+    page = _chrome(rng, body, f"Bench Film {film_id} ({year})")
+    meta = (f'<meta name="twitter:title" content="Bench Film {film_id} ({year})"/>'
+            f'<meta name="twitter:data2" content="{rng.uniform(1, 5):.2f} out of 5"/>'
+            f'<meta name="twitter:description" content="A film for benchmarking."/>')
+    return page.replace("</head>", meta + "</head>", 1)
+
+
+def film_details_page(film_id: int, seed=0) -> str:
+    rng = random.Random(seed * 100003 + film_id + 70000)
+    links = (f'<a href="/studio/studio-{film_id % 13}/" class="text-slug">Studio {film_id % 13}</a>'
+             + "".join(f'<a href="/films/country/{c.lower().replace(" ", "-")}/" class="text-slug">{c}</a>'
+                       for c in rng.sample(COUNTRIES, 2))
+             + "".join(f'<a href="/films/language/{lang.lower()}/" class="text-slug">{lang}</a>'
+                       for lang in rng.sample(LANGUAGES, 2)))
+    body = f'<div id="tab-details"><h3><span>Studio</span></h3><div class="text-sluglist"><p>{links}</p></div></div>'
+    return _chrome(rng, body, f"Bench Film {film_id} details")
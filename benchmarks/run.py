@@ -0,0 +1,263 @@
+"""
+Offline scraper benchmarks.
+
+Fixture pages (see benchmarks.fixtures) are loaded into a replay-only ResponseCache, so the real scraping functions
+run unchanged without touching the network. Each benchmark is run once under tracemalloc for its peak memory, then
+timed over --repeat runs (best run kept).
+
+  python -m benchmarks.run [--scale 1] [--repeat 3] [--only NAME ...] [--output results.json]
+                           [--baseline benchmarks/baseline.json] [--save-baseline] [--fail-on-regression]
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from benchmarks import fixtures
+from scraping import cache, extract, fetch, members, user
+from scraping.movie import Movie, movie_details
+from scraping.scraper import RatingScraper
+from utils import storage
+from utils.storage import ParsingStorage
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+# Flag benchmarks whose throughput dropped by more than this fraction against the baseline
+REGRESSION_THRESHOLD = 0.10
+
+RATED_PAGES = 20
+MEMBER_PAGES = 10
+DIARY_PAGES = 10
+FILMS = 40
+# Ratings structured by the structure_* benchmarks: a heavy user's whole films grid
+USER_RATINGS = 10_000
+
+
+class Suite:
+    def __init__(self, scale=1.0):
+        self.rated_pages = max(1, int(RATED_PAGES * scale))
+        self.member_pages = max(1, int(MEMBER_PAGES * scale))
+        self.diary_pages = max(1, int(DIARY_PAGES * scale))
+        self.films = max(1, int(FILMS * scale))
+        self.user_ratings = max(1, int(USER_RATINGS * scale))
+
+        self.rated_html = [fixtures.rated_films_page(n, pages=self.rated_pages) for n in range(1, self.rated_pages + 1)]
+        self.raw_ratings = [r for page in self.rated_html
+                            for r in extract.extract("rated_films", page, fixtures.USERNAME)]
+        # The extracted grid, tiled under fresh film ids up to user_ratings
+        self.user_ratings_raw = [(title, str(int(film_id) + copy * 1_000_000), film_url, rating, username)
+                                 for copy in range(-(-self.user_ratings // len(self.raw_ratings)))
+                                 for title, film_id, film_url, rating, username in self.raw_ratings
+                                 ][:self.user_ratings]
+
+        self._tmp = tempfile.TemporaryDirectory(prefix="letterboxd-bench-")
+        self.cache = cache.ResponseCache(os.path.join(self._tmp.name, "http_cache"), replay_only=True)
+        self._record()
+
+    def _record(self):
+        """ Put every fixture page in the replay cache under the URL the scrapers will ask for """
+        username = fixtures.USERNAME
+        for n, page in enumerate(self.rated_html, 1):
+            self.cache.store(user.films_page_url(username, n), page)
+        self.cache.store(user.films_page_url(username, self.rated_pages + 1), fixtures.rated_films_page(0, n=0))
+
+        for n in range(1, self.member_pages + 1):
+            self.cache.store(members.members_page_url(members.MEMBERS_YEAR_TOP, n), fixtures.members_page(n))
+        self.cache.store(members.members_page_url(members.MEMBERS_YEAR_TOP, self.member_pages + 1),
+                         fixtures.members_page(0, n=0))
+
+        for n in range(1, self.diary_pages + 1):
+            self.cache.store(user.diary_page_url(username, n), fixtures.diary_page(n, pages=self.diary_pages))
+
+        for film_id in range(self.films):
+            url = f"https://letterboxd.com/film/{fixtures.film_slug(film_id)}/"
+            self.cache.store(url, fixtures.film_page(film_id))
+            self.cache.store(url + "details/", fixtures.film_details_page(film_id))
+
+    def benchmarks(self) -> dict:
+        """ {name: fn() -> (pages, rows)} """
+        benches = {}
+        for backend in extract.BACKENDS:
+            benches[f"extract_rated_films[{backend}]"] = lambda backend=backend: self.extract_rated(backend)
+        benches.update({
+            "user_films_rated": self.user_films_rated,
+            "top_users": self.top_users,
+            "user_diary_page": self.user_diary_page,
+            "user_diary": self.user_diary,
+            "movie": self.movie,
+            "movie_details": self.movie_details,
+            "structure_results": self.structure_results,
+            "structure_rows": self.structure_rows,
+            "insert_ratings[memory]": lambda: self.insert_ratings(in_memory=True),
+            "insert_ratings[disk]": lambda: self.insert_ratings(in_memory=False),
+        })
+        return benches
+
+    def extract_rated(self, backend: str):
+        rows = 0
+        for page in self.rated_html:
+            rows += len(extract.extract("rated_films", page, fixtures.USERNAME, backend=backend))
+        return len(self.rated_html), rows
+
+    def user_films_rated(self):
+        ratings = user.user_films_rated(user.User(fixtures.USERNAME))
+        return self.rated_pages, len(ratings)
+
+    def top_users(self):
+        n = self.member_pages * fixtures.MEMBERS_PER_PAGE
+        return self.member_pages + 1, len(members.top_users(n))
+
+    def user_diary_page(self):
+        u = user.User(fixtures.USERNAME)
+        rows = sum(len(user.user_diary_page(u, n)) for n in range(1, self.diary_pages + 1))
+        return self.diary_pages, rows
+
+    def user_diary(self):
+        return self.diary_pages, len(user.user_diary(user.User(fixtures.USERNAME)))
+
+    def movie(self):
+        for film_id in range(self.films):
+            Movie("/film/" + fixtures.film_slug(film_id) + "/").resolve()
+        return self.films, self.films
+
+    def movie_details(self):
+        rows = 0
+        for film_id in range(self.films):
+            movie = Movie.__new__(Movie)
+            movie.url = f"https://letterboxd.com/film/{fixtures.film_slug(film_id)}/"
+            rows += sum(len(v) for v in movie_details(movie).values())
+        return self.films, rows
+
+    def structure_results(self):
+        rs = RatingScraper(None)
+        rs._results = self.user_ratings_raw
+        return -(-self.user_ratings // fixtures.FILMS_PER_PAGE), len(rs.structure_results())
+
+    def structure_rows(self):
+        rs = RatingScraper(None)
+        rs._results = self.user_ratings_raw
+        return -(-self.user_ratings // fixtures.FILMS_PER_PAGE), len(rs.structure_rows())
+
+    def insert_ratings(self, in_memory: bool):
+        rs = RatingScraper(None)
+        rs._results = self.raw_ratings
+        ratings = rs.structure_results()
+        previous = storage.SCRAPE_DB
+        storage.SCRAPE_DB = os.path.join(self._tmp.name, "bench_store.db")
+        try:
+            if os.path.exists(storage.SCRAPE_DB):
+                os.remove(storage.SCRAPE_DB)
+            db = ParsingStorage(in_memory=in_memory)
+            db.insert_ratings(ratings)
+            db.close()
+        finally:
+            storage.SCRAPE_DB = previous
+        return self.rated_pages, len(ratings)
+
+    def close(self):
+        self.cache.close()
+        self._tmp.cleanup()
+
+
+def measure(fn, repeat: int) -> dict:
+    # The traced run also warms up imports and caches before the timed ones
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pages, rows = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "seconds": best,
+        "pages": pages,
+        "rows": rows,
+        "pages_per_s": pages / best if best else 0.0,
+        "rows_per_s": rows / best if best else 0.0,
+        "peak_kib": peak / 1024,
+    }
+
+
+def compare(results: dict, baseline: dict) -> list:
+    """ [(name, baseline rows/s, current rows/s, fractional change)] for the benchmarks in both """
+    rows = []
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["rows_per_s"]
+        change = (current["rows_per_s"] - before) / before if before else 0.0
+        rows.append((name, before, current["rows_per_s"], change))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser("Offline scraper benchmarks")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the number of fixture pages")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark (the best is kept)")
+    parser.add_argument("--only", nargs="+", help="Only run benchmarks whose name starts with one of these")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help=f"Exit non-zero if any benchmark is more than {REGRESSION_THRESHOLD:.0%} slower than "
+                             f"the baseline")
+    args = parser.parse_args()
+
+    suite = Suite(args.scale)
+    previous_cache = fetch._cache
+    fetch.set_cache(suite.cache)
+    results = {}
+    try:
+        for name, fn in suite.benchmarks().items():
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            results[name] = measure(fn, args.repeat)
+            r = results[name]
+            print(f"{name:<30} {r['seconds'] * 1000:9.1f}ms {r['pages_per_s']:9.1f} pages/s "
+                  f"{r['rows_per_s']:11.1f} rows/s  peak {r['peak_kib']:9.0f} KiB")
+    finally:
+        fetch.set_cache(previous_cache)
+        suite.close()
+
+    report = {
+        "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": args.scale,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    regressed = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != args.scale:
+            print(f"Baseline was recorded at scale {baseline.get('scale')}; comparing anyway")
+        print(f"\nAgainst baseline from {baseline['created_at']}:")
+        for name, before, after, change in compare(results, baseline["results"]):
+            flag = "  REGRESSION" if change < -REGRESSION_THRESHOLD else ""
+            print(f"{name:<30} {before:11.1f} -> {after:11.1f} rows/s ({change:+.1%}){flag}")
+            if flag:
+                regressed.append(name)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+
+    if regressed and args.fail_on_regression:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,5 +8,7 @@ source venv/bin/activate
 
 TSTAMP=`date +'%Y%m%d_%H%M%S'`
 
-python3 scrape.py -upd 50 2>&1 > logs/scrape_$TSTAMP.log &
+# Runs that overlap share the job queue in the DB rather than scraping the same stale users twice
+python3 scrape.py --enqueue 50 --incremental 2>&1 > logs/enqueue_$TSTAMP.log
+python3 scrape.py --worker --incremental 2>&1 > logs/scrape_$TSTAMP.log &
 deactivate
@@ -1,10 +1,14 @@
 import argparse
-from scraping import members, user
+import asyncio
+import atexit
+import os
+from scraping import cache, congestion, extract, fetch, members, user
+from scraping.engine import FetchEngine
 from datetime import datetime
 import time
 import random
 from scraping.scraper import UsersScraper, RatingScraper
-from utils import ParsingStorage
+from utils import ParsingStorage, metrics
 from utils.reporting import start_logging
 import logging
 
@@ -24,47 +28,174 @@ def cli_get_top_members(get_top_members):
     structured_users = us.structure_results()
     for su in structured_users:
         logger.info(f"  {str(su)} ")
-        db.insert_member(su)
+    db.insert_members(structured_users)
 
 
-def cli_user_film_ratings(user_film_ratings):
+def cli_user_film_ratings(user_film_ratings, incremental=False, index_updater=None, precheck=False, db=None):
+    """
+    :param index_updater: IndexUpdater shared across a multi-user run, which then saves it (False to skip it).
+     By default, a built neighbour index is updated and saved for just this user.
+    :param precheck: skip the scrape if the user's profile counters haven't changed since their last one
+    :param db: ParsingStorage to use, e.g. one shared by a worker's jobs; a new one by default
+    """
     logger.info(f"] User Film Ratings {user_film_ratings}")
 
-    db = ParsingStorage()
+    db = db or ParsingStorage()
+    if precheck:
+        from utils import precheck as profile_check
+        if not profile_check.precheck_user(db, user_film_ratings):
+            logger.info(f"'{user_film_ratings}' is unchanged since their last scrape")
+            return
+    own_updater = index_updater is None
+    if own_updater:
+        index_updater = neighbour_index_updater()
+
+    rs, full_scrape = rating_scraper_for(db, user_film_ratings, incremental, stream=True)
+    if full_scrape:
+        stream_user_ratings(db, user_film_ratings, rs, index_updater)
+    else:
+        rs.scrape()
+        store_user_ratings(db, user_film_ratings, rs, full_scrape, index_updater)
+
+    if own_updater and index_updater:
+        index_updater.save()
+
+
+def neighbour_index_updater():
+    """ An IndexUpdater if a neighbour index has been built (see --build-index), otherwise None """
+    try:
+        from suggest.index import IndexUpdater, INDEX_PATH
+    except ImportError:
+        return None
+    return IndexUpdater(INDEX_PATH) if os.path.exists(INDEX_PATH) else None
+
+
+def rating_scraper_for(db, username, incremental, engine=None, stream=False):
+    """
+    Pick between a full and an incremental ("delta") scrape of the user's ratings.
+    Incremental scrapes fall back to full ones when the user is due a periodic full re-scrape.
+    :param stream: make full scrapes streaming ones (see stream_user_ratings), resuming any interrupted one
+    :return: (RatingScraper, whether it's a full scrape)
+    """
+    userinfo = user.User(username)
+    if incremental and not db.needs_full_scrape(username):
+        known = db.get_user_ratings(username)
+        if known:
+            logger.debug(f"Incremental scrape for '{username}' against {len(known)} stored ratings")
+            if engine:
+                return RatingScraper(user.user_films_rated_delta_async, userinfo, known, engine), False
+            return RatingScraper(user.user_films_rated_delta, userinfo, known), False
+
+    if engine:
+        return RatingScraper(user.user_films_rated_async, userinfo, engine), True
+    if stream:
+        resume_after = db.get_scrape_progress(username)
+        if resume_after:
+            logger.info(f"Resuming interrupted scrape of '{username}' after page {resume_after}")
+        return RatingScraper(user.iter_user_films_rated, userinfo, resume_after + 1), True
+    return RatingScraper(user.user_films_rated, userinfo), True
+
+
+def store_user_ratings(db, username, rs, full_scrape=True, index_updater=None):
+    rating_rows = rs.structure_rows()
+
+    if not rating_rows:
+        """ Couldn't parse results for this user """
+        logger.error(f"Couldn't get film ratings for user '{username}'")
+        db.remove_user(username)
 
-    userinfo = user.User(user_film_ratings)
-    rs = RatingScraper(user.user_films_rated, userinfo)
-    rs.scrape()
-    structured_ratings = rs.structure_results()
 
-    if not structured_ratings:
-        """ Couldn't parse results for this user """
-        logger.error(f"Couldn't get film ratings for user '{user_film_ratings}'")
-        db.remove_user(user_film_ratings)
+    db.insert_rating_rows(rating_rows)
+    db.refresh_user(username, full_scrape)
+    if index_updater and rating_rows:
+        index_updater.update(db, username)
+
+
+def stream_user_ratings(db, username, rs, index_updater=None):
+    """ store_user_ratings for a streaming RatingScraper: commits each page as it's scraped """
+    stored = 0
+    for page_no, ratings in rs.stream():
+        db.insert_ratings_page(username, page_no, ratings)
+        stored += len(ratings)
+        logger.debug(f"  Committed page {page_no} for '{username}' ({stored} ratings)")
 
+    resumed = db.get_scrape_progress(username)
+    if not stored and not resumed:
+        logger.error(f"Couldn't get film ratings for user '{username}'")
+        db.remove_user(username)
 
-    # Test insertion into the DB
-    for r in structured_ratings:
-        # print(f"  [Debug] {str(r)}")
-        db.insert_rating(r)
+    db.refresh_user(username, full_scrape=True)
+    if index_updater and (stored or resumed):
+        index_updater.update(db, username)
 
-    db.refresh_user(user_film_ratings)
+
+async def update_film_ratings_async(stale_users, users_in_flight, pages_in_flight, incremental=False):
+    """ Scrape several stale users at once, each with up to pages_in_flight page requests outstanding """
+    db = ParsingStorage()
+    user_slots = asyncio.Semaphore(users_in_flight)
+    index_updater = neighbour_index_updater()
+
+    async def update_one(i, stale_user):
+        async with user_slots:
+            logger.debug(f"  [{i}] - [Debug] Fetching film ratings for user '{stale_user}'...")
+            try:
+                rs, full_scrape = rating_scraper_for(db, stale_user, incremental, engine)
+                await rs.scrape_async()
+                store_user_ratings(db, stale_user, rs, full_scrape, index_updater)
+            except Exception as e:
+                # One user's failure mustn't cancel everyone else's scrape; they stay stale for the next run
+                logger.error(f"Couldn't update film ratings for user '{stale_user}': {e}")
+                db.connection.rollback()
+            if not fetch.paced():
+                # Without a global --rate-limit or --adaptive pacing requests, each user slot keeps the sequential
+                # loop's pause between users
+                await asyncio.sleep(BACKOFF_TIME_BASE * (1 + random.random()))
+
+    with FetchEngine(max_in_flight=users_in_flight * pages_in_flight, per_user=pages_in_flight) as engine:
+        await engine.gather(update_one(i, u) for i, u in enumerate(stale_users))
+    db.close()
+    if index_updater:
+        index_updater.save()
 
 
-def cli_update_film_ratings(max_users_to_update=50, report_stale_users_only=False):
+def cli_update_film_ratings(max_users_to_update=50, report_stale_users_only=False, users_in_flight=1,
+                            pages_in_flight=1, incremental=False, pipeline=False, parse_workers=None,
+                            write_batch=None, precheck=False):
+    """ :param precheck: pre-check the users' profiles first, and only scrape the ones that changed """
     logger.info(f"] Check user updates")
 
     db = ParsingStorage()
-    stale_user_list = db.get_stale_users()
+    stale_user_list = db.get_stale_users(incremental)
+    if precheck and not report_stale_users_only:
+        from utils import precheck as profile_check
+        stale_user_list = profile_check.precheck(db, stale_user_list[:max_users_to_update])
     db.close()
     if not report_stale_users_only:
+        if pipeline:
+            update_film_ratings_pipelined(stale_user_list[:max_users_to_update], users_in_flight, parse_workers,
+                                          write_batch, incremental)
+            return
+
+        if users_in_flight > 1 or pages_in_flight > 1:
+            asyncio.run(update_film_ratings_async(stale_user_list[:max_users_to_update], users_in_flight,
+                                                  pages_in_flight, incremental))
+            return
+
+        index_updater = neighbour_index_updater()
         for i, stale_user in enumerate(stale_user_list):
             if i >= max_users_to_update:
                 break
             logger.debug(f"  [{i}] - [Debug] Fetching film ratings for user '{stale_user}'...")
-            cli_user_film_ratings(stale_user)
-            sleep_time = BACKOFF_TIME_BASE * (1 + random.random())
-            time.sleep(sleep_time)
+            try:
+                cli_user_film_ratings(stale_user, incremental, index_updater or False)
+            except fetch.FetchError as e:
+                # Left stale, so the next run tries them again
+                logger.error(f"Couldn't fetch film ratings for user '{stale_user}': {e}")
+            if not fetch.paced():
+                sleep_time = BACKOFF_TIME_BASE * (1 + random.random())
+                time.sleep(sleep_time)
+        if index_updater:
+            index_updater.save()
     else:
         logger.info(f"Got stale_user_list of length {len(stale_user_list)}")
         for u in stale_user_list:
@@ -72,6 +203,100 @@ def cli_update_film_ratings(max_users_to_update=50, report_stale_users_only=Fals
         return stale_user_list
 
 
+def update_film_ratings_pipelined(stale_users, fetch_workers, parse_workers=None, write_batch=None,
+                                  incremental=False):
+    """ Scrape users through the fetch -> parse -> write pipeline, which overlaps network, parsing and DB writes """
+    from utils import pipeline
+
+    index_updater = neighbour_index_updater()
+    # Keep the per-user pause between users unless a global --rate-limit or --adaptive is pacing requests instead
+    ratings_pipeline = pipeline.RatingsPipeline(fetch_workers=fetch_workers,
+                                                parse_workers=parse_workers or pipeline.PARSE_WORKERS,
+                                                write_batch=write_batch or pipeline.WRITE_BATCH,
+                                                user_pause=0.0 if fetch.paced() else BACKOFF_TIME_BASE,
+                                                index_updater=index_updater)
+    ratings_pipeline.run(stale_users, incremental)
+    if index_updater:
+        index_updater.save()
+
+
+def cli_enqueue(max_users_to_enqueue=50, incremental=False):
+    """ Queue scrape jobs for stale users, for --worker processes to pick up """
+    logger.info(f"] Enqueue stale users")
+    from utils.jobs import JobQueue
+
+    db = ParsingStorage()
+    stale_user_list = db.get_stale_users(incremental)
+    db.close()
+    queue = JobQueue()
+    queued = queue.enqueue(stale_user_list[:max_users_to_enqueue])
+    logger.info(f"Queued {queued} new jobs; queue is now {queue.counts()}")
+    queue.close()
+
+
+def cli_worker(incremental=False, max_jobs=None, precheck=False):
+    """ Drain the job queue one user at a time; any number of these can run against the same DB """
+    from utils.jobs import JobQueue, Heartbeat, worker_id
+
+    owner = worker_id()
+    logger.info(f"] Worker {owner}")
+    queue = JobQueue()
+    db = ParsingStorage()
+    done = 0
+    try:
+        with Heartbeat(queue, owner):
+            while max_jobs is None or done < max_jobs:
+                claimed = queue.claim(owner)
+                if not claimed:
+                    break
+                username = claimed[0]
+                try:
+                    # Concurrent workers would overwrite each other's copy of the neighbour index, so leave it alone
+                    cli_user_film_ratings(username, incremental, index_updater=False, precheck=precheck, db=db)
+                except Exception as e:
+                    logger.error(f"Job for '{username}' failed: {e}")
+                    # Don't leave the failed job's writes open on the connection the next job uses
+                    db.connection.rollback()
+                    queue.fail(owner, username, repr(e))
+                else:
+                    if not queue.complete(owner, username):
+                        logger.warning(f"Lost the lease on '{username}' before finishing it")
+                done += 1
+                if not fetch.paced():
+                    time.sleep(BACKOFF_TIME_BASE * (1 + random.random()))
+        logger.info(f"Worker {owner} finished {done} jobs; queue is now {queue.counts()}")
+    finally:
+        db.close()
+        queue.close()
+
+
+def cli_enrich_films(max_films=None, workers=None):
+    """ Fill the films table with metadata for every rated film it doesn't have (or has stale) """
+    logger.info(f"] Enrich films")
+    from utils import films
+
+    db = ParsingStorage()
+    loaded, failed = films.enrich_films(db, max_films=max_films, workers=workers or films.FILM_WORKERS)
+    db.close()
+    print(f"Loaded {loaded} films ({failed} failed)")
+
+
+def cli_crawl_follows(seeds, max_depth=None, max_users=None, workers=None):
+    """ Discover users by crawling the follow graph outward from seeds (or carry on with the saved frontier) """
+    logger.info(f"] Crawl the follow graph")
+    from utils import crawler
+
+    db = ParsingStorage()
+    fc = crawler.FollowCrawler(db, max_depth=max_depth or crawler.CRAWL_DEPTH,
+                               workers=workers or crawler.CRAWL_WORKERS)
+    if seeds:
+        logger.info(f"Seeded the crawl with {fc.seed(seeds)} new users")
+    stats = fc.run(max_users=max_users)
+    db.close()
+    print(f"Crawled {stats['crawled']} users, discovered {stats['discovered']} new ones; "
+          f"{stats['frontier']} users left on the frontier")
+
+
 def cli_refresh_last_updated():
     """ Helper method if you've got film ratings data in the DB that you don't think needs to be updated"""
     logger.info(f"] Setting")
@@ -89,6 +314,152 @@ def cli_refresh_last_updated():
     db.connection.commit()
 
 
+def cli_suggest(username, k=10, metric="cosine", min_overlap=10):
+    logger.info(f"] Suggest users for {username} to follow")
+    # numpy/scipy are only needed for suggestions, so don't make scraping depend on them
+    from suggest.index import NeighbourIndex, INDEX_PATH
+    from suggest.snapshot import load_matrix
+
+    username = username.lower()
+    if os.path.exists(INDEX_PATH):
+        index = NeighbourIndex.load(INDEX_PATH)
+        # Lists only hold index.keep users for certain, so larger k go to the matrix
+        if (index.metric == metric and index.min_overlap == min_overlap and username in index.user_index
+                and k <= index.keep):
+            logger.debug(f"Answering from the neighbour index at {INDEX_PATH}")
+            suggestions = index.query(username, k=k)
+            print_suggestions(suggestions)
+            return suggestions
+
+    db = ParsingStorage()
+    matrix = load_matrix(db)
+    db.close()
+
+    suggestions = matrix.suggest(username, k=k, metric=metric, min_overlap=min_overlap)
+    print_suggestions(suggestions)
+    return suggestions
+
+
+def format_taste_feature(feature) -> str:
+    """ "Horror (42, +0.31)": films watched and affinity (unknown for genres read off genre pages) """
+    if feature["affinity"] is None:
+        return f"{feature['name']} ({feature['films']})"
+    return f"{feature['name']} ({feature['films']}, {feature['affinity']:+.2f})"
+
+
+def cli_taste(usernames, k=10, refresh=False):
+    """ Print each user's taste profile (genres, decades, countries, directors), computed from the DB """
+    logger.info(f"] Taste profiles for {', '.join(usernames)}")
+    from suggest.taste import TasteProfiler, DIMENSIONS
+
+    db = ParsingStorage()
+    profiler = TasteProfiler(db, top=k)
+    profiles = {}
+    for username in usernames:
+        username = username.lower()
+        profile = profiler.profile(username, refresh=refresh)
+        profiles[username] = profile
+        print(f"{username}: {profile['films']} films, {profile['rated']} rated (mean {profile['mean_rating']}), "
+              f"{profile['coverage']:.0%} with metadata")
+        for dimension in DIMENSIONS:
+            features = ", ".join(format_taste_feature(f) for f in profile[dimension][:k])
+            print(f"  {dimension:<9} [{profile['sources'][dimension]}] {features}")
+    db.close()
+    return profiles
+
+
+def cli_suggest_social(username, k=10, metric="cosine", min_overlap=10):
+    """ Suggestions blending the follow graph (friends of friends, shared followers, PageRank) with ratings """
+    logger.info(f"] Suggest users for {username} to follow, by follow graph and ratings")
+    from suggest.graph import FollowGraph, GraphSuggester
+    from suggest.snapshot import load_matrix
+
+    username = username.lower()
+    db = ParsingStorage()
+    graph = FollowGraph.from_db(db)
+    matrix = load_matrix(db)
+    db.close()
+
+    if username not in graph.user_index:
+        logger.warning(f"No follow edges stored for '{username}' (see --crawl-follows): suggesting by ratings only")
+        suggestions = matrix.suggest(username, k=k, metric=metric, min_overlap=min_overlap)
+        print_suggestions(suggestions)
+        return suggestions
+
+    suggestions = GraphSuggester(graph, matrix, metric=metric, min_overlap=min_overlap).suggest(username, k=k)
+    for rank, (other, score, signals) in enumerate(suggestions, 1):
+        print(f"{rank:>3}. {other:<30} score={score:.3f} friends_of_friends={signals['friends_of_friends']:.0f} "
+              f"shared_followers={signals['shared_followers']:.0f} pagerank={signals['pagerank']:.2e} "
+              f"similarity={signals['rating_similarity']:.3f}")
+    return suggestions
+
+
+def print_suggestions(suggestions):
+    for rank, (other, score, overlap) in enumerate(suggestions, 1):
+        print(f"{rank:>3}. {other:<30} similarity={score:.3f} films_in_common={overlap}")
+
+
+def cli_build_index(neighbours, metric="cosine", min_overlap=10):
+    logger.info(f"] Build {neighbours}-neighbour index")
+    from suggest.index import NeighbourIndex, INDEX_PATH
+    from suggest.snapshot import load_matrix
+
+    db = ParsingStorage()
+    matrix = load_matrix(db)
+    db.close()
+    NeighbourIndex.build(matrix, neighbours, metric, min_overlap).save(INDEX_PATH)
+    logger.info(f"Saved neighbour index to {INDEX_PATH}")
+
+
+def cli_index_recall(sample_size, k=10, metric="cosine", min_overlap=10):
+    """ Recall/latency of the neighbour index against brute force, for a random sample of users """
+    logger.info(f"] Neighbour index recall over {sample_size} users")
+    from suggest.index import recall_benchmark
+    from suggest.snapshot import load_matrix
+
+    db = ParsingStorage()
+    matrix = load_matrix(db)
+    db.close()
+    sample = random.sample(matrix.users, min(sample_size, len(matrix.users)))
+    for row in recall_benchmark(matrix, sample, k, metric, min_overlap):
+        print(f"neighbours={row['neighbours']:<4} recall@{k}={row['recall']:.3f} build={row['build_s']:.1f}s "
+              f"query={row['index_ms']:.2f}ms brute_force={row['brute_ms']:.2f}ms")
+
+
+def cli_write_snapshot():
+    """ Export the ratings table to the memory-mapped snapshot that --suggest/--build-index load from """
+    logger.info(f"] Write ratings snapshot")
+    from suggest.snapshot import write_snapshot, SNAPSHOT_PATH
+
+    db = ParsingStorage()
+    meta = write_snapshot(db, SNAPSHOT_PATH)
+    db.close()
+    print(f"{meta['ratings']} ratings: {meta['users']} users x {meta['films']} films -> {SNAPSHOT_PATH}")
+
+
+def cli_migrate_db():
+    """ Upgrade an existing scrape_store.db to the current schema (e.g. deduping the ratings table) """
+    logger.info(f"] Migrating DB")
+    db = ParsingStorage(migrate=True)
+    logger.info(f"DB is at schema version {db.schema_version()}")
+    db.close()
+
+
+def dump_metrics(directory):
+    """ Log where the run's time went and write the run's metrics out, if it recorded any """
+    if not (metrics.REGISTRY.histograms or metrics.REGISTRY.counters):
+        return
+    metrics.REGISTRY.log_summary()
+    json_path, prom_path = metrics.REGISTRY.dump(directory)
+    logger.info(f"Wrote run metrics to {json_path} and {prom_path}")
+
+
+def save_congestion_state(controller, path):
+    """ Keep what the congestion controller learned for the next run """
+    logger.info(f"Congestion control: {controller.summary()}")
+    controller.save(path)
+
+
 def main():
     parser = argparse.ArgumentParser("A scraper")
     parser.add_argument('--get-top-members', '-top', dest="get_top_members",
@@ -101,26 +472,160 @@ def main():
 
     parser.add_argument('--users-to-update', '-utu', dest="users_to_update", action="store_true",
                         help="Flag denoting to list users whose film ratings have not been scraped in the last 7 days")
+    parser.add_argument('--enqueue', dest="enqueue", type=int,
+                        help="Queue rating-scrape jobs for up to < N > stale users, for --worker processes")
+    parser.add_argument('--worker', dest="worker", type=int, nargs="?", const=0,
+                        help="Claim and run queued jobs until the queue is empty (or < N > jobs are done)")
+    parser.add_argument('--enrich-films', dest="enrich_films", type=int, nargs="?", const=0,
+                        help="Fetch metadata (directors, year, genres, countries...) for rated films missing from "
+                             "the films table, or only the first < N > of them")
+    parser.add_argument('--film-workers', dest="film_workers", type=int,
+                        help="Films fetched concurrently by --enrich-films")
+    parser.add_argument('--crawl-follows', dest="crawl_follows", nargs="*", metavar="SEED",
+                        help="Discover users breadth-first through following/followers lists, from these seed users "
+                             "(or resuming the saved frontier)")
+    parser.add_argument('--crawl-depth', dest="crawl_depth", type=int,
+                        help="With --crawl-follows, expand users fewer than < N > hops from a seed")
+    parser.add_argument('--crawl-max', dest="crawl_max", type=int,
+                        help="With --crawl-follows, stop after expanding < N > users")
+    parser.add_argument('--crawl-workers', dest="crawl_workers", type=int,
+                        help="Users whose follows --crawl-follows fetches concurrently")
     parser.add_argument('--refresh-last-updated', '-r', dest="refresh_last_updated", action="store_true",
                         help="Update the 'last_updated' column in the DB for all users with film ratings")
+    parser.add_argument('--precheck', dest="precheck", action="store_true",
+                        help="With -ufr, -upd or --worker, fetch each user's profile first and skip scraping users "
+                             "whose film/rating counters haven't changed since their last scrape")
+    parser.add_argument('--incremental', '-inc', dest="incremental", action="store_true",
+                        help="With -ufr/-upd, only page through films newest-first until reaching already-stored "
+                             "ratings (users get a full re-scrape every few weeks regardless)")
+    parser.add_argument('--suggest', dest="suggest",
+                        help="Suggest users for < user > to follow, by similarity of their film ratings")
+    parser.add_argument('--social', dest="social", action="store_true",
+                        help="With --suggest, also score candidates by the follow graph (see --crawl-follows)")
+    parser.add_argument('--taste', dest="taste", nargs="+", metavar="USER",
+                        help="Print users' most watched genres, decades, countries and directors, and how they rate "
+                             "them against their own average (cached until their ratings or the films table change)")
+    parser.add_argument('--refresh-taste', dest="refresh_taste", action="store_true",
+                        help="With --taste, recompute profiles instead of using cached ones")
+    parser.add_argument('--top-k', '-k', dest="top_k", type=int, default=10,
+                        help="With --suggest, how many users to suggest")
+    parser.add_argument('--metric', dest="metric", choices=("cosine", "pearson"), default="cosine",
+                        help="With --suggest, similarity of mean-centred ratings over all films (cosine) or "
+                             "over co-rated films only (pearson)")
+    parser.add_argument('--min-overlap', dest="min_overlap", type=int, default=10,
+                        help="With --suggest, only consider users with at least < N > rated films in common")
+    parser.add_argument('--build-index', dest="build_index", type=int, nargs="?", const=50,
+                        help="Precompute each user's < N > (default 50) most similar users for --suggest; the index "
+                             "is then kept up to date as users' ratings are re-scraped")
+    parser.add_argument('--index-recall', dest="index_recall", type=int,
+                        help="Benchmark neighbour index recall and latency against brute force over < N > users")
+    parser.add_argument('--snapshot', dest="snapshot", action="store_true",
+                        help="Export the ratings table to a compact memory-mapped snapshot; suggestions load from "
+                             "it instead of the DB while it exists")
+    parser.add_argument('--migrate-db', dest="migrate_db", action="store_true",
+                        help="One-shot upgrade of an existing DB to the current schema")
+
+    parser.add_argument('--connect-timeout', dest="connect_timeout", type=float, default=fetch.CONNECT_TIMEOUT,
+                        help="Seconds to wait for a connection to letterboxd.com")
+    parser.add_argument('--read-timeout', dest="read_timeout", type=float, default=fetch.READ_TIMEOUT,
+                        help="Seconds to wait for a page body before retrying")
+    parser.add_argument('--max-retries', dest="max_retries", type=int, default=fetch.MAX_RETRIES,
+                        help="Retries per page on connection errors and 5xx responses")
+    parser.add_argument('--http-cache', dest="http_cache", nargs="?", const=cache.CACHE_DIR,
+                        help="Cache fetched pages on disk (in < DIR >, default .http_cache) and reuse them within "
+                             "their TTL")
+    parser.add_argument('--http-cache-mb', dest="http_cache_mb", type=int, default=cache.MAX_BYTES // 1024 ** 2,
+                        help="Size bound for --http-cache; least recently used pages are evicted beyond it")
+    parser.add_argument('--replay', dest="replay", action="store_true",
+                        help="Serve every page from --http-cache and never touch the network")
+    parser.add_argument('--extract-backend', dest="extract_backend", choices=extract.BACKENDS,
+                        default=extract.BACKEND, help="HTML extraction backend for scraped pages")
+    parser.add_argument('--users-in-flight', '-j', dest="users_in_flight", type=int, default=1,
+                        help="With -upd, scrape up to < N > users concurrently")
+    parser.add_argument('--pages-in-flight', dest="pages_in_flight", type=int, default=1,
+                        help="With -upd, keep up to < N > page requests in flight per user")
+    parser.add_argument('--rate-limit', dest="rate_limit", type=float, default=0.0,
+                        help="Global politeness budget in requests/second across all users (0 = unlimited)")
+    parser.add_argument('--adaptive', dest="adaptive", nargs="?", const=congestion.STATE_PATH,
+                        help="Tune the request rate and concurrency to Letterboxd's responses (AIMD), starting from "
+                             "and saving to < STATE > (default: congestion_state.json); --rate-limit caps the rate")
+    parser.add_argument('--pipeline', dest="pipeline", action="store_true",
+                        help="With -upd, run fetching (-j threads), parsing and DB writes as overlapping stages")
+    parser.add_argument('--parse-workers', dest="parse_workers", type=int,
+                        help="With --pipeline, processes parsing pages (default: one per CPU)")
+    parser.add_argument('--write-batch', dest="write_batch", type=int,
+                        help="With --pipeline, rating rows per DB transaction")
+    parser.add_argument('--metrics-dir', dest="metrics_dir", default=metrics.METRICS_DIR,
+                        help="Where to write each run's timing/counter summary (JSON) and Prometheus text file")
     args = parser.parse_args()
 
     logger.debug(f"{args=}")
+    # Also covers runs that die partway, which are the ones most worth looking at
+    atexit.register(dump_metrics, args.metrics_dir)
+    fetch.configure(connect_timeout=args.connect_timeout, read_timeout=args.read_timeout,
+                    max_retries=args.max_retries)
+    if args.adaptive:
+        controller = congestion.AimdController.load(args.adaptive, max_rate=args.rate_limit or congestion.MAX_RATE)
+        fetch.set_controller(controller)
+        atexit.register(save_congestion_state, controller, args.adaptive)
+    else:
+        fetch.set_rate_limit(args.rate_limit)
+    extract.set_backend(args.extract_backend)
+    if args.http_cache or args.replay:
+        fetch.set_cache(cache.ResponseCache(args.http_cache or cache.CACHE_DIR,
+                                            max_bytes=args.http_cache_mb * 1024 ** 2, replay_only=args.replay))
     if args.get_top_members:
         cli_get_top_members(args.get_top_members)
 
     elif args.user_film_ratings:
-        cli_user_film_ratings(args.user_film_ratings)
+        cli_user_film_ratings(args.user_film_ratings, args.incremental, precheck=args.precheck)
 
     elif args.users_to_update:
-        cli_update_film_ratings(report_stale_users_only=True)
+        cli_update_film_ratings(report_stale_users_only=True, incremental=args.incremental)
 
     elif args.update_film_ratings:
-        cli_update_film_ratings(max_users_to_update=int(args.update_film_ratings))
+        cli_update_film_ratings(max_users_to_update=int(args.update_film_ratings),
+                                users_in_flight=args.users_in_flight, pages_in_flight=args.pages_in_flight,
+                                incremental=args.incremental, pipeline=args.pipeline,
+                                parse_workers=args.parse_workers, write_batch=args.write_batch,
+                                precheck=args.precheck)
+
+    elif args.enqueue:
+        cli_enqueue(args.enqueue, args.incremental)
+
+    elif args.worker is not None:
+        cli_worker(args.incremental, max_jobs=args.worker or None, precheck=args.precheck)
+
+    elif args.enrich_films is not None:
+        cli_enrich_films(args.enrich_films or None, args.film_workers)
+
+    elif args.crawl_follows is not None:
+        cli_crawl_follows(args.crawl_follows, args.crawl_depth, args.crawl_max, args.crawl_workers)
 
     elif args.refresh_last_updated:
         cli_refresh_last_updated()
 
+    elif args.taste:
+        cli_taste(args.taste, k=args.top_k, refresh=args.refresh_taste)
+
+    elif args.suggest and args.social:
+        cli_suggest_social(args.suggest, k=args.top_k, metric=args.metric, min_overlap=args.min_overlap)
+
+    elif args.suggest:
+        cli_suggest(args.suggest, k=args.top_k, metric=args.metric, min_overlap=args.min_overlap)
+
+    elif args.build_index:
+        cli_build_index(args.build_index, metric=args.metric, min_overlap=args.min_overlap)
+
+    elif args.index_recall:
+        cli_index_recall(args.index_recall, k=args.top_k, metric=args.metric, min_overlap=args.min_overlap)
+
+    elif args.snapshot:
+        cli_write_snapshot()
+
+    elif args.migrate_db:
+        cli_migrate_db()
+
     else:
         parser.print_help()
 
@@ -1,10 +1,42 @@
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 import json
+import logging
 import re
-import requests
+from scraping import fetch
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_WORKERS = 8
 
 
 class Base:
+    # {attribute: name of the method that fetches it}. These are fetched on first access rather than in __init__, so
+    # constructing an object costs no requests; a method setting several attributes from one page is run once.
+    LAZY_ATTRIBUTES = {}
+
+    def __getattr__(self, name):
+        # Only reached for attributes that aren't set (yet)
+        loader = type(self).LAZY_ATTRIBUTES.get(name)
+        if loader is None or loader in self.__dict__.get("_loaded", ()):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        self._load(loader)
+        # The loader may legitimately not set it, e.g. Movie.director for a film with several directors
+        return object.__getattribute__(self, name)
+
+    def _load(self, loader: str):
+        getattr(self, loader)()
+        self.__dict__.setdefault("_loaded", set()).add(loader)
+
+    def resolve(self):
+        """ Fetch every lazy attribute that hasn't been fetched yet """
+        loaded = self.__dict__.get("_loaded", ())
+        for loader in dict.fromkeys(type(self).LAZY_ATTRIBUTES.values()):
+            if loader not in loaded:
+                self._load(loader)
+        return self
 
     def self_check_value(self, value):
         """ Check to ensure no particularly exotic characters are present """
@@ -15,21 +47,38 @@ class Base:
         return self.jsonify()
 
     def jsonify(self) -> str:
-        return json.dumps(self, indent=4, cls=Encoder)
+        return json.dumps(self.resolve(), indent=4, cls=Encoder)
+
+    @staticmethod
+    def get_page(url: str) -> str:
+        """ Raw page HTML, for the extractors in scraping.extract """
+        return fetch.fetch_text(url)
 
     @staticmethod
     def get_parsed_page(url: str) -> BeautifulSoup:
+        page = fetch.fetch_text(url)
+        with metrics.timer("extract_seconds", extractor="parsed_page", backend="soup"):
+            return BeautifulSoup(page, "lxml")
 
-        # From letterboxdpy on Github:
-        # This fixes a blocked by cloudflare error i've encountered
-        headers = {
-            "referer": "https://letterboxd.com",
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
-        }
 
-        return BeautifulSoup(requests.get(url, headers=headers).text, "lxml")
+def prefetch(objects, workers=PREFETCH_WORKERS) -> list:
+    """
+    Resolve the lazy attributes of many objects concurrently
+    :return: the objects that failed to load (their errors are logged)
+    """
+    objects = list(objects)
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch") as pool:
+        for obj, future in zip(objects, [pool.submit(obj.resolve) for obj in objects]):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Couldn't load {type(obj).__name__} {getattr(obj, 'url', None) or getattr(obj, 'username', '')}: {e}")
+                failed.append(obj)
+    return failed
 
 
 class Encoder(json.JSONEncoder):
     def default(self, o):
-        return o.__dict__
\ No newline at end of file
+        # Underscored attributes are per-object caches (e.g. Movie's fetched pages), not data
+        return {k: v for k, v in o.__dict__.items() if not k.startswith("_")}
\ No newline at end of file
@@ -0,0 +1,186 @@
+"""
+Persistent HTTP response cache for scraped pages.
+
+Bodies are stored one file per URL (named by the URL's sha256) under CACHE_DIR, with an sqlite index holding each
+entry's validators, fetch time, size and last access for TTL checks and LRU eviction.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from scraping.fetch import FetchError
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = ".http_cache"
+MAX_BYTES = 2 * 1024 ** 3
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# First matching pattern wins
+TTLS = [
+    (re.compile(r"letterboxd\.com/film/[^/]+/(details/)?$"), 30 * DAY),
+    (re.compile(r"/films/(by/[^/]+/)?(page/\d+/)?$"), 6 * HOUR),
+    (re.compile(r"/films/diary/(page/\d+/)?$"), 6 * HOUR),
+    (re.compile(r"/members/"), DAY),
+    # Profile pages are what the pre-check (see utils.precheck) compares, so they mustn't be served stale for long
+    (re.compile(r"letterboxd\.com/[A-Za-z0-9_]+/$"), HOUR),
+]
+DEFAULT_TTL = DAY
+
+
+class CacheMiss(FetchError):
+    """ Raised in replay-only mode for a URL that was never cached """
+
+
+def ttl_for(url: str) -> int:
+    for pattern, ttl in TTLS:
+        if pattern.search(url):
+            return ttl
+    return DEFAULT_TTL
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_DIR, max_bytes=MAX_BYTES, replay_only=False):
+        """
+        :param replay_only: serve everything from the cache, regardless of age, and never touch the network
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.replay_only = replay_only
+        os.makedirs(path, exist_ok=True)
+
+        # Fetches happen on worker threads, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(path, "index.db"), check_same_thread=False)
+        self.cursor = self.connection.cursor()
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS entries(key TEXT PRIMARY KEY, url TEXT, etag TEXT, "
+                            "last_modified TEXT, fetched_at REAL, last_access REAL, size INTEGER)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS entries_by_access ON entries(last_access)")
+        self.connection.commit()
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode("UTF-8")).hexdigest()
+
+    def _body_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + ".html")
+
+    def lookup(self, url: str):
+        """ (etag, last_modified, fetched_at, body) for a cached url, or None """
+        key = self.key(url)
+        with self._lock:
+            self.cursor.execute("SELECT etag, last_modified, fetched_at FROM entries WHERE key = ?", (key,))
+            row = self.cursor.fetchone()
+            if not row:
+                return None
+            self.cursor.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+        try:
+            with open(self._body_path(key), encoding="UTF-8") as f:
+                return row + (f.read(),)
+        except FileNotFoundError:
+            return None
+
+    def store(self, url: str, body: str, etag=None, last_modified=None):
+        key = self.key(url)
+        body_path = self._body_path(key)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        data = body.encode("UTF-8")
+        # Write-then-rename so concurrent readers never see a partial body
+        tmp_path = f"{body_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+        now = time.time()
+        # The rename and the index row go together under the lock, so evict() can't remove one without the other
+        with self._lock:
+            os.replace(tmp_path, body_path)
+            self.cursor.execute("INSERT OR REPLACE INTO entries (key, url, etag, last_modified, fetched_at, "
+                                "last_access, size) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (key, url, etag, last_modified, now, now, len(data)))
+            self.connection.commit()
+        self.evict()
+
+    def revalidated(self, url: str):
+        """ The server confirmed our copy is current (HTTP 304): restart its TTL """
+        with self._lock:
+            self.cursor.execute("UPDATE entries SET fetched_at = ? WHERE key = ?", (time.time(), self.key(url)))
+            self.connection.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            self.cursor.execute("SELECT COALESCE(SUM(size), 0) FROM entries")
+            return self.cursor.fetchone()[0]
+
+    def evict(self):
+        """
+        Drop least recently used entries until the cache is back under 90% of max_bytes.
+        Entries are chosen and their bodies deleted under the lock, so a concurrent store() of the same key either
+        lands before (and is evicted whole) or after (and survives whole).
+        """
+        if self.size() <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        with self._lock:
+            self.cursor.execute("SELECT COALESCE(SUM(size), 0) FROM entries")
+            total = self.cursor.fetchone()[0]
+            self.cursor.execute("SELECT key, size FROM entries ORDER BY last_access")
+            evicted = []
+            for key, size in self.cursor.fetchall():
+                if total <= target:
+                    break
+                evicted.append(key)
+                total -= size
+            self.cursor.executemany("DELETE FROM entries WHERE key = ?", ((k,) for k in evicted))
+            self.connection.commit()
+            for key in evicted:
+                try:
+                    os.remove(self._body_path(key))
+                except FileNotFoundError:
+                    pass
+        logger.debug(f"Evicted {len(evicted)} cached pages")
+
+    def fetch_text(self, url: str, fetch) -> str:
+        """
+        Serve url from the cache if it's within its TTL, otherwise revalidate/refetch it via fetch(url, headers).
+        """
+        hit = self.lookup(url)
+        url_class = metrics.url_class(url)
+        if self.replay_only:
+            if hit is None:
+                metrics.inc("http_cache_total", url_class=url_class, outcome="replay_miss")
+                raise CacheMiss(f"{url} is not in the cache at {self.path}")
+            metrics.inc("http_cache_total", url_class=url_class, outcome="hit")
+            return hit[3]
+
+        headers = {}
+        if hit is not None:
+            etag, last_modified, fetched_at, body = hit
+            if time.time() - fetched_at < ttl_for(url):
+                metrics.inc("http_cache_total", url_class=url_class, outcome="hit")
+                return body
+            if etag:
+                headers["if-none-match"] = etag
+            if last_modified:
+                headers["if-modified-since"] = last_modified
+
+        response = fetch(url, headers=headers or None)
+        if response.status_code == 304 and hit is not None:
+            metrics.inc("http_cache_total", url_class=url_class, outcome="revalidated")
+            self.revalidated(url)
+            return hit[3]
+        metrics.inc("http_cache_total", url_class=url_class, outcome="miss")
+        if response.status_code == 200:
+            self.store(url, response.text, response.headers.get("etag"), response.headers.get("last-modified"))
+        return response.text
+
+    def close(self):
+        self.connection.close()
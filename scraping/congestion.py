@@ -0,0 +1,241 @@
+"""
+AIMD congestion control for requests to Letterboxd.
+
+Every fetch (see scraping.fetch) takes a slot from the controller before it goes out and reports how it went when it
+comes back. The controller caps both the requests in flight and the request rate, and tunes them like TCP does its
+window: while responses come back fine it adds a little to each for every second's worth of them (additive increase);
+on a congestion signal (a 429, a Cloudflare challenge page, 5xx/connection errors, or latency climbing well above its
+baseline) it halves them (multiplicative decrease). A Retry-After on a response pauses every caller until it's up.
+
+The learned rate is saved to a small JSON file at the end of a run, so the next cron run starts from it instead of
+relearning it from the bottom.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+STATE_PATH = "congestion_state.json"
+# Saved state older than this is ignored: Letterboxd's tolerance may well have changed since
+STATE_MAX_AGE_DAYS = 7
+
+INITIAL_RATE = 1.0
+MIN_RATE = 0.1
+MAX_RATE = 20.0
+INITIAL_CONCURRENCY = 2
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 16
+
+# Additive increase per round of healthy responses (one round = a second's worth at the current rate)
+RATE_STEP = 0.5
+CONCURRENCY_STEP = 1
+# Multiplicative decrease on a congestion signal
+DECREASE_FACTOR = 0.5
+# Signals within this many seconds of a decrease are the same episode (responses to requests already in flight)
+DECREASE_HOLD = 5.0
+
+# Latency: an exponentially weighted mean, against the lowest that mean has been
+LATENCY_ALPHA = 0.2
+LATENCY_FACTOR = 3.0
+# Means below this are never treated as congestion, however low the baseline is
+LATENCY_FLOOR = 1.0
+MAX_RETRY_AFTER = 600.0
+
+OK = "ok"
+SLOW = "slow"
+THROTTLED = "throttled"
+CHALLENGE = "challenge"
+SERVER_ERROR = "server_error"
+ERROR = "error"
+SIGNALS = (OK, SLOW, THROTTLED, CHALLENGE, SERVER_ERROR, ERROR)
+
+CHALLENGE_STATUSES = (403, 429, 503)
+CHALLENGE_MARKERS = ("challenge-platform", "cf-chl", "<title>Just a moment...</title>")
+
+
+def is_challenge(response) -> bool:
+    """ Whether a response is a Cloudflare challenge/interstitial rather than the page asked for """
+    if response.headers.get("cf-mitigated") == "challenge":
+        return True
+    if response.status_code not in CHALLENGE_STATUSES:
+        return False
+    text = response.text
+    return any(marker in text for marker in CHALLENGE_MARKERS)
+
+
+def classify(response) -> str:
+    """ The congestion signal carried by a response (OK for anything that isn't one, 404s included) """
+    if is_challenge(response):
+        return CHALLENGE
+    if response.status_code == 429:
+        return THROTTLED
+    if response.status_code >= 500:
+        return SERVER_ERROR
+    return OK
+
+
+def retry_after(response) -> float:
+    """ Seconds a response's Retry-After header asks us to wait (delay-seconds or HTTP-date form), or None """
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        seconds = float(value)
+    else:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            logger.warning(f"Ignoring unparseable Retry-After: {value!r}")
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+class AimdController:
+    def __init__(self, rate=INITIAL_RATE, concurrency=INITIAL_CONCURRENCY, min_rate=MIN_RATE, max_rate=MAX_RATE,
+                 min_concurrency=MIN_CONCURRENCY, max_concurrency=MAX_CONCURRENCY, paused_until=0.0):
+        """
+        :param rate: starting request rate, per second
+        :param concurrency: starting limit on requests in flight
+        :param paused_until: epoch time before which no request may go out (an earlier run's Retry-After)
+        """
+        self.min_rate, self.max_rate = min_rate, max_rate
+        self.min_concurrency, self.max_concurrency = min_concurrency, max_concurrency
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.concurrency = min(max(int(concurrency), min_concurrency), max_concurrency)
+        self.in_flight = 0
+        self.latency = None
+        self.baseline_latency = None
+        self.counts = dict.fromkeys(SIGNALS, 0)
+        self.increases = 0
+        self.decreases = 0
+        self._cond = threading.Condition()
+        self._next_at = 0.0
+        self._paused_until = time.monotonic() + max(paused_until - time.time(), 0.0)
+        self._healthy = 0
+        self._last_decrease = float("-inf")
+
+    @classmethod
+    def load(cls, path=STATE_PATH, **limits):
+        """ A controller starting from the state saved at path, or from the defaults if there's none (or it's old) """
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return cls(**limits)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable congestion state at {path}: {e}")
+            return cls(**limits)
+
+        age_days = (time.time() - state.get("saved_at", 0)) / 86400
+        if age_days > STATE_MAX_AGE_DAYS:
+            logger.info(f"Congestion state at {path} is {age_days:.0f} days old; starting from the defaults")
+            return cls(paused_until=state.get("paused_until", 0.0), **limits)
+        logger.info(f"Starting at {state['rate']:.2f} req/s, {state['concurrency']} in flight (saved {path})")
+        return cls(rate=state["rate"], concurrency=state["concurrency"], paused_until=state.get("paused_until", 0.0),
+                   **limits)
+
+    def save(self, path=STATE_PATH):
+        with self._cond:
+            paused_for = self._paused_until - time.monotonic()
+            state = {
+                "rate": self.rate,
+                "concurrency": self.concurrency,
+                "paused_until": time.time() + paused_for if paused_for > 0 else 0.0,
+                "saved_at": time.time(),
+                "saved": datetime.utcnow().isoformat(timespec="seconds"),
+            }
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def acquire(self):
+        """ Block until a request may go out: a slot in flight is free, and its turn under the rate has come """
+        with self._cond:
+            while self.in_flight >= self.concurrency:
+                self._cond.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            slot = max(now, self._next_at, self._paused_until)
+            self._next_at = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def release(self, signal: str, seconds: float = None, wait: float = None):
+        """
+        Hand back an acquire()d slot, with what became of the request
+        :param signal: one of SIGNALS (see classify)
+        :param seconds: the request's latency, for successful responses
+        :param wait: the response's Retry-After, in seconds
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if signal == OK and seconds is not None and self._slow(seconds):
+                signal = SLOW
+            self.counts[signal] += 1
+            metrics.inc("http_congestion_total", signal=signal)
+
+            if wait:
+                self._pause(wait)
+            if signal == OK:
+                self._healthy += 1
+                if self._healthy >= self.rate:
+                    self._increase()
+            else:
+                self._decrease(signal)
+            self._cond.notify_all()
+
+    def _slow(self, seconds: float) -> bool:
+        self.latency = seconds if self.latency is None else LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * self.latency
+        if self.baseline_latency is None or self.latency < self.baseline_latency:
+            self.baseline_latency = self.latency
+        return self.latency > max(LATENCY_FACTOR * self.baseline_latency, LATENCY_FLOOR)
+
+    def _pause(self, seconds: float):
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            logger.warning(f"Letterboxd asked us to wait {seconds:.0f}s (Retry-After): pausing all requests")
+            self._paused_until = until
+
+    def _increase(self):
+        self._healthy = 0
+        self.rate = min(self.rate + RATE_STEP, self.max_rate)
+        self.concurrency = min(self.concurrency + CONCURRENCY_STEP, self.max_concurrency)
+        self.increases += 1
+        logger.debug(f"Congestion control: up to {self.rate:.2f} req/s, {self.concurrency} in flight")
+
+    def _decrease(self, signal: str):
+        self._healthy = 0
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_HOLD:
+            return
+        self._last_decrease = now
+        self.rate = max(self.rate * DECREASE_FACTOR, self.min_rate)
+        self.concurrency = max(int(self.concurrency * DECREASE_FACTOR), self.min_concurrency)
+        # The next slot is at the new, slower rate
+        self._next_at = max(self._next_at, now + 1.0 / self.rate)
+        self.decreases += 1
+        logger.warning(f"Congestion control ({signal}): down to {self.rate:.2f} req/s, {self.concurrency} in flight")
+
+    def summary(self) -> dict:
+        with self._cond:
+            responses = sum(self.counts.values())
+            congested = responses - self.counts[OK]
+            return {
+                "rate": round(self.rate, 3),
+                "concurrency": self.concurrency,
+                "responses": responses,
+                "congestion_rate": round(congested / responses, 4) if responses else 0.0,
+                "signals": {signal: n for signal, n in self.counts.items() if n},
+                "latency_s": round(self.latency, 3) if self.latency is not None else None,
+                "baseline_latency_s": round(self.baseline_latency, 3) if self.baseline_latency is not None else None,
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
@@ -0,0 +1,76 @@
+"""
+asyncio fetch engine for paginated scrapes.
+
+Page requests still go through the pooled, retrying session in scraping.fetch (so the global politeness budget
+applies to them too), but they are run on a bounded thread pool so several pages can be in flight at once.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from scraping.base import Base
+
+
+logger = logging.getLogger(__name__)
+
+MAX_IN_FLIGHT = 8
+PAGES_IN_FLIGHT_PER_USER = 4
+
+
+class FetchEngine:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, per_user=PAGES_IN_FLIGHT_PER_USER):
+        """
+        :param max_in_flight: page requests allowed in flight across all users
+        :param per_user: page requests allowed in flight for a single paginated scrape
+        """
+        self.max_in_flight = max_in_flight
+        self.per_user = per_user
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="fetch")
+        self._semaphore = None
+
+    async def get_page(self, url: str) -> str:
+        if self._semaphore is None:
+            # Created lazily so that the semaphore binds to the running event loop
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, Base.get_page, url)
+
+    async def paginate(self, url_for_page, parse_page, first_page=1, stop=None) -> list:
+        """
+        Fetch pages first_page, first_page+1, ... in windows of self.per_user concurrent requests until a page
+        parses to no results (or stop(results, page_results) is true), and return the parsed results in page order.
+        :param url_for_page: page number -> url
+        :param parse_page: page HTML -> list of results for that page (see scraping.extract)
+        :param stop: optional predicate on the results accumulated so far and those of the latest page
+        """
+        results = []
+        page_no = first_page
+        while True:
+            window = range(page_no, page_no + self.per_user)
+            pages = await asyncio.gather(*(self.get_page(url_for_page(n)) for n in window))
+            for page in pages:
+                page_results = parse_page(page)
+                if not page_results:
+                    return results
+                results.extend(page_results)
+                if stop is not None and stop(results, page_results):
+                    return results
+            page_no += self.per_user
+
+    async def gather(self, coros) -> list:
+        """ Run several per-user scrapes together; they share this engine's max_in_flight budget """
+        return await asyncio.gather(*coros)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run(coro):
+    """ Convenience wrapper for sync callers """
+    return asyncio.run(coro)
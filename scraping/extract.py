@@ -0,0 +1,211 @@
+"""
+Pluggable extraction layer: raw page HTML -> the tuples/dicts the scraping functions return.
+
+Each extractor has a reference "soup" backend (a full BeautifulSoup tree, registered by the module that owns the
+parsing code) and may have faster ones that only materialize the nodes they need:
+  - "strainer": the same soup code, but parsing only the elements passed via SoupStrainer
+  - "lxml": raw lxml with XPath, no BeautifulSoup objects at all
+Fast backends must return exactly what the soup backend does for the same page.
+"""
+import logging
+import re
+from bs4 import BeautifulSoup, SoupStrainer
+from lxml import html as lxml_html
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("lxml", "strainer", "soup")
+BACKEND = "lxml"
+
+_extractors = {}
+
+
+def set_backend(backend: str):
+    global BACKEND
+    if backend not in BACKENDS:
+        raise Exception(f"Unknown extraction backend '{backend}'")
+    BACKEND = backend
+
+
+def register(name: str, backend: str):
+    """ Decorator registering fn(html, *args) as the given backend of extractor name """
+    def wrap(fn):
+        _extractors.setdefault(name, {})[backend] = fn
+        return fn
+    return wrap
+
+
+def register_soup(name: str, page_fn, parse_only: SoupStrainer = None):
+    """
+    Register page_fn(BeautifulSoup, *args) as the reference "soup" backend of extractor name, and, given a
+    SoupStrainer covering every node page_fn looks at, as its "strainer" backend too.
+    """
+    register(name, "soup")(lambda html, *args: page_fn(BeautifulSoup(html, "lxml"), *args))
+    if parse_only is not None:
+        register(name, "strainer")(lambda html, *args: page_fn(BeautifulSoup(html, "lxml", parse_only=parse_only),
+                                                               *args))
+
+
+def extract(name: str, html: str, *args, backend: str = None):
+    """ Run extractor name over a page's HTML, with the selected backend or the next best one it has """
+    backends = _extractors[name]
+    for candidate in (backend or BACKEND, "soup"):
+        if candidate in backends:
+            with metrics.timer("extract_seconds", extractor=name, backend=candidate):
+                return backends[candidate](html, *args)
+    raise Exception(f"No backend registered for extractor '{name}'")
+
+
+"""  =======================================================================  """
+
+
+def _has_class(cls: str) -> str:
+    """ XPath predicate matching one token of a multi-valued class attribute, like bs4's {"class": [cls]} """
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')"
+
+
+def _tree(html: str):
+    return lxml_html.document_fromstring(html or "<html></html>")
+
+
+@register("films_watched", "lxml")
+def _films_watched_lxml(html: str) -> list:
+    return [(img.attrib['alt'], img.getparent().attrib['data-film-slug'])
+            for img in _tree(html).iterfind(".//img")
+            if "image" in (img.get("class") or "").split()]
+
+
+@register("rated_films", "lxml")
+def _rated_films_lxml(html: str, username: str) -> list:
+    rating_list = []
+    for p in _tree(html).xpath(f"//p[{_has_class('poster-viewingdata')}]"):
+        poster = p.getparent()
+        div = poster.find(".//div")
+        film_id = div.attrib['data-film-id']
+        film_url_pattern = div.attrib['data-film-slug']
+
+        film_title_unreliable = ""
+        img = poster.find(".//img")
+        if img is not None and 'alt' in img.attrib:
+            film_title_unreliable = img.attrib['alt']
+        else:
+            # Same report as the soup backend's p.parent.img['alt'] failing
+            e = KeyError('alt') if img is not None else TypeError("'NoneType' object is not subscriptable")
+            print(f"[Error]: couldn't get film title. {e=}")
+
+        span = p.find(".//span")
+        rating = span.text_content() if span is not None else "NR"
+        rating_list.append((film_title_unreliable, film_id, film_url_pattern, rating, username))
+    return rating_list
+
+
+@register("members", "lxml")
+def _members_lxml(html: str) -> list:
+    tables = _tree(html).xpath(f"//table[{_has_class('person-table')}]")
+    if not tables:
+        return []
+    avatars = tables[0].xpath(".//a[normalize-space(@class)='avatar -a40']")
+    return [a.attrib['href'].replace('/', '') for a in avatars]
+
+
+@register("diary_rows", "lxml")
+def _diary_rows_lxml(html: str) -> list:
+    ret = []
+    month_year = ''
+    for item in _tree(html).xpath(f"//tr[{_has_class('diary-entry-row')}]"):
+        curr = {}
+
+        h3 = item.find(".//h3")
+        curr['movie'] = h3.text_content()
+        curr['movie_id'] = h3.find(".//a").attrib['href'].split('/')[3]
+        curr['rating'] = item.xpath(f".//span[{_has_class('rating')}]")[0].text_content().strip()
+        day = item.xpath(".//td[normalize-space(@class)='td-day diary-day center']")[0].text_content()
+        day = day.replace(' ', '').replace(' ', '')
+
+        calendar = item.xpath(f".//td[{_has_class('td-calendar')}]")[0].text_content()
+        if calendar.replace(' ', '').replace(' ', '') != '':
+            month_year = calendar
+
+        curr['date'] = day.strip() + ' ' + month_year.strip()
+        ret.append(curr)
+    return ret
+
+
+@register("film_metadata", "lxml")
+def _film_metadata_lxml(html: str) -> dict:
+    tree = _tree(html)
+    res = {}
+
+    director = tree.xpath("//span[not(*) and text()='Director']")
+    director_links = director[0].getparent().getparent().findall(".//a") if director else []
+    if director_links:
+        res['director'] = director_links[0].text_content()
+    else:
+        directors = tree.xpath("//span[not(*) and text()='Directors']")
+        if directors:
+            p = directors[0].getparent().getparent().findall(".//p")[0]
+            res['directors'] = [a.text_content() for a in p.iterfind(".//a")]
+
+    rating = tree.xpath("//meta[@name='twitter:data2']/@content")
+    res['rating'] = rating[0] if rating else "None found"
+
+    title = tree.xpath("//meta[@name='twitter:title']/@content")
+    if title:
+        res['year'] = title[0][title[0].find('(') + 1:title[0].find(')')]
+    else:
+        res['year'] = "None found"
+
+    genres = tree.xpath("//div[@id='tab-genres']")
+    if not genres:
+        raise Exception("No movie found")
+    res['genres'] = [a.text_content() for a in genres[0].iterfind(".//a") if a.attrib['href'][7:12] == 'genre']
+    return res
+
+
+@register("film_details", "lxml")
+def _film_details_lxml(html: str) -> dict:
+    tree = _tree(html)
+    details = tree.xpath("//div[@id='tab-details']")
+    if not details:
+        raise Exception("No film details found")
+    res = {'Country': [], 'Studio': [], 'Language': []}
+    for a in details[0].iterfind(".//a"):
+        href = a.attrib['href']
+        if href[1:7] == 'studio':
+            res['Studio'].append(a.text_content())
+        if href[7:14] == 'country':
+            res['Country'].append(a.text_content())
+        if href[7:15] == 'language':
+            res['Language'].append(a.text_content())
+    return res
+
+
+@register("page_count", "lxml")
+def _page_count_lxml(html: str) -> int:
+    texts = (li.text_content().strip() for li in _tree(html).xpath(f"//li[{_has_class('paginate-page')}]"))
+    return max((int(text) for text in texts if text.isdigit()), default=None)
+
+
+def leading_count(text: str) -> int:
+    """ 1234 from "1,234\xa0★★★ ratings (12%)"; 0 for "No ★★ ratings" """
+    match = re.match(r"[\d,]+", text.strip())
+    return int(match.group().replace(",", "")) if match else 0
+
+
+@register("profile_counts", "lxml")
+def _profile_counts_lxml(html: str) -> dict:
+    tree = _tree(html)
+    films = None
+    for h4 in tree.xpath(f"//h4[{_has_class('profile-statistic')}]"):
+        spans = list(h4.iter("span"))
+        if len(spans) >= 2 and spans[1].text_content().strip() == "Films":
+            films = leading_count(spans[0].text_content())
+
+    histogram = []
+    for li in tree.xpath(f"//li[{_has_class('rating-histogram-bar')}]"):
+        a = next(li.iter("a"), None)
+        histogram.append(leading_count(a.get("title") or a.text_content()) if a is not None else 0)
+
+    return {"films": films, "ratings": sum(histogram) if histogram else None, "histogram": histogram or None}
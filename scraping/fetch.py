@@ -0,0 +1,190 @@
+"""
+Shared HTTP fetch layer for all scraping modules.
+
+A single pooled requests.Session is created per process so repeated fetches against letterboxd.com reuse
+keep-alive connections instead of paying a fresh TCP+TLS handshake per page.
+"""
+import logging
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from scraping import congestion
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# From letterboxdpy on Github:
+# This fixes a blocked by cloudflare error i've encountered
+DEFAULT_HEADERS = {
+    "referer": "https://letterboxd.com",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+    "accept-encoding": "gzip, deflate",
+    "connection": "keep-alive",
+}
+
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 20.0
+MAX_RETRIES = 3
+RETRY_BACKOFF_BASE = 1.0
+RETRY_STATUSES = (500, 502, 503, 504)
+POOL_SIZE = 16
+# Global politeness budget shared by every thread/task in the process; 0 disables it
+REQUESTS_PER_SECOND = 0.0
+
+_session = None
+_session_lock = threading.Lock()
+# Optional scraping.cache.ResponseCache consulted by fetch_text()
+_cache = None
+# Optional scraping.congestion.AimdController every request goes through
+_controller = None
+_throttle_lock = threading.Lock()
+_next_request_at = 0.0
+
+
+class FetchError(Exception):
+    """ Raised when a page couldn't be fetched after all retries """
+
+
+def configure(connect_timeout=None, read_timeout=None, max_retries=None, backoff_base=None, pool_size=None):
+    """ Override the module defaults. Changing pool_size resets the shared session. """
+    global CONNECT_TIMEOUT, READ_TIMEOUT, MAX_RETRIES, RETRY_BACKOFF_BASE, POOL_SIZE, _session
+    if connect_timeout is not None:
+        CONNECT_TIMEOUT = connect_timeout
+    if read_timeout is not None:
+        READ_TIMEOUT = read_timeout
+    if max_retries is not None:
+        MAX_RETRIES = max_retries
+    if backoff_base is not None:
+        RETRY_BACKOFF_BASE = backoff_base
+    if pool_size is not None and pool_size != POOL_SIZE:
+        POOL_SIZE = pool_size
+        with _session_lock:
+            if _session is not None:
+                _session.close()
+            _session = None
+
+
+def set_rate_limit(requests_per_second: float):
+    """ Cap the process-wide request rate, e.g. 2.0 for at most one request every 0.5s """
+    global REQUESTS_PER_SECOND
+    REQUESTS_PER_SECOND = requests_per_second
+
+
+def set_controller(controller):
+    """ Pace and cap requests with a scraping.congestion.AimdController, or stop doing so with None """
+    global _controller
+    _controller = controller
+
+
+def get_controller():
+    return _controller
+
+
+def paced() -> bool:
+    """ Whether something (a fixed rate limit or the congestion controller) already spaces out requests """
+    return REQUESTS_PER_SECOND > 0 or _controller is not None
+
+
+def _throttle():
+    """ Block until this caller's slot in the global politeness budget comes up """
+    global _next_request_at
+    if REQUESTS_PER_SECOND <= 0:
+        return
+    with _throttle_lock:
+        now = time.monotonic()
+        slot = max(now, _next_request_at)
+        _next_request_at = slot + 1.0 / REQUESTS_PER_SECOND
+    if slot > now:
+        time.sleep(slot - now)
+
+
+def get_session() -> requests.Session:
+    """ Returns the process-wide pooled session, creating it on first use """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Retries are handled in fetch() so that we can add jitter, so keep the adapter's own retries off
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(DEFAULT_HEADERS)
+                _session = session
+    return _session
+
+
+def _backoff(attempt: int) -> float:
+    """ Exponential backoff with full jitter: somewhere in [base * 2^attempt, 2 * base * 2^attempt) """
+    return RETRY_BACKOFF_BASE * (2 ** attempt) * (1 + random.random())
+
+
+def fetch(url: str, headers: dict = None) -> requests.Response:
+    """
+    GET a url through the shared session.
+    Connection errors, timeouts, 5xx and 429 responses and Cloudflare challenge pages are retried up to MAX_RETRIES
+    times with jittered backoff, waiting at least as long as any Retry-After asks.
+    """
+    session = get_session()
+    url_class = metrics.url_class(url)
+    last_error = None
+    wait = None
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            sleep_time = max(_backoff(attempt - 1), wait or 0.0)
+            logger.warning(f"Retrying {url} in {sleep_time:.1f}s (attempt {attempt}/{MAX_RETRIES}): {last_error}")
+            time.sleep(sleep_time)
+        _throttle()
+        controller = _controller
+        if controller is not None:
+            controller.acquire()
+        signal, seconds, wait = congestion.ERROR, None, None
+        start = time.perf_counter()
+        try:
+            response = session.get(url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            seconds = time.perf_counter() - start
+            signal, wait = congestion.classify(response), congestion.retry_after(response)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.inc("http_errors_total", url_class=url_class, error=type(e).__name__)
+            last_error = e
+            continue
+        finally:
+            if controller is not None:
+                controller.release(signal, seconds, wait)
+        _record_response(url_class, response, seconds)
+
+        if signal == congestion.CHALLENGE:
+            metrics.inc("http_challenges_total", url_class=url_class)
+            last_error = f"Cloudflare challenge (HTTP {response.status_code})"
+            continue
+        if response.status_code == 429 or response.status_code in RETRY_STATUSES:
+            last_error = f"HTTP {response.status_code}"
+            continue
+        return response
+
+    raise FetchError(f"Couldn't fetch {url} after {MAX_RETRIES + 1} attempts: {last_error}")
+
+
+def _record_response(url_class: str, response: requests.Response, seconds: float):
+    # requests doesn't expose DNS/connect timings separately: they're part of the time to headers
+    ttfb = response.elapsed.total_seconds()
+    metrics.observe("http_request_seconds", seconds, url_class=url_class)
+    metrics.observe("http_ttfb_seconds", ttfb, url_class=url_class)
+    metrics.observe("http_body_seconds", max(seconds - ttfb, 0.0), url_class=url_class)
+    metrics.inc("http_requests_total", url_class=url_class, status=response.status_code)
+    metrics.inc("http_response_bytes_total", len(response.content), url_class=url_class)
+
+
+def set_cache(cache):
+    """ Route fetch_text() through a scraping.cache.ResponseCache, or stop doing so with None """
+    global _cache
+    _cache = cache
+
+
+def fetch_text(url: str) -> str:
+    if _cache is not None:
+        return _cache.fetch_text(url, fetch)
+    return fetch(url).text
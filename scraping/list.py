@@ -3,10 +3,14 @@ Adapted from https://github.com/nmcassa/letterboxdpy
 """
 import re
 from json import JSONEncoder
+from scraping import extract, paginate
 from scraping.base import Base
+from scraping.engine import FetchEngine
 
 
 class List(Base):
+    LAZY_ATTRIBUTES = {"description": "load_description", "filmCount": "film_count", "movies": "film_count"}
+
     def __init__(self, author: str, title: str) -> None:
         if not re.match("^[A-Za-z0-9_]*$", author):
             raise Exception("Invalid author")
@@ -15,10 +19,8 @@ class List(Base):
         self.author = author.lower()
         self.url = "https://letterboxd.com/" + self.author +"/list/" + self.title + "/"
 
-        page = self.get_parsed_page(self.url)
-    
-        self.description(page)
-        self.film_count(self.url)
+    def load_description(self):
+        self.list_description(self.get_parsed_page(self.url))
 
     def list_title(self, page: None) -> str:
         data = page.find("meta", attrs={'property': 'og:title'})
@@ -28,31 +30,27 @@ class List(Base):
         data = page.find("span", attrs={'itemprop': 'name'})
         return data.text
 
-    def description(self, page: None) -> str:
+    def list_description(self, page: None) -> str:
         try:
             data = page.find_all("meta", attrs={'property': 'og:description'})
             self.description = data[0]['content']
         except:
-            return None
-
-    def film_count(self, url: str) -> int: #and movie_list!!
-        prev = count = 0
-        curr = 1
-        movie_list = []
-        while prev != curr:
-            count += 1
-            prev = len(movie_list)
-            page = self.get_parsed_page(url + "page/" + str(count) + "/")
-
-            img = page.find_all("img", {"class": ["image"], })
-
-            for item in img:
-                movie_url = item.parent['data-film-slug']
-                movie_list.append((item['alt'], movie_url))
-                
-            curr = len(movie_list)
-
-        self.filmCount = curr
+            self.description = None
+        return self.description
+
+    def film_count(self, url: str = None) -> int: #and movie_list!!
+        url = url or self.url
+        movie_list = paginate.paginate(lambda n: url + "page/" + str(n) + "/",
+                                       lambda page: extract.extract("films_watched", page))
+        self._set_movies(movie_list)
+
+    async def film_count_async(self, url: str, engine: FetchEngine) -> int:
+        movie_list = await engine.paginate(lambda n: url + "page/" + str(n) + "/",
+                                           lambda page: extract.extract("films_watched", page))
+        self._set_movies(movie_list)
+
+    def _set_movies(self, movie_list: list):
+        self.filmCount = len(movie_list)
         self.movies = movie_list
 
         if self.filmCount == 0:
@@ -77,7 +75,7 @@ def list_tags(list: List) -> list:
 
 class Encoder(JSONEncoder):
     def default(self, o):
-        return o.__dict__
+        return {k: v for k, v in o.__dict__.items() if not k.startswith("_")}
 
 
 if __name__ == "__main__":
@@ -1,6 +1,9 @@
 import json
 from typing import List
+from bs4 import SoupStrainer
+from scraping import extract
 from scraping.base import Base
+from scraping.engine import FetchEngine
 
 
 MEMBERS_YEAR_TOP = "https://letterboxd.com/members/popular/this/year/"
@@ -12,9 +15,35 @@ class MemberListing(Base):
         self.listing_base = url
 
 
+def members_page(page) -> List:
+    """ Account names in the popular members table of a single listing page """
+    member_list = []
+    tables = page.find_all('table', {"class": ["person-table"], })
+    if not tables:
+        return member_list
+    popular_members_table = tables[0]
+    avatars = popular_members_table.find_all("a", {"class": ["avatar -a40"], })
+
+    for avatar in avatars:
+        acct_path = avatar['href']
+        acct = acct_path.replace('/', '')
+        member_list.append(acct)
+
+    return member_list
+
+
+extract.register_soup("members", members_page, parse_only=SoupStrainer("table"))
+
+
+def members_page_url(listing_base: str, page_no: int) -> str:
+    if page_no == 1:
+        return listing_base
+    return listing_base + '/page/' + str(page_no) + "/"
+
+
 def top_users(n: int) -> List:
     ml = MemberListing(url=MEMBERS_YEAR_TOP)
-    page = ml.get_parsed_page(ml.listing_base)
+    page = ml.get_page(ml.listing_base)
 
     # returns all movies
     prev = -1
@@ -25,17 +54,18 @@ def top_users(n: int) -> List:
     while prev != curr and curr < n:
         count += 1
         prev = len(member_list)
-        popular_members_table = page.find_all('table', {"class": ["person-table"], })[0]
-        avatars = popular_members_table.find_all("a", {"class": ["avatar -a40"], })
+        member_list.extend(extract.extract("members", page))
+        curr = len(member_list)
+        page = ml.get_page(members_page_url(ml.listing_base, count))
 
-        for avatar in avatars:
-            acct_path = avatar['href']
-            acct = acct_path.replace('/', '')
-            member_list.append(acct)
+    return member_list[:n]
 
-        curr = len(member_list)
-        page = ml.get_parsed_page(ml.listing_base + '/page/' + str(count) + "/")
 
+async def top_users_async(n: int, engine: FetchEngine) -> List:
+    ml = MemberListing(url=MEMBERS_YEAR_TOP)
+    member_list = await engine.paginate(lambda count: members_page_url(ml.listing_base, count),
+                                        lambda page: extract.extract("members", page),
+                                        stop=lambda members, _: len(members) >= n)
     return member_list[:n]
 
 
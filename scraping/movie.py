@@ -2,13 +2,16 @@
 Adapted from https://github.com/nmcassa/letterboxdpy
 """
 import json
-import requests
 from bs4 import BeautifulSoup
 from json import JSONEncoder
 from scraping.base import Base
+from scraping import extract, fetch
+from utils import metrics
 
 
 class Movie(Base):
+    LAZY_ATTRIBUTES = {field: "load_metadata" for field in ("director", "directors", "rating", "year", "genres")}
+
     def __init__(self, title: str, year: str = '') -> None:
 
         if title[0] == "/":
@@ -19,15 +22,22 @@ class Movie(Base):
             self.title = title.replace(' ', '-').lower()
             self.url = "https://letterboxd.com/film/" + self.title + "/"
 
-        page = self.get_parsed_page(self.url)
+    def load_metadata(self):
+        """ Set director(s), rating, year and genres from the film page """
+        self.__dict__.update(extract.extract("film_metadata", self.movie_page()))
 
-        if not self.check_year(year, page):
-            year = ''
-        
-        self.movie_director(page)
-        self.movie_rating(page)
-        self.movie_year(page)
-        self.movie_genre(page)
+    def movie_page(self, subpage: str = '') -> str:
+        """ HTML of the film's page (or e.g. its "details/" subpage), fetched at most once per Movie """
+        url = self.url + subpage
+        pages = self.__dict__.setdefault("_pages", {})
+        if url not in pages:
+            pages[url] = self.get_page(url)
+        return pages[url]
+
+    def parsed_movie_page(self, subpage: str = '') -> BeautifulSoup:
+        page = self.movie_page(subpage)
+        with metrics.timer("extract_seconds", extractor="parsed_page", backend="soup"):
+            return BeautifulSoup(page, "lxml")
 
     def movie_director(self, page: None) -> str or list:
         try:
@@ -87,13 +97,26 @@ class Movie(Base):
         self.genres = res
 
 
+def film_metadata_page(page: BeautifulSoup) -> dict:
+    """ The attributes Movie.__init__ sets from a film page: director(s), rating, year, genres """
+    movie = Movie.__new__(Movie)
+    movie.movie_director(page)
+    movie.movie_rating(page)
+    movie.movie_year(page)
+    movie.movie_genre(page)
+    return dict(movie.__dict__)
+
+
+extract.register_soup("film_metadata", film_metadata_page)
+
+
 def movie_popular_reviews(movie: Movie) -> dict:
     if type(movie) != Movie:
         raise Exception("Improper parameter")
 
     ret = []
 
-    page = movie.get_parsed_page(movie.url)
+    page = movie.parsed_movie_page()
 
     data = page.find("ul", {"class": ["film-popular-review"], })
     data = data.find_all("div", {"class": ["film-detail-content"], })
@@ -125,14 +148,19 @@ def movie_details(movie: Movie) -> dict:
     if type(movie) != Movie:
         raise Exception("Improper parameter")
 
-    page = movie.get_parsed_page(movie.url + "details/")
+    return extract.extract("film_details", movie.movie_page("details/"))
+
 
+def film_details_page(page: BeautifulSoup) -> dict:
+    """ Studios, countries and languages from a film's details/ page """
     res = {}
     studio = []
     country = []
     language = []
 
     div = page.find("div", {"id": ["tab-details"], })
+    if div is None:
+        raise Exception("No film details found")
     a = div.find_all("a")
 
     for item in a:
@@ -150,11 +178,14 @@ def movie_details(movie: Movie) -> dict:
     return res
 
 
+extract.register_soup("film_details", film_details_page)
+
+
 def movie_description(movie: Movie) -> str:
     if type(movie) != Movie:
         raise Exception("Improper parameter")
         
-    page = movie.get_parsed_page(movie.url)
+    page = movie.parsed_movie_page()
 
     try:
         data = page.find_all("meta", attrs={'name':'twitter:description'})
@@ -166,8 +197,7 @@ def movie_description(movie: Movie) -> str:
 def movie_poster(movie_id):
     '''Returns the poster link of a movie'''
     try:
-        page = requests.get("https://letterboxd.com/film/" + movie_id + "/", timeout=5)
-        page = BeautifulSoup(page.text, 'lxml')
+        page = BeautifulSoup(fetch.fetch_text("https://letterboxd.com/film/" + movie_id + "/"), 'lxml')
 
         script_w_data = page.select_one('script[type="application/ld+json"]')
         link = json.loads(script_w_data.text.split(
@@ -182,7 +212,7 @@ def movie_poster(movie_id):
 
 class Encoder(JSONEncoder):
     def default(self, o):
-        return o.__dict__
+        return {k: v for k, v in o.__dict__.items() if not k.startswith("_")}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+"""
+Concurrent fan-out over Letterboxd's paged listings (films grids, diaries, lists).
+
+Listings with a numbered paginator show it on every page, so the first page fetched tells us the last page number.
+The remaining pages are then fetched on a bounded thread pool and handed back in page order, instead of being probed
+one at a time until an empty page comes back (which also cost a wasted request per listing). Single-page listings
+have no paginator, and neither do those paged only by next/previous links (e.g. follows): for those, a non-empty
+first page is followed by probing the next pages one at a time until an empty one.
+"""
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from bs4 import BeautifulSoup, SoupStrainer
+from scraping import extract
+from scraping.base import Base
+
+
+logger = logging.getLogger(__name__)
+
+PAGINATE_WORKERS = 4
+# Pages fetched ahead of the consumer, per worker
+WINDOW_PER_WORKER = 2
+
+
+def page_count_page(page: BeautifulSoup) -> int:
+    """ Highest page number in a listing page's paginator; None if it has none """
+    numbers = [int(text) for text in (li.get_text().strip() for li in page.find_all("li", {"class": ["paginate-page"]}))
+               if text.isdigit()]
+    return max(numbers, default=None)
+
+
+extract.register_soup("page_count", page_count_page, parse_only=SoupStrainer("li"))
+
+
+def iter_pages(url_for_page, parse_page, first_page=1, workers=PAGINATE_WORKERS, max_pages=None):
+    """
+    Yields (page number, parse_page(page HTML)) for pages first_page..N of a listing, in order
+    :param url_for_page: page number -> url
+    :param parse_page: page HTML -> that page's results (see scraping.extract)
+    :param max_pages: stop after this many pages, however long the listing is
+    """
+    page = Base.get_page(url_for_page(first_page))
+    last_page = extract.extract("page_count", page)
+    stop = first_page + max_pages - 1 if max_pages else None
+    results = parse_page(page)
+    yield first_page, results
+    if last_page is None:
+        if results:
+            yield from _probe_pages(url_for_page, parse_page, first_page + 1, stop)
+        return
+    if stop:
+        last_page = min(last_page, stop)
+    if last_page <= first_page:
+        return
+
+    def fetch_page(page_no):
+        return page_no, parse_page(Base.get_page(url_for_page(page_no)))
+
+    pages = iter(range(first_page + 1, last_page + 1))
+    pool = ThreadPoolExecutor(max_workers=min(workers, last_page - first_page), thread_name_prefix="paginate")
+    try:
+        # Pages are handed back in order, with at most a window of later ones in flight or waiting to be read, so a
+        # long listing doesn't queue up (or hold in memory) all of its pages at once
+        window = deque(pool.submit(fetch_page, page_no) for page_no in islice(pages, workers * WINDOW_PER_WORKER))
+        while window:
+            yield window.popleft().result()
+            page_no = next(pages, None)
+            if page_no is not None:
+                window.append(pool.submit(fetch_page, page_no))
+    finally:
+        # A consumer that stops early (or fails) shouldn't wait on the pages it won't read
+        pool.shutdown(cancel_futures=True)
+
+
+def _probe_pages(url_for_page, parse_page, page_no: int, stop: int = None):
+    """ Yields (page number, results) from page_no on, one page at a time, up to the first empty page (or stop) """
+    while stop is None or page_no <= stop:
+        results = parse_page(Base.get_page(url_for_page(page_no)))
+        if not results:
+            return
+        yield page_no, results
+        page_no += 1
+
+
+def paginate(url_for_page, parse_page, workers=PAGINATE_WORKERS, max_pages=None) -> list:
+    """ Every page's results of a listing (or its first max_pages), concatenated in page order """
+    results = []
+    for _, page_results in iter_pages(url_for_page, parse_page, workers=workers, max_pages=max_pages):
+        results.extend(page_results)
+    return results
@@ -1,38 +1,51 @@
 from datetime import datetime
 import hashlib
 import logging
+from utils import metrics
 
 
 logger = logging.getLogger(__name__)
 
 class DbObject:
+    # Subclasses list their fields in __slots__, so there's no per-object __dict__
+    __slots__ = ()
+
     def __repr__(self):
-        return str(self.__dict__.items())
+        return str([(name, getattr(self, name)) for name in self.__slots__])
 
     def __str__(self):
-        return str(self.__dict__.values())
+        return str([getattr(self, name) for name in self.__slots__])
+
+
+def rating_id(film_id, username) -> int:
+    """ Stable ID for a user/film_id combo, so re-scrapes of the same rating map onto the same row """
+    # The first 15 hex digits of the MD5, i.e. the top 60 bits of its first 8 bytes
+    return int.from_bytes(hashlib.md5(f"{film_id}{username}".encode()).digest()[:8], "big") >> 4
 
 
 class RatingObject(DbObject):
     """ A class for structuring film ratings data. """
-    def __init__(self, film_title, film_url, film_id, film_rating, username):
+    __slots__ = ("last_updated", "film_title", "film_url", "film_id", "film_rating", "user", "id")
+
+    def __init__(self, film_title, film_url, film_id, film_rating, username, last_updated=None):
         # Database ID entries will be unique to a user/film_id combo.
         # **This implies we only count a single rating of a film by a user **
 
-        self.last_updated: int = int(datetime.utcnow().timestamp())
+        if last_updated is None:
+            last_updated = int(datetime.utcnow().timestamp())
+        self.last_updated: int = last_updated
         self.film_title: str = film_title
         self.film_url: str = film_url
         self.film_id: int = int(film_id)
         self.film_rating: float = film_rating
         self.user: int = username
-        self.id: int = int(hashlib.md5(
-                                  bytes(film_id, "UTF-8") + bytes(username, "UTF-8") + bytes(str(self.last_updated),
-                                                                                         "UTF-8")
-                                 ).hexdigest()[:15], 16)
+        self.id: int = rating_id(film_id, username)
 
 
 class ScrapedUserObject(DbObject):
     """ A class for structuring scrapes of Letterboxd users """
+    __slots__ = ("user", "last_updated", "id")
+
     def __init__(self, username):
         self.user: str = username
         # Initialize the member at 0 since they haven't been scraped yet
@@ -56,8 +69,14 @@ class Scraper:
         logger.debug(f"Executing function {self.scraping_function}")
         self._results = self.scraping_function(*self._args, **self._kwargs)
 
+    async def scrape_async(self):
+        """ Same as scrape(), for the *_async scraping functions that run on a FetchEngine """
+        logger.debug(f"Awaiting function {self.scraping_function}")
+        self._results = await self.scraping_function(*self._args, **self._kwargs)
+
 
 class UsersScraper(Scraper):
+    @metrics.timed("structure_seconds", kind="users")
     def structure_results(self):
         """
         Fit the user list into ScrapedUserObjects
@@ -67,10 +86,12 @@ class UsersScraper(Scraper):
         logger.debug(f"Prettifying top users results")
         for user in self._results:
             self.results.append(ScrapedUserObject(user))
+        metrics.inc("structure_rows_total", len(self.results), kind="users")
         return self.results
 
 
 class RatingScraper(Scraper):
+    @metrics.timed("structure_seconds", kind="ratings")
     def structure_results(self):
         """
         Take unstructured results self._results (from self.scraping_function), add RatingObject structuring
@@ -83,19 +104,67 @@ class RatingScraper(Scraper):
             logger.error(f"Problem with scraped ratings: {self._results=}")
         else:
             logger.debug(f"Structuring scraped ratings for '{self._args}', likely user '{self._results[0][4]}'")
-            for rating in self._results:
-                # Example entry in _results: (film_title_unreliable, film_id, film_url_pattern, rating, user )
-                rating_val = RatingScraper.translate_stars(rating[3])
-                # print(f"{rating} --------> {rating_val}")
-                ro = RatingObject(
-                    film_title=rating[0],
-                    film_id=rating[1],
-                    film_url=rating[2],
-                    film_rating=rating_val,
-                    username=rating[4])
-                self.results.append(ro)
+            last_updated = int(datetime.utcnow().timestamp())
+            self.results = [RatingScraper.structure_rating(rating, last_updated) for rating in self._results]
+        metrics.inc("structure_rows_total", len(self.results), kind="ratings")
         return self.results
 
+    @metrics.timed("structure_seconds", kind="rows")
+    def structure_rows(self) -> list:
+        """ structure_results(), as rows for ParsingStorage.insert_rating_rows rather than RatingObjects """
+        if self._results and len(self._results[0]) != 5:
+            logger.error(f"Problem with scraped ratings: {self._results=}")
+            return []
+        rows = RatingScraper.rating_rows(self._results or [])
+        metrics.inc("structure_rows_total", len(rows), kind="rows")
+        return rows
+
+    def stream(self):
+        """
+        scrape() + structure_rows() for streaming scraping functions (like user.iter_user_films_rated) that
+        yield (page number, page results): yields (page number, page of rows), never holding more than one page,
+        so each can be stored as it arrives.
+        """
+        logger.debug(f"Streaming function {self.scraping_function}")
+        for page_no, page_results in self.scraping_function(*self._args, **self._kwargs):
+            with metrics.timer("structure_seconds", kind="stream"):
+                page = RatingScraper.rating_rows(page_results)
+            metrics.inc("structure_rows_total", len(page), kind="stream")
+            yield page_no, page
+
+    @staticmethod
+    def structure_rating(rating, last_updated=None) -> RatingObject:
+        # Example rating: (film_title_unreliable, film_id, film_url_pattern, rating, user )
+        rating_val = STAR_VALUES.get(rating[3], MISSING)
+        if rating_val is MISSING:
+            rating_val = RatingScraper.translate_stars(rating[3])
+        return RatingObject(
+            film_title=rating[0],
+            film_id=rating[1],
+            film_url=rating[2],
+            film_rating=rating_val,
+            username=rating[4],
+            last_updated=last_updated)
+
+    @staticmethod
+    def rating_rows(ratings, last_updated=None) -> list:
+        """
+        Scraped (title, film_id, slug, rating, username) tuples -> (id, user, film_title, film_url, film_id,
+        film_rating, last_updated) rows, the column order of ParsingStorage.insert_rating_rows, without an object
+        per rating: one timestamp for the whole batch, and star strings looked up in STAR_VALUES
+        """
+        if last_updated is None:
+            last_updated = int(datetime.utcnow().timestamp())
+        stars_value = STAR_VALUES.get
+        rows = []
+        append = rows.append
+        for title, film_id, film_url, stars, username in ratings:
+            rating_val = stars_value(stars, MISSING)
+            if rating_val is MISSING:
+                rating_val = RatingScraper.translate_stars(stars)
+            append((rating_id(film_id, username), username, title, film_url, int(film_id), rating_val, last_updated))
+        return rows
+
     @staticmethod
     def translate_stars(rating):
         rating_val = 0
@@ -113,3 +182,9 @@ class RatingScraper(Scraper):
             rating_val = None
 
         return rating_val
+
+
+MISSING = object()
+# translate_stars of every rating string a films grid shows, so structuring a rating is one dict lookup
+STAR_VALUES = {stars: RatingScraper.translate_stars(stars)
+               for stars in ["", "NR"] + ["★" * n + half for n in range(6) for half in ("", "½")][1:-1]}
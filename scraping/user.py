@@ -1,22 +1,31 @@
 import json
 import re
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from bs4 import BeautifulSoup, SoupStrainer
+from scraping import extract, paginate
 from scraping.base import Base
+from scraping.engine import FetchEngine
+from scraping.scraper import RatingScraper
 
 
 class User(Base):
+    LAZY_ATTRIBUTES = {"favorites": "load_profile", "stats": "load_profile", "watchlist_length": "user_watchlist"}
+
     def __init__(self, username: str, scrape_basic_user_stats=False) -> None:
+        """
+        :param scrape_basic_user_stats: no longer needed: favorites, stats and watchlist_length are fetched on first
+            access (or with resolve()/base.prefetch)
+        """
         if not re.match("^[A-Za-z0-9_]*$", username):
             raise Exception("Invalid username")
 
         self.username = username.lower()
 
-        if scrape_basic_user_stats:
-            page = self.get_parsed_page("https://letterboxd.com/" + self.username + "/")
-
-            self.user_watchlist()
-            self.user_favorites(page)
-            self.user_stats(page)
+    def load_profile(self):
+        """ Set favorites and stats from the profile page """
+        page = self.get_parsed_page("https://letterboxd.com/" + self.username + "/")
+        self.user_favorites(page)
+        self.user_stats(page)
 
     def user_favorites(self, page: BeautifulSoup) -> list:
         data = page.find("section", {"id": ["favourites"], }).findChildren("div")
@@ -60,117 +69,238 @@ class User(Base):
         return ret
 
 
+def films_page_url(username: str, page_no: int) -> str:
+    return "https://letterboxd.com/" + username + "/films/page/" + str(page_no) + "/"
+
+
+def films_by_date_page_url(username: str, page_no: int) -> str:
+    """ The same grid as films_page_url, sorted by when the film was logged, newest first """
+    return "https://letterboxd.com/" + username + "/films/by/date/page/" + str(page_no) + "/"
+
+
+def diary_page_url(username: str, page_no: int) -> str:
+    return "https://letterboxd.com/" + username + "/films/diary/page/" + str(page_no) + "/"
+
+
+def films_watched_page(page: BeautifulSoup) -> list:
+    """ (title, slug) for every poster on a single /films/ (or list) page """
+    movie_list = []
+    img = page.find_all("img", {"class": ["image"], })
+
+    for item in img:
+        movie_url = item.parent['data-film-slug']
+        movie_list.append((item['alt'], movie_url))
+
+    return movie_list
+
+
+def films_rated_page(page: BeautifulSoup, username: str) -> list:
+    """ (title, film_id, slug, rating, username) for every poster on a single /films/ page """
+    rating_list = []
+    ps = page.find_all("p", {"class": ["poster-viewingdata"], })
+    for p in ps:
+        film_id = p.parent.div['data-film-id']
+        film_url_pattern = p.parent.div['data-film-slug']
+        rating = "NR"
+        film_title_unreliable = ""
+        try:
+            film_title_unreliable = p.parent.img['alt']
+        except Exception as e:
+            print(f"[Error]: couldn't get film title. {e=}")
+
+        try:
+            spans = p.find_all('span')
+            if spans:
+                rating = spans[0].text
+        except Exception as e:
+            print(f"[Error]: couldn't get film rating. {e=}")
+        finally:
+            rating_list.append( (film_title_unreliable, film_id, film_url_pattern, rating, username ) )
+
+    return rating_list
+
+
+# Both grids only look inside each poster's <li>
+extract.register_soup("films_watched", films_watched_page, parse_only=SoupStrainer("li"))
+extract.register_soup("rated_films", films_rated_page, parse_only=SoupStrainer("li"))
+
+
 def user_films_watched(user: User) -> list:
     if type(user) != User:
         raise Exception("Improper parameter")
 
     #returns all movies
-    prev = count = 0
-    curr = 1
-    movie_list = []
-
-    while prev != curr:
-        count += 1
-        prev = len(movie_list)
-        page = user.get_parsed_page("https://letterboxd.com/" + user.username + "/films/page/" + str(count) + "/")
+    return paginate.paginate(lambda n: films_page_url(user.username, n),
+                             lambda page: extract.extract("films_watched", page))
 
-        img = page.find_all("img", {"class": ["image"], })
 
-        for item in img:
-            movie_url = item.parent['data-film-slug']
-            movie_list.append((item['alt'], movie_url))
+async def user_films_watched_async(user: User, engine: FetchEngine) -> list:
+    if type(user) != User:
+        raise Exception("Improper parameter")
 
-        curr = len(movie_list)
-            
-    return movie_list
+    return await engine.paginate(lambda n: films_page_url(user.username, n),
+                                 lambda page: extract.extract("films_watched", page))
 
 
 def user_films_rated(user: User) -> list:
+    rating_list = []
+    for _, page_ratings in iter_user_films_rated(user):
+        rating_list.extend(page_ratings)
+    return rating_list
+
+
+def iter_user_films_rated(user: User, first_page=1):
+    """
+    Streaming form of user_films_rated: yields (page number, that page's ratings) in page order, starting at
+    first_page (e.g. to resume an interrupted scrape), so callers can store each page as it comes in.
+    Later pages are fetched concurrently (see scraping.paginate) while earlier ones are being stored.
+    """
+    if type(user) != User:
+        raise Exception("Improper parameter")
+
+    for page_no, page_ratings in paginate.iter_pages(lambda n: films_page_url(user.username, n),
+                                                     lambda page: extract.extract("rated_films", page, user.username),
+                                                     first_page=first_page):
+        if page_ratings:
+            yield page_no, page_ratings
+
+
+async def user_films_rated_async(user: User, engine: FetchEngine) -> list:
+    if type(user) != User:
+        raise Exception("Improper parameter")
+
+    return await engine.paginate(lambda n: films_page_url(user.username, n),
+                                 lambda page: extract.extract("rated_films", page, user.username))
+
+
+def page_already_known(page_ratings: list, known: dict) -> bool:
+    """ True if every (film_id, rating) on the page is already stored, unchanged, in known {film_id: rating} """
+    for rating in page_ratings:
+        film_id = int(rating[1])
+        if film_id not in known or known[film_id] != RatingScraper.translate_stars(rating[3]):
+            return False
+    return True
+
+
+def user_films_rated_delta(user: User, known: dict) -> list:
+    """
+    Incremental form of user_films_rated: walks the user's films newest-first and stops after the first page
+    that holds nothing new or changed relative to known {film_id: film_rating}.
+    Edits to ratings of older films are not seen, so callers should still do a periodic full user_films_rated.
+    """
     if type(user) != User:
         raise Exception("Improper parameter")
 
-    prev = count = 0
-    curr = -1
+    count = 0
     rating_list = []
 
-    while prev != curr:
+    while True:
         count += 1
-        prev = len(rating_list)
-        page = user.get_parsed_page("https://letterboxd.com/" + user.username + "/films/page/" + str(count) + "/")
-
-        ps = page.find_all("p", {"class": ["poster-viewingdata"], })
-        for p in ps:
-            film_id = p.parent.div['data-film-id']
-            film_url_pattern = p.parent.div['data-film-slug']
-            rating = "NR"
-            film_title_unreliable = ""
-            try:
-                film_title_unreliable = p.parent.img['alt']
-            except Exception as e:
-                print(f"[Error]: couldn't get film title. {e=}")
-
-            try:
-                spans = p.find_all('span')
-                if spans:
-                    rating = spans[0].text
-            except Exception as e:
-                print(f"[Error]: couldn't get film rating. {e=}")
-            finally:
-                rating_list.append( (film_title_unreliable, film_id, film_url_pattern, rating, user.username ) )
-
-        curr = len(rating_list)
+        page = user.get_page(films_by_date_page_url(user.username, count))
+        page_ratings = extract.extract("rated_films", page, user.username)
+        rating_list.extend(page_ratings)
+        if not page_ratings or page_already_known(page_ratings, known):
+            break
 
     return rating_list
 
 
-def user_following(user: User) -> list:
+async def user_films_rated_delta_async(user: User, known: dict, engine: FetchEngine) -> list:
     if type(user) != User:
         raise Exception("Improper parameter")
 
-    # returns the first page of following
-    page = user.get_parsed_page("https://letterboxd.com/" + user.username + "/following/")
-    data = page.find_all("img", attrs={'height': '40'})
+    return await engine.paginate(lambda n: films_by_date_page_url(user.username, n),
+                                 lambda page: extract.extract("rated_films", page, user.username),
+                                 stop=lambda _, page_ratings: page_already_known(page_ratings, known))
 
-    ret = []
 
-    for person in data:
-        ret.append(person['alt'])
+def follows_page_url(username: str, direction: str, page_no: int) -> str:
+    """ :param direction: "following" or "followers" """
+    return "https://letterboxd.com/" + username + "/" + direction + "/page/" + str(page_no) + "/"
 
-    return ret
 
+def user_following(user: User, max_pages=None) -> list:
+    """ Usernames of everyone the user follows (from the first max_pages pages, if given) """
+    if type(user) != User:
+        raise Exception("Improper parameter")
+
+    # Same person-table markup as the members listings. Follows pages only link to the next/previous page, with no
+    # numbered paginator, so paginate reads them one at a time until an empty page
+    return paginate.paginate(lambda n: follows_page_url(user.username, "following", n),
+                             lambda page: extract.extract("members", page), max_pages=max_pages)
 
-def user_followers(user: User) -> list:
+
+def user_followers(user: User, max_pages=None) -> list:
+    """ Usernames of everyone following the user (from the first max_pages pages, if given) """
     if type(user) != User:
         raise Exception("Improper parameter")
 
-    #returns the first page of followers
-    page = user.get_parsed_page("https://letterboxd.com/" + user.username + "/followers/")
-    data = page.find_all("img", attrs={'height': '40'})
+    return paginate.paginate(lambda n: follows_page_url(user.username, "followers", n),
+                             lambda page: extract.extract("members", page), max_pages=max_pages)
 
-    ret = []
 
-    for person in data:
-        ret.append(person['alt'])
+def profile_counts_page(page: BeautifulSoup) -> dict:
+    """
+    The profile page's film counter and ratings histogram (ratings per half star, ½ first):
+    {"films": int or None, "ratings": int or None, "histogram": [10 ints] or None}
+    """
+    films = None
+    for h4 in page.find_all("h4", {"class": ["profile-statistic"], }):
+        spans = h4.find_all("span")
+        if len(spans) >= 2 and spans[1].text.strip() == "Films":
+            films = extract.leading_count(spans[0].text)
 
-    return ret
+    histogram = []
+    for li in page.find_all("li", {"class": ["rating-histogram-bar"], }):
+        # Empty buckets have no link
+        a = li.find("a")
+        histogram.append(extract.leading_count(a.get("title") or a.text) if a else 0)
 
+    return {"films": films, "ratings": sum(histogram) if histogram else None, "histogram": histogram or None}
 
-def user_genre_info(user: User) -> dict:
+
+extract.register_soup("profile_counts", profile_counts_page, parse_only=SoupStrainer(["h4", "li"]))
+
+
+def user_profile_counts(user: User) -> dict:
+    """ profile_counts_page for the user, in one request (see utils.precheck) """
     if type(user) != User:
         raise Exception("Improper parameter")
 
-    genres = ["action", "adventure", "animation", "comedy", "crime", "documentary",
-              "drama", "family", "fantasy", "history", "horror", "music", "mystery",
-              "romance", "science-fiction", "thriller", "tv-movie", "war", "western"]
-    ret = {}
-    for genre in genres:
-        page = user.get_parsed_page("https://letterboxd.com/" + user.username +
-                                    "/films/genre/" + genre + "/")
-        data = page.find("span", {"class": ["replace-if-you"], })
-        data = data.next_sibling
-        ret[genre] = [int(s) for s in data.split() if s.isdigit()][0]
-        
-    return ret
+    return extract.extract("profile_counts", user.get_page("https://letterboxd.com/" + user.username + "/"))
+
+
+# Genre page slugs -> genre names as film pages list them
+GENRES = {
+    "action": "Action", "adventure": "Adventure", "animation": "Animation", "comedy": "Comedy", "crime": "Crime",
+    "documentary": "Documentary", "drama": "Drama", "family": "Family", "fantasy": "Fantasy", "history": "History",
+    "horror": "Horror", "music": "Music", "mystery": "Mystery", "romance": "Romance",
+    "science-fiction": "Science Fiction", "thriller": "Thriller", "tv-movie": "TV Movie", "war": "War",
+    "western": "Western",
+}
+GENRE_WORKERS = 4
+
+
+def user_genre_count(user: User, genre: str) -> int:
+    """ Films the user has watched in a genre, read off their genre page """
+    page = user.get_parsed_page("https://letterboxd.com/" + user.username +
+                                "/films/genre/" + genre + "/")
+    data = page.find("span", {"class": ["replace-if-you"], })
+    data = data.next_sibling
+    return [int(s) for s in data.split() if s.isdigit()][0]
+
+
+def user_genre_info(user: User, workers=GENRE_WORKERS) -> dict:
+    """
+    {genre slug: films watched} from the user's genre pages, fetched concurrently. One request per genre: prefer
+    suggest.taste, which works them out from stored ratings and film metadata
+    """
+    if type(user) != User:
+        raise Exception("Improper parameter")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="genres") as pool:
+        counts = pool.map(lambda genre: user_genre_count(user, genre), GENRES)
+        return dict(zip(GENRES, counts))
 
 
 #gives reviews that the user selected has made
@@ -196,14 +326,8 @@ def user_reviews(user: User) -> list:
     return ret
 
 
-def user_diary_page(user: User, page) -> list:
-    '''Returns the user's diary for a specific page'''
-
-    if type(user) != User:
-        raise Exception("Improper parameter")
-
-    page = user.get_parsed_page(
-        "https://letterboxd.com/" + user.username + "/films/diary/page/"+str(page)+"/")
+def diary_rows_page(page: BeautifulSoup) -> list:
+    '''Diary entries on a single diary page'''
     ret = []
 
     data = page.find_all("tr", {"class": ["diary-entry-row"], })
@@ -233,26 +357,27 @@ def user_diary_page(user: User, page) -> list:
     return ret
 
 
-def user_diary(user: User) -> list:
-    """Returns a list of dictionaries with the user's diary"""
+extract.register_soup("diary_rows", diary_rows_page, parse_only=SoupStrainer("tr"))
+
 
-    page = user.get_parsed_page("https://letterboxd.com/" + user.username + "/films/diary/")
+def user_diary_page(user: User, page) -> list:
+    '''Returns the user's diary for a specific page'''
 
-    # Get the max number of pages
-    try:
-        max_page = page.findAll("li", {"class": ["paginate-page"], })[-1].text
-        print(max_page)
-        ret = []
+    if type(user) != User:
+        raise Exception("Improper parameter")
 
-        for i in range(1, int(max_page)+1):
-            page_result = user_diary_page(user, i)
-            ret.extend(page_result)
+    page = user.get_page(diary_page_url(user.username, page))
+    return extract.extract("diary_rows", page)
 
-    except IndexError:
-        print('No diary found')
-        ret =[]
 
-    return ret
+def user_diary(user: User) -> list:
+    """Returns a list of dictionaries with the user's diary"""
+
+    if type(user) != User:
+        raise Exception("Improper parameter")
+
+    return paginate.paginate(lambda n: diary_page_url(user.username, n),
+                             lambda page: extract.extract("diary_rows", page))
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+from suggest.ratings import RatingMatrix
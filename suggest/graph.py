@@ -0,0 +1,166 @@
+"""
+Follow-graph suggestions.
+
+The follows table (see utils.crawler) is loaded once into a sparse user x user adjacency matrix; each signal for a
+user is then a sparse matrix-vector product or two over the whole graph:
+  friends of friends: number of people the user follows who follow each candidate (paths of length 2)
+  shared followers:   number of people following both the user and each candidate
+  personalized PageRank: probability a random walk along follows, restarting at the user, ends at each candidate
+GraphSuggester blends these with rating similarity from a RatingMatrix.
+"""
+import logging
+import weakref
+import numpy as np
+from scipy import sparse
+from suggest.ratings import MIN_OVERLAP
+
+
+logger = logging.getLogger(__name__)
+
+PAGERANK_RESTART = 0.15
+PAGERANK_ITERATIONS = 30
+PAGERANK_TOLERANCE = 1e-4
+
+# Each signal is scaled to [0, 1] over the candidates before blending
+WEIGHTS = {"friends_of_friends": 0.3, "shared_followers": 0.2, "pagerank": 0.2, "rating_similarity": 0.3}
+
+
+class FollowGraph:
+    def __init__(self, users, follows: sparse.csr_matrix):
+        """
+        :param users: usernames, one per row and column of follows
+        :param follows: users x users, 1 where the row's user follows the column's
+        """
+        self.users = list(users)
+        self.user_index = {u: i for i, u in enumerate(self.users)}
+        self.follows = sparse.csr_matrix(follows, dtype=np.float32)
+        self.follows.sum_duplicates()
+        self.follows.data[:] = 1
+        self.followed_by = self.follows.T.tocsr()
+
+        # Random-walk transitions, transposed so that one step of the walk is a single csr product
+        out_degree = np.asarray(self.follows.sum(axis=1)).ravel()
+        inverse = np.divide(1.0, out_degree, out=np.zeros_like(out_degree), where=out_degree > 0)
+        self.transitions_t = (sparse.diags(inverse) @ self.follows).T.tocsr()
+        self.dangling = out_degree == 0
+        # Per RatingMatrix, dropped along with the matrix: {matrix: (its user count, rows)}
+        self._rating_rows = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def from_db(cls, db, chunk_size=100_000):
+        """ Load every edge in a ParsingStorage's follows table """
+        followers, followees = [], []
+        for rows in db.iter_follows(chunk_size):
+            chunk_followers, chunk_followees = zip(*rows)
+            followers.append(np.array(chunk_followers, dtype=object))
+            followees.append(np.array(chunk_followees, dtype=object))
+
+        if not followers:
+            return cls([], sparse.csr_matrix((0, 0), dtype=np.float32))
+
+        followers, followees = np.concatenate(followers), np.concatenate(followees)
+        users, codes = np.unique(np.concatenate([followers, followees]), return_inverse=True)
+        n = len(followers)
+        follows = sparse.csr_matrix((np.ones(n, dtype=np.float32), (codes[:n], codes[n:])),
+                                    shape=(len(users), len(users)))
+        logger.info(f"Loaded {follows.nnz} follow edges between {len(users)} users")
+        return cls(users, follows)
+
+    def _index(self, username: str) -> int:
+        if username not in self.user_index:
+            raise Exception(f"No follow edges stored for user '{username}'")
+        return self.user_index[username]
+
+    def friends_of_friends(self, username: str) -> np.ndarray:
+        """ For every user, how many of the people username follows follow them """
+        return self.followed_by @ self.follows[self._index(username)].toarray().ravel()
+
+    def shared_followers(self, username: str) -> np.ndarray:
+        """ For every user, how many people follow both them and username """
+        return self.followed_by @ self.followed_by[self._index(username)].toarray().ravel()
+
+    def pagerank(self, username: str, restart=PAGERANK_RESTART, iterations=PAGERANK_ITERATIONS,
+                 tolerance=PAGERANK_TOLERANCE) -> np.ndarray:
+        """ Personalized PageRank of every user, restarting at username; walks from users who follow nobody restart """
+        seed = np.zeros(len(self.users), dtype=np.float32)
+        seed[self._index(username)] = 1.0
+        rank = seed.copy()
+        for _ in range(iterations):
+            stuck = rank[self.dangling].sum()
+            updated = (1 - restart) * (self.transitions_t @ rank) + (restart + (1 - restart) * stuck) * seed
+            converged = np.abs(updated - rank).sum() < tolerance
+            rank = updated
+            if converged:
+                break
+        return rank
+
+    def rating_rows(self, matrix) -> np.ndarray:
+        """ Each graph user's row in a RatingMatrix, or -1 for users without ratings """
+        cached = self._rating_rows.get(matrix)
+        # RatingMatrix.set_user appends users it didn't have
+        if cached is None or cached[0] != len(matrix.users):
+            rows = np.fromiter((matrix.user_index.get(u, -1) for u in self.users), dtype=np.int64,
+                               count=len(self.users))
+            cached = self._rating_rows[matrix] = (len(matrix.users), rows)
+        return cached[1]
+
+
+def _scaled(values: np.ndarray) -> np.ndarray:
+    top = values.max() if len(values) else 0
+    return values / top if top > 0 else np.zeros_like(values, dtype=np.float64)
+
+
+class GraphSuggester:
+    def __init__(self, graph: FollowGraph, matrix=None, weights=None, metric="cosine", min_overlap=MIN_OVERLAP):
+        """
+        :param matrix: RatingMatrix for the rating_similarity signal; without one, only the graph signals count
+        :param weights: {signal: weight}, defaulting to WEIGHTS
+        """
+        self.graph = graph
+        self.matrix = matrix
+        self.weights = dict(WEIGHTS if weights is None else weights)
+        self.metric = metric
+        self.min_overlap = min_overlap
+
+    def signals(self, username: str) -> tuple:
+        """
+        Candidates for username (anyone within two hops or with PageRank, that they don't already follow) and each
+        signal for them, unscaled
+        :return: (candidate graph rows, {signal: values indexed like the candidates})
+        """
+        graph = self.graph
+        i = graph._index(username)
+        raw = {
+            "friends_of_friends": graph.friends_of_friends(username),
+            "shared_followers": graph.shared_followers(username),
+            "pagerank": graph.pagerank(username),
+        }
+        reachable = (raw["friends_of_friends"] > 0) | (raw["shared_followers"] > 0) | (raw["pagerank"] > 0)
+        reachable[i] = False
+        reachable[graph.follows[i].indices] = False
+        candidates = np.flatnonzero(reachable)
+        signals = {name: values[candidates] for name, values in raw.items()}
+
+        similarity = np.zeros(len(candidates))
+        if self.matrix is not None and username in self.matrix.user_index:
+            rows = graph.rating_rows(self.matrix)[candidates]
+            rated = rows >= 0
+            if rated.any():
+                scores, overlaps = self.matrix.similarities(username, self.metric, rows=rows[rated])
+                similarity[rated] = np.where(overlaps >= self.min_overlap, np.maximum(scores, 0), 0)
+        signals["rating_similarity"] = similarity
+        return candidates, signals
+
+    def suggest(self, username: str, k=10) -> list:
+        """ Top-k users to follow for username, as [(user, blended score, {signal: raw value})] """
+        candidates, signals = self.signals(username)
+        blended = np.zeros(len(candidates))
+        for name, weight in self.weights.items():
+            blended += weight * _scaled(signals[name])
+
+        top = np.arange(len(candidates))
+        if len(top) > k:
+            top = np.argpartition(-blended, k - 1)[:k]
+        top = top[np.argsort(-blended[top], kind="stable")]
+        return [(self.graph.users[candidates[c]], float(blended[c]),
+                 {name: float(values[c]) for name, values in signals.items()}) for c in top]
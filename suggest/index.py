@@ -0,0 +1,248 @@
+"""
+Precomputed nearest-neighbour index: each user's `neighbours` most similar users, persisted to disk.
+
+The index is built exactly, one block of users at a time (a block x all-users sparse product per block, so memory
+stays bounded), and is then kept current by re-scoring single users as they're re-scraped rather than by rebuilding
+it. Suggestion queries are a lookup.
+"""
+import logging
+import os
+import time
+import numpy as np
+from suggest.ratings import RatingMatrix, MIN_OVERLAP
+from suggest.snapshot import load_matrix
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = "neighbour_index.npz"
+
+# Recall/latency knobs: keeping more neighbours per user costs build time, disk and update time, but keeps recall
+# up when queries filter users out (e.g. ones already followed) or ask for a larger k. Bigger blocks build faster
+# at the cost of block_size x n_users dense scratch arrays.
+NEIGHBOURS = 50
+BLOCK_SIZE = 256
+# Extra candidates kept per user beyond NEIGHBOURS, so that a list can lose a few users to updates before it needs
+# rescoring in full
+SLACK = 10
+
+
+def _block_scores(matrix: RatingMatrix, rows, metric: str, min_overlap: int):
+    """ Similarities and overlaps of matrix rows (a slice or row numbers) to every matrix user, -inf for themselves """
+    dots = (matrix.centered[rows] @ matrix.centered.T).toarray()
+    overlaps = (matrix.rated[rows] @ matrix.rated.T).toarray()
+    if metric == "cosine":
+        denominators = np.outer(matrix.norms[rows], matrix.norms)
+    else:
+        theirs = (matrix.rated[rows] @ matrix.centered_sq.T).toarray()
+        ours = (matrix.centered_sq[rows] @ matrix.rated.T).toarray()
+        denominators = np.sqrt(theirs * ours)
+    scores = np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators > 0)
+
+    scores[overlaps < min_overlap] = -np.inf
+    scores[np.arange(len(scores)), np.arange(len(matrix.users))[rows]] = -np.inf
+    return scores, overlaps
+
+
+class NeighbourIndex:
+    """
+    Between builds the index is kept current approximately. Each list holds up to neighbours + slack candidates, so
+    that users whose similarity falls on an update (and who drop out of the list, or sink below its other entries)
+    can leave it without costing it any of its top neighbours; a list left with fewer than neighbours users is
+    rescored in full. A user whose similarity rises only displaces a list's weakest entry, so the slack tail can
+    hold users a full rebuild would rank below others it doesn't list.
+    """
+    def __init__(self, users, neighbours, scores, overlaps, metric="cosine", min_overlap=MIN_OVERLAP, keep=None):
+        """
+        :param users: usernames, one per row of the other arrays
+        :param neighbours: n_users x (keep + slack) row numbers of each user's nearest users, -1 for empty slots
+        :param scores: their similarities, -inf for empty slots
+        :param overlaps: their number of co-rated films
+        :param keep: neighbours every list should have (when there are that many candidates); all of them by default
+        """
+        self.users = list(users)
+        self.user_index = {u: i for i, u in enumerate(self.users)}
+        self.neighbours = np.asarray(neighbours, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.overlaps = np.asarray(overlaps, dtype=np.int32)
+        self.metric = metric
+        self.min_overlap = min_overlap
+        self.keep = self.neighbours.shape[1] if keep is None else keep
+
+    @classmethod
+    def build(cls, matrix: RatingMatrix, neighbours=NEIGHBOURS, metric="cosine", min_overlap=MIN_OVERLAP,
+              block_size=BLOCK_SIZE, slack=SLACK):
+        n = len(matrix.users)
+        m = min(neighbours + slack, max(n - 1, 1))
+        index = cls(matrix.users, np.full((n, m), -1), np.full((n, m), -np.inf), np.zeros((n, m)), metric,
+                    min_overlap, min(neighbours, m))
+
+        start_time = time.perf_counter()
+        for start in range(0, n, block_size):
+            block = slice(start, min(start + block_size, n))
+            scores, overlaps = _block_scores(matrix, block, metric, min_overlap)
+            index._set_rows(block, scores, overlaps)
+        logger.info(f"Built {index.keep}(+{m - index.keep})-neighbour index over {n} users in "
+                    f"{time.perf_counter() - start_time:.1f}s")
+        return index
+
+    def _set_rows(self, block, scores: np.ndarray, overlaps: np.ndarray):
+        m = self.neighbours.shape[1]
+        if scores.shape[1] > m:
+            top = np.argpartition(-scores, m - 1, axis=1)[:, :m]
+        else:
+            top = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        self.neighbours[block] = np.where(np.isfinite(top_scores), top, -1)
+        self.scores[block] = top_scores
+        self.overlaps[block] = np.take_along_axis(overlaps, top, axis=1)
+
+    def _scores(self, matrix: RatingMatrix, rows: np.ndarray):
+        """ _block_scores of index rows, moved into this index's column numbering (-inf for users matrix lacks) """
+        columns = np.array([self.user_index.get(u, -1) for u in matrix.users], dtype=np.int64)
+        present = columns >= 0
+        matrix_scores, matrix_overlaps = _block_scores(
+            matrix, np.array([matrix.user_index[self.users[r]] for r in rows], dtype=np.int64), self.metric,
+            self.min_overlap)
+        scores = np.full((len(rows), len(self.users)), -np.inf, dtype=np.float32)
+        overlaps = np.zeros((len(rows), len(self.users)), dtype=np.int32)
+        scores[:, columns[present]] = matrix_scores[:, present]
+        overlaps[:, columns[present]] = matrix_overlaps[:, present]
+        return scores, overlaps
+
+    def rescore(self, matrix: RatingMatrix, rows, block_size=BLOCK_SIZE):
+        """ Rebuild the lists of index rows exactly against matrix (users matrix has no ratings for are left as is) """
+        rows = np.array([r for r in rows if self.users[r] in matrix.user_index], dtype=np.int64)
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            self._set_rows(block, *self._scores(matrix, block))
+
+    def update_user(self, matrix: RatingMatrix, username: str, ratings: dict):
+        """
+        Re-score username, from their freshly stored {film_id: film_rating}, against every user in matrix: replaces
+        their row in matrix and their own neighbour list, enters/updates/removes them in everyone else's, and rescores
+        any list that's left with fewer than keep users.
+        """
+        matrix.set_user(username, ratings)
+        if username not in self.user_index:
+            self.user_index[username] = len(self.users)
+            self.users.append(username)
+            m = self.neighbours.shape[1]
+            self.neighbours = np.vstack([self.neighbours, np.full((1, m), -1, dtype=np.int32)])
+            self.scores = np.vstack([self.scores, np.full((1, m), -np.inf, dtype=np.float32)])
+            self.overlaps = np.vstack([self.overlaps, np.zeros((1, m), dtype=np.int32)])
+        i = self.user_index[username]
+
+        scores, overlaps = self._scores(matrix, np.array([i]))
+        self._set_rows(slice(i, i + 1), scores, overlaps)
+        scores, overlaps = scores[0], overlaps[0]
+
+        # Take the user out of every list. They go back into a list they were in unless they now score below all of
+        # its other entries (someone the list doesn't hold may outrank them), and into any other list wherever they
+        # now beat the weakest entry.
+        stale = self.neighbours == i
+        listed = stale.any(axis=1)
+        self.neighbours[stale] = -1
+        self.scores[stale] = -np.inf
+        floor = np.where(self.neighbours >= 0, self.scores, np.inf).min(axis=1)
+        candidates = np.flatnonzero(np.isfinite(scores) & ~(listed & (scores < floor) & np.isfinite(floor)))
+        weakest = np.argmin(self.scores[candidates], axis=1)
+        beats = scores[candidates] > self.scores[candidates, weakest]
+        candidates, weakest = candidates[beats], weakest[beats]
+        self.neighbours[candidates, weakest] = i
+        self.scores[candidates, weakest] = scores[candidates]
+        self.overlaps[candidates, weakest] = overlaps[candidates]
+
+        short = np.flatnonzero(listed & ((self.neighbours >= 0).sum(axis=1) < self.keep))
+        if len(short):
+            logger.debug(f"Rescoring {len(short)} neighbour lists that '{username}' left short")
+            self.rescore(matrix, short)
+
+    def query(self, username: str, k=10, exclude=None) -> list:
+        """ Top-k users to follow for username, as [(user, score, overlap)], like RatingMatrix.suggest """
+        i = self.user_index[username]
+        neighbours, scores, overlaps = self.neighbours[i], self.scores[i], self.overlaps[i]
+        valid = neighbours >= 0
+        if exclude is not None:
+            valid &= ~np.isin(neighbours, exclude)
+        order = np.flatnonzero(valid)
+        order = order[np.argsort(-scores[order], kind="stable")][:k]
+        return [(self.users[neighbours[o]], float(scores[o]), int(overlaps[o])) for o in order]
+
+    def save(self, path=INDEX_PATH):
+        # np.savez adds .npz to names that lack it, so keep it on the temporary file too
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, users=np.array(self.users, dtype=str), neighbours=self.neighbours, scores=self.scores,
+                 overlaps=self.overlaps, metric=np.array(self.metric), min_overlap=np.array(self.min_overlap),
+                 keep=np.array(self.keep))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        with np.load(path) as data:
+            # Indexes saved before keep was stored have no slack
+            keep = int(data["keep"]) if "keep" in data else None
+            return cls(data["users"].tolist(), data["neighbours"], data["scores"], data["overlaps"],
+                       str(data["metric"]), int(data["min_overlap"]), keep)
+
+
+class IndexUpdater:
+    """
+    Applies per-user updates to the on-disk index over a scrape run, loading the index and ratings on first use. Each
+    update also replaces the user's row in the loaded ratings, so later users in the run are scored against it.
+    """
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.matrix = None
+        self.index = None
+
+    def update(self, db, username: str):
+        if self.index is None:
+            self.matrix = load_matrix(db)
+            self.index = NeighbourIndex.load(self.path)
+        self.index.update_user(self.matrix, username, db.get_user_ratings(username))
+
+    def save(self):
+        if self.index is not None:
+            self.index.save(self.path)
+
+
+def recall_benchmark(matrix: RatingMatrix, users, k=10, metric="cosine", min_overlap=MIN_OVERLAP,
+                     neighbour_counts=(10, 20, 50), exclude_fraction=0.2, seed=0) -> list:
+    """
+    Recall@k and latency of NeighbourIndex queries against brute-force RatingMatrix.suggest, per neighbours setting.
+    Each query excludes a random exclude_fraction of all users, standing in for ones the target already follows.
+    :return: [{neighbours, build_s, recall, index_ms, brute_ms}]
+    """
+    rng = np.random.default_rng(seed)
+    excluded = {u: np.flatnonzero(rng.random(len(matrix.users)) < exclude_fraction) for u in users}
+
+    exact, brute_time = {}, 0.0
+    for u in users:
+        start = time.perf_counter()
+        scores, overlaps = matrix.similarities(u, metric)
+        exact[u] = {s[0] for s in matrix.top_k(scores, overlaps, u, k, min_overlap, exclude=excluded[u])}
+        brute_time += time.perf_counter() - start
+
+    report = []
+    for neighbours in neighbour_counts:
+        start = time.perf_counter()
+        index = NeighbourIndex.build(matrix, neighbours, metric, min_overlap)
+        build_time = time.perf_counter() - start
+
+        hits = total = 0
+        index_time = 0.0
+        for u in users:
+            start = time.perf_counter()
+            approx = {s[0] for s in index.query(u, k, exclude=excluded[u])}
+            index_time += time.perf_counter() - start
+            hits += len(approx & exact[u])
+            total += len(exact[u])
+        report.append({
+            "neighbours": neighbours,
+            "build_s": build_time,
+            "recall": hits / total if total else 1.0,
+            "index_ms": 1000 * index_time / len(users),
+            "brute_ms": 1000 * brute_time / len(users),
+        })
+    return report
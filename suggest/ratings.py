@@ -0,0 +1,184 @@
+"""
+Rating-similarity follow suggestions.
+
+The ratings table is loaded once into a sparse user x film matrix; each query is then a couple of sparse
+matrix-vector products over every user at once.
+"""
+import logging
+import numpy as np
+from scipy import sparse
+
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("cosine", "pearson")
+MIN_OVERLAP = 10
+
+
+class RatingMatrix:
+    def __init__(self, users, film_ids, ratings: sparse.csr_matrix):
+        """
+        :param users: usernames, one per row of ratings
+        :param film_ids: Letterboxd film ids, one per column of ratings
+        :param ratings: users x films star ratings (0.5 - 5.0), zero where unrated
+        """
+        self.users = list(users)
+        self.user_index = {u: i for i, u in enumerate(self.users)}
+        self.film_ids = np.asarray(film_ids)
+        self.ratings = sparse.csr_matrix(ratings, dtype=np.float32)
+        self.ratings.sort_indices()
+        self._derive()
+
+    def _derive(self):
+        counts = np.diff(self.ratings.indptr)
+        sums = np.asarray(self.ratings.sum(axis=1)).ravel()
+        self.means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+
+        # Mean-centre each user's ratings so that harsh and generous raters are comparable. The derived matrices
+        # share ratings' indices and indptr (which may be a snapshot's read-only mmaps), with data of their own.
+        structure = (self.ratings.indices, self.ratings.indptr)
+        centered = self.ratings.data - np.repeat(self.means, counts).astype(np.float32)
+        self.centered = sparse.csr_matrix((centered, *structure), shape=self.ratings.shape)
+        self.centered_sq = sparse.csr_matrix((centered * centered, *structure), shape=self.ratings.shape)
+        self.rated = sparse.csr_matrix((np.ones_like(centered), *structure), shape=self.ratings.shape)
+        self.norms = np.sqrt(np.asarray(self.centered_sq.sum(axis=1)).ravel())
+
+    @classmethod
+    def from_db(cls, db, chunk_size=100_000):
+        """ Load every star rating in a ParsingStorage """
+        users, films, values = [], [], []
+        for rows in db.iter_rating_triples(chunk_size):
+            chunk_users, chunk_films, chunk_values = zip(*rows)
+            users.append(np.array(chunk_users, dtype=object))
+            films.append(np.array(chunk_films, dtype=np.int64))
+            values.append(np.array(chunk_values, dtype=np.float32))
+
+        if not values:
+            return cls([], [], sparse.csr_matrix((0, 0), dtype=np.float32))
+
+        user_names, user_codes = np.unique(np.concatenate(users), return_inverse=True)
+        film_ids, film_codes = np.unique(np.concatenate(films), return_inverse=True)
+        ratings = sparse.csr_matrix((np.concatenate(values), (user_codes, film_codes)),
+                                    shape=(len(user_names), len(film_ids)))
+        logger.info(f"Loaded {ratings.nnz} ratings: {len(user_names)} users x {len(film_ids)} films")
+        return cls(user_names, film_ids, ratings)
+
+    def similarities(self, username: str, metric="cosine", rows=None):
+        """
+        Similarity of every user (or just those in rows) to username, and the number of films each has rated in
+        common with them.
+          cosine:  cosine of the mean-centred rating vectors
+          pearson: the same dot product, normalised over co-rated films only
+        :return: (scores, overlaps), both indexed like self.users (or rows)
+        """
+        i = self.user_index[username]
+        return self.similarities_to(self.centered[i].toarray().ravel(), self.rated[i].toarray().ravel(), metric, rows)
+
+    def vector(self, ratings: dict):
+        """
+        Dense film vectors for {film_id: film_rating}, e.g. a freshly scraped user's ratings
+        :return: (mean-centred ratings, 1/0 rated indicator)
+        """
+        target = np.zeros(len(self.film_ids), dtype=np.float32)
+        target_rated = np.zeros(len(self.film_ids), dtype=np.float32)
+        columns, values = self._columns(ratings)
+        if len(values):
+            target[columns] = values - values.mean()
+            target_rated[columns] = 1
+        return target, target_rated
+
+    def _columns(self, ratings: dict):
+        """ (columns, star ratings) of the rated films in {film_id: film_rating} that the matrix has, by column """
+        rated = {f: r for f, r in ratings.items() if r}
+        if not rated or not len(self.film_ids):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        film_ids = np.fromiter(rated.keys(), dtype=np.int64, count=len(rated))
+        values = np.fromiter(rated.values(), dtype=np.float32, count=len(rated))
+        # Films nobody else in the matrix has rated can't contribute to any similarity
+        columns = np.searchsorted(self.film_ids, film_ids)
+        columns = np.minimum(columns, len(self.film_ids) - 1)
+        known = self.film_ids[columns] == film_ids
+        order = np.argsort(columns[known])
+        return columns[known][order], values[known][order]
+
+    def set_user(self, username: str, ratings: dict):
+        """
+        Replace username's row with their freshly stored {film_id: film_rating} (appending a row if they're new), so
+        that later similarities see their current ratings. Films the matrix has no column for are left out.
+        Only that row's derived values are computed; the other rows' are spliced around it as they are.
+        """
+        columns, values = self._columns(ratings)
+        indptr = np.asarray(self.ratings.indptr)
+        if username in self.user_index:
+            i = self.user_index[username]
+            start, end = indptr[i], indptr[i + 1]
+            indptr = indptr.copy()
+            indptr[i + 1:] += len(columns) - (end - start)
+        else:
+            i = len(self.users)
+            start = end = indptr[-1]
+            indptr = np.append(indptr, indptr[-1] + len(columns)).astype(indptr.dtype)
+            self.user_index[username] = i
+            self.users.append(username)
+            self.means = np.append(self.means, 0).astype(self.means.dtype)
+            self.norms = np.append(self.norms, 0).astype(self.norms.dtype)
+
+        mean = values.mean() if len(values) else 0.0
+        centered = (values - mean).astype(np.float32)
+        indices = np.concatenate([self.ratings.indices[:start], columns.astype(self.ratings.indices.dtype),
+                                  self.ratings.indices[end:]])
+        shape = (len(self.users), len(self.film_ids))
+
+        def spliced(matrix, row_data):
+            data = np.concatenate([matrix.data[:start], row_data, matrix.data[end:]])
+            return sparse.csr_matrix((data, indices, indptr), shape=shape)
+
+        self.ratings = spliced(self.ratings, values)
+        self.centered = spliced(self.centered, centered)
+        self.centered_sq = spliced(self.centered_sq, centered * centered)
+        self.rated = spliced(self.rated, np.ones_like(centered))
+        self.means[i] = mean
+        self.norms[i] = np.sqrt((centered * centered).sum())
+
+    def similarities_to(self, target: np.ndarray, target_rated: np.ndarray, metric="cosine", rows=None):
+        """ similarities(), for dense film vectors (see vector()) rather than a stored user """
+        if metric not in METRICS:
+            raise Exception(f"Unknown similarity metric '{metric}'")
+        centered, centered_sq, rated, norms = self.centered, self.centered_sq, self.rated, self.norms
+        if rows is not None:
+            centered, centered_sq, rated, norms = centered[rows], centered_sq[rows], rated[rows], norms[rows]
+
+        dots = centered @ target
+        overlaps = rated @ target_rated
+
+        if metric == "cosine":
+            denominators = norms * np.linalg.norm(target)
+        else:
+            theirs = centered_sq @ target_rated
+            ours = rated @ (target * target)
+            denominators = np.sqrt(theirs * ours)
+
+        scores = np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators > 0)
+        return scores, overlaps.astype(np.int64)
+
+    def top_k(self, scores, overlaps, username: str, k=10, min_overlap=MIN_OVERLAP, exclude=None, rows=None) -> list:
+        """ The k best-scoring users with enough films in common, as [(user, score, overlap)] """
+        rows = np.arange(len(self.users)) if rows is None else np.asarray(rows)
+        eligible = (overlaps >= min_overlap) & (rows != self.user_index[username])
+        if exclude is not None:
+            eligible &= ~np.isin(rows, exclude)
+        candidates = np.flatnonzero(eligible)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.users[rows[c]], float(scores[c]), int(overlaps[c])) for c in candidates]
+
+    def suggest(self, username: str, k=10, metric="cosine", min_overlap=MIN_OVERLAP, rows=None) -> list:
+        """
+        Top-k users to follow for username, as [(user, score, overlap)]
+        :param rows: only consider these users (e.g. candidates from a NeighbourIndex)
+        """
+        if username not in self.user_index:
+            raise Exception(f"No ratings stored for user '{username}'")
+        scores, overlaps = self.similarities(username, metric, rows)
+        return self.top_k(scores, overlaps, username, k, min_overlap, rows=rows)
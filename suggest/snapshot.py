@@ -0,0 +1,180 @@
+"""
+Compact, memory-mapped columnar snapshot of the ratings table.
+
+Layout of a snapshot directory:
+  user_offsets.npy  int64   n_users + 1 CSR row offsets into the two arrays below (users in name order)
+  film_index.npy    int32   interned film id of each rating, ascending within a user
+  ratings.npy       uint8   half stars (1 = ½ ... 10 = ★★★★★), 0 for films logged without a rating
+  film_ids.npy      int64   Letterboxd film id of each interned film id, ascending
+  star_users.npy    int32   interned user id of each user with star ratings
+  star_offsets.npy  int32   CSR row offsets of those users into the two arrays below
+  star_films.npy    int32   interned film id of each star rating, ascending within a user
+  stars.npy         float32 each star rating (0.5 - 5.0)
+  users.json                username of each interned user id
+  films.json                {"titles": [...], "urls": [...]} of each interned film id
+  meta.json                 counts, creation time and the ratings table's version (see ParsingStorage.ratings_version)
+
+The arrays are opened with mmap, so loading is near-instant and every worker process reading the same snapshot
+shares the same page cache instead of re-reading SQLite into Python lists. The star_* arrays are laid out exactly
+as scipy's CSR arrays, so a RatingMatrix is built straight over the mmaps without copying them. A snapshot is only
+used while the ratings table's row count and latest last_updated still match the ones it was written from.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+from scipy import sparse
+from suggest.ratings import RatingMatrix
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = "ratings_snapshot"
+
+
+def write_snapshot(db, path=SNAPSHOT_PATH, chunk_size=100_000) -> dict:
+    """ Export a ParsingStorage's ratings to a snapshot at path, replacing any previous one """
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    # One read transaction, so the films, count and ratings passes all see the same rows under WAL
+    db.connection.execute("BEGIN")
+    try:
+        film_ids, titles, urls = [], [], []
+        for rows in db.iter_films(chunk_size):
+            chunk_ids, chunk_titles, chunk_urls = zip(*rows)
+            film_ids.append(np.array(chunk_ids, dtype=np.int64))
+            titles.extend(chunk_titles)
+            urls.extend(chunk_urls)
+        film_ids = np.concatenate(film_ids) if film_ids else np.zeros(0, dtype=np.int64)
+
+        version = db.ratings_version()
+        n_ratings = version["ratings"]
+        n_stars = db.count_ratings(rated_only=True)
+        film_index = np.lib.format.open_memmap(os.path.join(tmp_path, "film_index.npy"), mode="w+",
+                                               dtype=np.int32, shape=(n_ratings,))
+        ratings = np.lib.format.open_memmap(os.path.join(tmp_path, "ratings.npy"), mode="w+",
+                                            dtype=np.uint8, shape=(n_ratings,))
+        star_films = np.lib.format.open_memmap(os.path.join(tmp_path, "star_films.npy"), mode="w+",
+                                               dtype=np.int32, shape=(n_stars,))
+        stars = np.lib.format.open_memmap(os.path.join(tmp_path, "stars.npy"), mode="w+",
+                                          dtype=np.float32, shape=(n_stars,))
+        users, offsets, star_offsets = [], [], []
+        position = star_position = 0
+        for rows in db.iter_rating_triples(chunk_size, rated_only=False):
+            chunk_users, chunk_films, chunk_ratings = zip(*rows)
+            end = position + len(rows)
+            chunk_index = np.searchsorted(film_ids, np.array(chunk_films, dtype=np.int64))
+            film_index[position:end] = chunk_index
+            # None (no rating) -> nan -> 0
+            half_stars = np.array(chunk_ratings, dtype=np.float64) * 2
+            rated = half_stars > 0
+            ratings[position:end] = np.nan_to_num(half_stars, nan=0).round().astype(np.uint8)
+            # Star ratings before each row of the chunk, so each user's star offset is known from their first row
+            rated_before = np.r_[0, np.cumsum(rated)]
+            star_end = star_position + int(rated_before[-1])
+            star_films[star_position:star_end] = chunk_index[rated]
+            stars[star_position:star_end] = half_stars[rated] / 2
+
+            chunk_users = np.array(chunk_users, dtype=object)
+            starts = np.flatnonzero(np.r_[True, chunk_users[1:] != chunk_users[:-1]])
+            if users and chunk_users[0] == users[-1]:
+                # This chunk continues the previous chunk's last user
+                starts = starts[1:]
+            users.extend(chunk_users[starts].tolist())
+            offsets.extend((starts + position).tolist())
+            star_offsets.extend((rated_before[starts] + star_position).tolist())
+            position, star_position = end, star_end
+    finally:
+        db.connection.commit()
+
+    for array in (film_index, ratings, star_films, stars):
+        array.flush()
+    del film_index, ratings, star_films, stars, array
+    np.save(os.path.join(tmp_path, "user_offsets.npy"), np.array(offsets + [position], dtype=np.int64))
+    # Users with nothing but unrated films get no row, as in RatingMatrix.from_db
+    star_offsets = np.array(star_offsets + [star_position], dtype=np.int64)
+    star_users = np.flatnonzero(np.diff(star_offsets))
+    np.save(os.path.join(tmp_path, "star_users.npy"), star_users.astype(np.int32))
+    np.save(os.path.join(tmp_path, "star_offsets.npy"), np.r_[0, star_offsets[star_users + 1]].astype(np.int32))
+    np.save(os.path.join(tmp_path, "film_ids.npy"), film_ids)
+    with open(os.path.join(tmp_path, "users.json"), "w") as f:
+        json.dump(users, f)
+    with open(os.path.join(tmp_path, "films.json"), "w") as f:
+        json.dump({"titles": titles, "urls": urls}, f)
+    meta = {"users": len(users), "films": len(film_ids), "ratings": position, "stars": star_position,
+            "last_updated": version["last_updated"], "created_at": int(time.time())}
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+    logger.info(f"Wrote ratings snapshot to {path}: {meta}")
+    return meta
+
+
+class Snapshot:
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        self.user_offsets = np.load(os.path.join(path, "user_offsets.npy"), mmap_mode="r")
+        self.film_index = np.load(os.path.join(path, "film_index.npy"), mmap_mode="r")
+        self.ratings = np.load(os.path.join(path, "ratings.npy"), mmap_mode="r")
+        self.film_ids = np.load(os.path.join(path, "film_ids.npy"), mmap_mode="r")
+        self.star_users = np.load(os.path.join(path, "star_users.npy"), mmap_mode="r")
+        self.star_offsets = np.load(os.path.join(path, "star_offsets.npy"), mmap_mode="r")
+        self.star_films = np.load(os.path.join(path, "star_films.npy"), mmap_mode="r")
+        self.stars = np.load(os.path.join(path, "stars.npy"), mmap_mode="r")
+        with open(os.path.join(path, "users.json")) as f:
+            self.users = json.load(f)
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.user_index = {u: i for i, u in enumerate(self.users)}
+        self._films = None
+
+    @property
+    def films(self) -> dict:
+        """ {"titles": [...], "urls": [...]}, only read when something needs the strings """
+        if self._films is None:
+            with open(os.path.join(self.path, "films.json")) as f:
+                self._films = json.load(f)
+        return self._films
+
+    def user_ratings(self, username: str):
+        """ (Letterboxd film ids, star ratings) of a single user, with 0 for unrated films """
+        i = self.user_index[username]
+        start, end = self.user_offsets[i], self.user_offsets[i + 1]
+        return self.film_ids[self.film_index[start:end]], self.ratings[start:end] / 2
+
+    def to_matrix(self) -> RatingMatrix:
+        """ RatingMatrix over every star rating in the snapshot, sharing the mmapped arrays rather than copying them """
+        ratings = sparse.csr_matrix((self.stars, self.star_films, self.star_offsets),
+                                    shape=(len(self.star_users), len(self.film_ids)))
+        return RatingMatrix([self.users[i] for i in self.star_users], self.film_ids, ratings)
+
+
+def is_current(meta: dict, db) -> bool:
+    """ Whether the ratings table is still as it was when the snapshot with this meta.json was written """
+    return all(meta.get(key) == value for key, value in db.ratings_version().items())
+
+
+def load_matrix(db, path=SNAPSHOT_PATH) -> RatingMatrix:
+    """
+    RatingMatrix from the snapshot at path if one has been written and the ratings table hasn't changed since,
+    otherwise straight from the DB
+    """
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        logger.info(f"No ratings snapshot at {path}: loading ratings from the DB")
+        return RatingMatrix.from_db(db)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    taken = time.ctime(meta["created_at"])
+    if not is_current(meta, db):
+        logger.warning(f"Ratings snapshot {path} taken at {taken} is out of date: loading ratings from the DB "
+                       f"instead (re-run --snapshot to refresh it)")
+        return RatingMatrix.from_db(db)
+    logger.info(f"Loading ratings from snapshot {path} taken at {taken}")
+    return Snapshot(path).to_matrix()
@@ -0,0 +1,174 @@
+"""
+Taste profiles: the genres, decades, countries and directors a user watches most, and how they rate them against
+their own average.
+
+Computed locally by joining the user's stored ratings against the films table (see utils.films), with no requests:
+the films table is loaded once into a sparse films x features indicator matrix per dimension, and a user's profile
+is then a few sparse products over just the rows of the films they've logged. Profiles are cached in the
+taste_profiles table until the user's ratings change on a re-scrape or the films table changes.
+
+Where too few of a user's films have metadata yet (see --enrich-films), genres fall back to the user's genre pages,
+fetched concurrently (scraping.user.user_genre_info).
+"""
+import json
+import logging
+import numpy as np
+from scipy import sparse
+from scraping import user
+
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ("genres", "decades", "countries", "directors")
+# Features kept per dimension, most watched first
+TOP_FEATURES = 20
+# Below this fraction of a user's films with metadata, genres come from their genre pages instead
+MIN_COVERAGE = 0.5
+# Affinity shrinks towards 0 as if each feature also had this many films rated at the user's average, so a
+# director seen once doesn't outrank one seen twenty times
+AFFINITY_PRIOR = 5
+
+
+def decade(year) -> str:
+    return f"{year // 10 * 10}s" if year else None
+
+
+class FilmFeatures:
+    def __init__(self, film_ids, features: dict):
+        """
+        :param film_ids: sorted Letterboxd film ids, one per row of each indicator matrix
+        :param features: {dimension: (feature names, films x names csr indicator matrix)}
+        """
+        self.film_ids = np.asarray(film_ids, dtype=np.int64)
+        self.features = features
+
+    @classmethod
+    def from_db(cls, db, chunk_size=100_000):
+        """ Load every film in a ParsingStorage's films table """
+        film_ids = []
+        names = {dimension: {} for dimension in DIMENSIONS}
+        rows = {dimension: [] for dimension in DIMENSIONS}
+        cols = {dimension: [] for dimension in DIMENSIONS}
+        for chunk in db.iter_film_metadata(chunk_size):
+            for film_id, year, directors, genres, countries in chunk:
+                row = len(film_ids)
+                film_ids.append(film_id)
+                values = {
+                    "genres": json.loads(genres) if genres else [],
+                    "decades": [decade(year)] if year else [],
+                    "countries": json.loads(countries) if countries else [],
+                    "directors": json.loads(directors) if directors else [],
+                }
+                for dimension, film_values in values.items():
+                    codes = names[dimension]
+                    for value in dict.fromkeys(film_values):
+                        rows[dimension].append(row)
+                        cols[dimension].append(codes.setdefault(value, len(codes)))
+
+        features = {}
+        for dimension in DIMENSIONS:
+            indicator = sparse.csr_matrix((np.ones(len(rows[dimension]), dtype=np.float32),
+                                           (rows[dimension], cols[dimension])),
+                                          shape=(len(film_ids), len(names[dimension])))
+            features[dimension] = (list(names[dimension]), indicator)
+        logger.info(f"Loaded film features for {len(film_ids)} films: "
+                    + ", ".join(f"{len(n)} {d}" for d, (n, _) in features.items()))
+        return cls(film_ids, features)
+
+    def rows(self, film_ids: np.ndarray) -> tuple:
+        """ :return: (rows of the films that have metadata, mask of which of film_ids those are) """
+        if not len(self.film_ids):
+            return np.zeros(0, dtype=np.int64), np.zeros(len(film_ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.film_ids, film_ids), len(self.film_ids) - 1)
+        known = self.film_ids[positions] == film_ids
+        return positions[known], known
+
+
+class TasteProfiler:
+    def __init__(self, db, features: FilmFeatures = None, top=TOP_FEATURES, min_coverage=MIN_COVERAGE,
+                 network_fallback=True):
+        """
+        :param features: FilmFeatures to share between profilers; loaded from db on first use otherwise
+        :param network_fallback: fetch genre pages for users whose films mostly lack metadata
+        """
+        self.db = db
+        self._features = features
+        self.top = top
+        self.min_coverage = min_coverage
+        self.network_fallback = network_fallback
+
+    @property
+    def features(self) -> FilmFeatures:
+        if self._features is None:
+            self._features = FilmFeatures.from_db(self.db)
+        return self._features
+
+    def profile(self, username: str, refresh=False) -> dict:
+        """ The user's taste profile, from the cache unless it's out of date (or refresh) """
+        films_version = self.db.films_version()
+        if not refresh:
+            cached = self.db.get_taste_profile(username, films_version)
+            if cached is not None:
+                return cached
+
+        profile = self.compute(self.db.get_user_ratings(username))
+        if profile["coverage"] < self.min_coverage and self.network_fallback:
+            logger.info(f"Only {profile['coverage']:.0%} of '{username}''s films have metadata: "
+                        f"reading their genre pages instead")
+            try:
+                profile["genres"] = self.network_genres(username)
+                profile["sources"]["genres"] = "network"
+            except Exception as e:
+                logger.error(f"Couldn't read genre pages of '{username}', keeping the local genres: {e}")
+        self.db.save_taste_profile(username, profile, films_version)
+        return profile
+
+    def compute(self, ratings: dict) -> dict:
+        """
+        Taste profile for {film_id: film_rating} (0 for films logged without a rating):
+        {"films", "rated", "mean_rating", "coverage" (fraction of films with metadata), "sources",
+         dimension: [{"name", "films", "rated", "mean_rating", "affinity"}, ...] for each of DIMENSIONS}
+        Affinity is how far above (or below) their own average the user rates the feature's films, shrunk towards
+        0 for features with few ratings (see AFFINITY_PRIOR).
+        """
+        film_ids = np.fromiter(ratings.keys(), dtype=np.int64, count=len(ratings))
+        stars = np.fromiter((r or 0 for r in ratings.values()), dtype=np.float32, count=len(ratings))
+        rated = stars > 0
+        rated_films = int(rated.sum())
+        mean_rating = float(stars[rated].mean()) if rated_films else 0.0
+
+        rows, known = self.features.rows(film_ids)
+        stars, rated = stars[known], rated[known]
+        deviation = np.where(rated, stars - mean_rating, 0).astype(np.float32)
+
+        profile = {
+            "films": len(ratings),
+            "rated": rated_films,
+            "mean_rating": round(mean_rating, 3),
+            "coverage": round(float(known.mean()), 3) if len(ratings) else 0.0,
+            "sources": {dimension: "local" for dimension in DIMENSIONS},
+        }
+        for dimension, (names, indicator) in self.features.features.items():
+            # The join: only the rows of the user's films, then per-feature sums over them
+            films = indicator[rows].T.tocsr()
+            watched = films @ np.ones(len(rows), dtype=np.float32)
+            rated_count = films @ rated.astype(np.float32)
+            star_sum = films @ stars
+            affinity = (films @ deviation) / (rated_count + AFFINITY_PRIOR)
+
+            present = np.flatnonzero(watched)
+            order = present[np.lexsort((-affinity[present], -watched[present]))][:self.top]
+            profile[dimension] = [
+                {"name": names[f], "films": int(watched[f]), "rated": int(rated_count[f]),
+                 "mean_rating": round(float(star_sum[f] / rated_count[f]), 3) if rated_count[f] else None,
+                 "affinity": round(float(affinity[f]), 3)}
+                for f in order
+            ]
+        return profile
+
+    def network_genres(self, username: str) -> list:
+        """ The genres dimension (films watched only) from the user's genre pages """
+        counts = user.user_genre_info(user.User(username))
+        genres = sorted(((user.GENRES[slug], n) for slug, n in counts.items() if n), key=lambda g: -g[1])
+        return [{"name": name, "films": n, "rated": None, "mean_rating": None, "affinity": None}
+                for name, n in genres[:self.top]]
@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+import pytest
+
+
+# The packages live at the repository root, which isn't installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraping import extract  # noqa: E402
+from scraping.base import Base  # noqa: E402
+
+
+@pytest.fixture(params=["lxml", "soup"])
+def backend(request):
+    previous = extract.BACKEND
+    extract.set_backend(request.param)
+    yield request.param
+    extract.set_backend(previous)
+
+
+class FakeSite:
+    """ Base.get_page stand-in serving page_fn(page number), recording requests and the most in flight at once """
+    def __init__(self, page_fn):
+        self.page_fn = page_fn
+        self.requested = []
+        self.in_flight = self.peak = 0
+        self._lock = threading.Lock()
+
+    def get_page(self, url):
+        page_no = int(url.rstrip("/").rsplit("/", 1)[-1])
+        with self._lock:
+            self.requested.append(page_no)
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            return self.page_fn(page_no)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture
+def site(monkeypatch):
+    def serve(page_fn):
+        fake = FakeSite(page_fn)
+        monkeypatch.setattr(Base, "get_page", staticmethod(fake.get_page))
+        return fake
+    return serve
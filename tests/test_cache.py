@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+import pytest
+from scraping import cache
+from scraping.cache import CacheMiss, ResponseCache, DAY, HOUR
+
+FILM = "https://letterboxd.com/film/bench-film-1/"
+FILMS_PAGE = "https://letterboxd.com/benchuser/films/page/2/"
+
+
+class Response:
+    def __init__(self, status_code=200, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class FakeServer:
+    """ fetch(url, headers) stand-in serving body, answering 304 to a matching If-None-Match """
+    def __init__(self, body="<html>v1</html>", etag='"v1"'):
+        self.body, self.etag = body, etag
+        self.requests = []
+
+    def __call__(self, url, headers=None):
+        self.requests.append(headers)
+        if headers and headers.get("if-none-match") == self.etag:
+            return Response(304)
+        return Response(200, self.body, {"etag": self.etag})
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    rc = ResponseCache(str(tmp_path / "cache"))
+    yield rc
+    rc.close()
+
+
+def age(rc: ResponseCache, url: str, seconds: float):
+    rc.cursor.execute("UPDATE entries SET fetched_at = fetched_at - ? WHERE key = ?", (seconds, rc.key(url)))
+    rc.connection.commit()
+
+
+def test_ttl_by_url_class():
+    assert cache.ttl_for(FILM) == 30 * DAY
+    assert cache.ttl_for(FILM + "details/") == 30 * DAY
+    assert cache.ttl_for(FILMS_PAGE) == 6 * HOUR
+    assert cache.ttl_for("https://letterboxd.com/benchuser/films/by/date/page/3/") == 6 * HOUR
+    assert cache.ttl_for("https://letterboxd.com/benchuser/") == HOUR
+    assert cache.ttl_for("https://letterboxd.com/benchuser/following/page/2/") == cache.DEFAULT_TTL
+
+
+def test_fresh_hits_skip_the_network(response_cache):
+    server = FakeServer()
+    assert response_cache.fetch_text(FILMS_PAGE, server) == server.body
+    assert response_cache.fetch_text(FILMS_PAGE, server) == server.body
+    assert server.requests == [None]
+
+
+def test_expiry_depends_on_url_class(response_cache):
+    server = FakeServer()
+    for url in (FILM, FILMS_PAGE):
+        response_cache.fetch_text(url, server)
+        age(response_cache, url, 7 * HOUR)
+    server.requests.clear()
+
+    # A week-old film page is still fresh; a 7 hour old films grid page isn't
+    response_cache.fetch_text(FILM, server)
+    assert server.requests == []
+    response_cache.fetch_text(FILMS_PAGE, server)
+    assert server.requests == [{"if-none-match": '"v1"'}]
+
+
+def test_etag_revalidation(response_cache):
+    server = FakeServer()
+    response_cache.fetch_text(FILMS_PAGE, server)
+    age(response_cache, FILMS_PAGE, DAY)
+
+    # 304: the cached body is served and its TTL restarts
+    assert response_cache.fetch_text(FILMS_PAGE, server) == "<html>v1</html>"
+    assert response_cache.fetch_text(FILMS_PAGE, server) == "<html>v1</html>"
+    assert len(server.requests) == 2
+
+    # Changed upstream: the new body replaces the cached one
+    age(response_cache, FILMS_PAGE, DAY)
+    server.body, server.etag = "<html>v2</html>", '"v2"'
+    assert response_cache.fetch_text(FILMS_PAGE, server) == "<html>v2</html>"
+    assert response_cache.lookup(FILMS_PAGE)[0] == '"v2"'
+
+
+def test_replay_only(tmp_path):
+    path = str(tmp_path / "cache")
+    rc = ResponseCache(path)
+    rc.store(FILMS_PAGE, "<html>cached</html>")
+    age(rc, FILMS_PAGE, 30 * DAY)
+    rc.close()
+
+    replay = ResponseCache(path, replay_only=True)
+    server = FakeServer()
+    # Served however old it is, and misses never go to the network
+    assert replay.fetch_text(FILMS_PAGE, server) == "<html>cached</html>"
+    with pytest.raises(CacheMiss):
+        replay.fetch_text(FILM, server)
+    assert server.requests == []
+    replay.close()
+
+
+def test_evicts_least_recently_used(tmp_path):
+    rc = ResponseCache(str(tmp_path / "cache"), max_bytes=3000)
+    urls = [f"https://letterboxd.com/film/film-{i}/" for i in range(3)]
+    for url in urls:
+        rc.store(url, "x" * 900)
+        time.sleep(0.01)
+    rc.lookup(urls[0])
+    rc.store("https://letterboxd.com/film/film-3/", "x" * 900)
+
+    assert rc.size() <= 3000 * 0.9
+    assert rc.lookup(urls[0]) is not None
+    assert rc.lookup(urls[1]) is None
+    rc.close()
+
+
+def test_concurrent_stores_keep_index_and_bodies_together(tmp_path):
+    rc = ResponseCache(str(tmp_path / "cache"), max_bytes=20_000)
+
+    def store_many(thread):
+        for i in range(60):
+            rc.store(f"https://letterboxd.com/film/film-{(thread * 7 + i) % 40}/", f"{thread}:{i}:" + "x" * 1000)
+
+    threads = [threading.Thread(target=store_many, args=(t,)) for t in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    rc.cursor.execute("SELECT key FROM entries")
+    indexed = {row[0] for row in rc.cursor.fetchall()}
+    on_disk = {name[:-len(".html")] for _, _, names in os.walk(rc.path) for name in names if name.endswith(".html")}
+    assert indexed == on_disk
+    assert rc.size() <= 20_000
+    rc.close()
+
+
+def test_store_during_eviction_keeps_its_body(tmp_path, monkeypatch):
+    """ Regression: evict() used to delete bodies after releasing the lock, taking a concurrent store()'s with them """
+    rc = ResponseCache(str(tmp_path / "cache"), max_bytes=2500)
+    urls = [f"https://letterboxd.com/film/film-{i}/" for i in range(3)]
+    rc.store(urls[0], "x" * 1000)
+    time.sleep(0.01)
+    rc.store(urls[1], "x" * 1000)
+
+    remove = os.remove
+    racing = []
+
+    def remove_while_storing(path):
+        # Re-store the entry being evicted, giving it time to finish unless the lock holds it back
+        if not racing:
+            racing.append(threading.Thread(target=rc.store, args=(urls[0], "fresh")))
+            racing[0].start()
+            racing[0].join(0.2)
+        remove(path)
+
+    monkeypatch.setattr(cache.os, "remove", remove_while_storing)
+    rc.store(urls[2], "x" * 1000)
+    racing[0].join()
+
+    assert racing
+    assert rc.lookup(urls[0])[3] == "fresh"
+    rc.close()
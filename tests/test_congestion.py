@@ -0,0 +1,199 @@
+import json
+import threading
+from email.utils import format_datetime
+from datetime import datetime, timezone
+import pytest
+from scraping import congestion
+from scraping.congestion import AimdController, OK, SLOW, THROTTLED, CHALLENGE, SERVER_ERROR, ERROR
+
+
+class Response:
+    def __init__(self, status_code=200, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class Clock:
+    """ time module stand-in: sleep() advances the clock instead of blocking """
+    EPOCH = 1_700_000_000.0
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.EPOCH + self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(congestion, "time", fake)
+    return fake
+
+
+def request(controller, signal=OK, seconds=None, wait=None):
+    controller.acquire()
+    controller.release(signal, seconds, wait)
+
+
+def test_additive_increase_per_round_of_healthy_responses(clock):
+    controller = AimdController(rate=2.0, concurrency=2)
+    request(controller)
+    assert (controller.rate, controller.concurrency) == (2.0, 2)
+    request(controller)
+    assert (controller.rate, controller.concurrency) == (2.5, 3)
+
+    # A round is a second's worth at the current rate, so the next takes three
+    request(controller)
+    request(controller)
+    assert controller.rate == 2.5
+    request(controller)
+    assert (controller.rate, controller.concurrency, controller.increases) == (3.0, 4, 2)
+
+
+def test_increase_stops_at_the_limits(clock):
+    controller = AimdController(rate=1.0, concurrency=2, max_rate=1.5, max_concurrency=3)
+    for _ in range(20):
+        request(controller)
+    assert (controller.rate, controller.concurrency) == (1.5, 3)
+
+
+def test_requests_are_spaced_by_the_rate(clock):
+    controller = AimdController(rate=4.0, concurrency=4)
+    for _ in range(4):
+        controller.acquire()
+    assert clock.now == pytest.approx(3 * 0.25)
+
+
+@pytest.mark.parametrize("signal", [THROTTLED, CHALLENGE, SERVER_ERROR, ERROR])
+def test_multiplicative_decrease_on_congestion(clock, signal):
+    controller = AimdController(rate=8.0, concurrency=8)
+    request(controller, signal)
+    assert (controller.rate, controller.concurrency) == (4.0, 4)
+    assert controller.counts[signal] == 1
+
+    # Responses to requests already in flight are the same episode
+    request(controller, signal)
+    assert (controller.rate, controller.concurrency, controller.decreases) == (4.0, 4, 1)
+
+    clock.now += congestion.DECREASE_HOLD
+    request(controller, signal)
+    assert (controller.rate, controller.concurrency, controller.decreases) == (2.0, 2, 2)
+
+
+def test_decrease_stops_at_the_floors(clock):
+    controller = AimdController(rate=0.3, concurrency=1, min_rate=0.2)
+    request(controller, THROTTLED)
+    assert (controller.rate, controller.concurrency) == (0.2, 1)
+
+
+def test_congestion_resets_the_healthy_round(clock):
+    controller = AimdController(rate=4.0, concurrency=4)
+    for _ in range(3):
+        request(controller)
+    request(controller, THROTTLED)
+    request(controller)
+    assert (controller.rate, controller.increases) == (2.0, 0)
+
+
+def test_latency_climbing_over_its_baseline_is_congestion(clock):
+    controller = AimdController(rate=20.0, concurrency=16)
+    for _ in range(5):
+        request(controller, OK, seconds=0.1)
+    request(controller, OK, seconds=10.0)
+    assert controller.counts[SLOW] == 1
+    assert (controller.rate, controller.concurrency) == (10.0, 8)
+
+
+def test_retry_after_pauses_the_next_acquire(clock):
+    controller = AimdController(rate=10.0, concurrency=4)
+    request(controller, THROTTLED, wait=30.0)
+    start = clock.now
+    controller.acquire()
+    assert clock.now - start == pytest.approx(30.0)
+
+
+def test_acquire_blocks_at_the_concurrency_limit(clock):
+    controller = AimdController(rate=20.0, concurrency=1)
+    controller.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (controller.acquire(), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.1)
+    controller.release(OK)
+    assert acquired.wait(5)
+    waiter.join()
+    assert controller.in_flight == 1
+
+
+def test_save_load_round_trip(clock, tmp_path):
+    path = str(tmp_path / "state.json")
+    controller = AimdController(rate=3.5, concurrency=5)
+    request(controller, THROTTLED, wait=120.0)
+    controller.save(path)
+
+    restored = AimdController.load(path)
+    assert (restored.rate, restored.concurrency) == (controller.rate, controller.concurrency)
+    # The pause carries over into the next run
+    start = clock.now
+    restored.acquire()
+    assert clock.now - start == pytest.approx(120.0)
+
+    assert AimdController.load(path, max_rate=1.0, max_concurrency=1).rate == 1.0
+
+
+def test_load_ignores_old_state_but_keeps_the_pause(clock, tmp_path):
+    path = str(tmp_path / "state.json")
+    AimdController(rate=12.0, concurrency=10).save(path)
+    with open(path) as f:
+        state = json.load(f)
+    state["saved_at"] -= (congestion.STATE_MAX_AGE_DAYS + 1) * 86400
+    state["paused_until"] = clock.time() + 60
+    with open(path, "w") as f:
+        json.dump(state, f)
+
+    controller = AimdController.load(path)
+    assert (controller.rate, controller.concurrency) == (congestion.INITIAL_RATE, congestion.INITIAL_CONCURRENCY)
+    controller.acquire()
+    assert clock.now == pytest.approx(60.0)
+
+
+def test_load_without_usable_state_uses_the_defaults(clock, tmp_path, caplog):
+    controller = AimdController.load(str(tmp_path / "missing.json"))
+    assert (controller.rate, controller.concurrency) == (congestion.INITIAL_RATE, congestion.INITIAL_CONCURRENCY)
+
+    corrupt = tmp_path / "corrupt.json"
+    corrupt.write_text("{not json")
+    controller = AimdController.load(str(corrupt))
+    assert (controller.rate, controller.concurrency) == (congestion.INITIAL_RATE, congestion.INITIAL_CONCURRENCY)
+    assert "unreadable congestion state" in caplog.text
+
+
+@pytest.mark.parametrize("response, signal", [
+    pytest.param(Response(200, "<html>films</html>"), OK, id="ok"),
+    pytest.param(Response(404), OK, id="not-found"),
+    pytest.param(Response(429), THROTTLED, id="throttled"),
+    pytest.param(Response(502), SERVER_ERROR, id="server-error"),
+    pytest.param(Response(403, "<title>Just a moment...</title>"), CHALLENGE, id="challenge-page"),
+    pytest.param(Response(200, headers={"cf-mitigated": "challenge"}), CHALLENGE, id="challenge-header"),
+    pytest.param(Response(403, "Forbidden"), OK, id="plain-403"),
+])
+def test_classify(response, signal):
+    assert congestion.classify(response) == signal
+
+
+def test_retry_after(clock):
+    assert congestion.retry_after(Response(429)) is None
+    assert congestion.retry_after(Response(429, headers={"retry-after": "42"})) == 42.0
+    assert congestion.retry_after(Response(429, headers={"retry-after": "86400"})) == congestion.MAX_RETRY_AFTER
+    assert congestion.retry_after(Response(429, headers={"retry-after": "soon"})) is None
+    when = datetime.fromtimestamp(clock.time() + 90, timezone.utc)
+    assert congestion.retry_after(Response(429, headers={"retry-after": format_datetime(when, usegmt=True)})) \
+        == pytest.approx(90.0, abs=1)
@@ -0,0 +1,49 @@
+import pytest
+from benchmarks import fixtures
+from scraping import extract
+# Imported for the soup/strainer backends they register
+from scraping import members, movie, paginate, user  # noqa: F401
+
+
+PROFILE_PAGE = ('<html><body><h4 class="profile-statistic statistic"><span class="value">1,234</span>'
+                '<span class="definition">Films</span></h4>'
+                '<ul class="rating-histogram">'
+                + "".join(f'<li class="rating-histogram-bar"><a title="{n:,}&nbsp;ratings">x</a></li>' if n else
+                          '<li class="rating-histogram-bar"><i></i></li>'
+                          for n in [0, 3, 12, 1005, 40, 0, 7, 2, 1, 9])
+                + '</ul></body></html>')
+
+CASES = {
+    "films_watched": [(fixtures.rated_films_page(1), ()), (fixtures.rated_films_page(0, n=0), ())],
+    "rated_films": [(fixtures.rated_films_page(n, seed=3), (fixtures.USERNAME,)) for n in (1, 2)],
+    "members": [(fixtures.members_page(1), ()), (fixtures.follows_page(2, pages=3), ()),
+                (fixtures.members_page(0, n=0), ())],
+    "diary_rows": [(fixtures.diary_page(n, pages=3), ()) for n in (1, 2)],
+    "film_metadata": [(fixtures.film_page(film_id), ()) for film_id in (1, 42)],
+    "film_details": [(fixtures.film_details_page(film_id), ()) for film_id in (1, 42)],
+    "page_count": [(fixtures.rated_films_page(1, n=1, pages=1), ()), (fixtures.rated_films_page(5, n=1, pages=9), ()),
+                   (fixtures.diary_page(1, n=1, pages=40), ()), (fixtures.follows_page(1, pages=3), ())],
+    "profile_counts": [(PROFILE_PAGE, ())],
+}
+
+
+@pytest.mark.parametrize("name, html, args", [pytest.param(name, html, args, id=f"{name}-{i}")
+                                               for name, cases in CASES.items()
+                                               for i, (html, args) in enumerate(cases)])
+def test_backends_match_soup(name, html, args):
+    expected = extract.extract(name, html, *args, backend="soup")
+    for backend in extract.BACKENDS:
+        assert extract.extract(name, html, *args, backend=backend) == expected, backend
+
+
+def test_every_extractor_covered():
+    assert set(CASES) == set(extract._extractors)
+
+
+def test_fixture_results():
+    assert len(extract.extract("rated_films", fixtures.rated_films_page(1), fixtures.USERNAME)) == \
+        fixtures.FILMS_PER_PAGE
+    assert extract.extract("page_count", fixtures.rated_films_page(5, pages=9)) == 9
+    assert extract.extract("page_count", fixtures.follows_page(1, pages=3)) is None
+    assert extract.extract("profile_counts", PROFILE_PAGE) == {
+        "films": 1234, "ratings": 1079, "histogram": [0, 3, 12, 1005, 40, 0, 7, 2, 1, 9]}
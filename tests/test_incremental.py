@@ -0,0 +1,63 @@
+import scrape
+from benchmarks import fixtures
+from scraping import extract, user
+from scraping.scraper import RatingScraper
+from utils.storage import ParsingStorage
+
+PAGES = 5
+
+
+def by_date_page(n):
+    return fixtures.rated_films_page(n, n=10, pages=PAGES) if n <= PAGES else fixtures.rated_films_page(n, n=0)
+
+
+def stored(*pages) -> dict:
+    """ {film_id: film_rating} as stored after scraping the given pages """
+    rows = []
+    for n in pages:
+        rows += RatingScraper.rating_rows(extract.extract("rated_films", by_date_page(n), fixtures.USERNAME))
+    return {row[4]: row[5] for row in rows}
+
+
+def test_delta_stops_at_first_known_page(site, backend):
+    fake = site(by_date_page)
+    ratings = user.user_films_rated_delta(user.User(fixtures.USERNAME), stored(1, 2, 3))
+
+    assert fake.requested == [1]
+    assert len(ratings) == 10
+
+
+def test_delta_reads_past_new_and_changed_ratings(site, backend):
+    fake = site(by_date_page)
+    known = stored(2, 3, 4, 5)
+    # Page 1 is all new; page 2 has a re-rated film
+    changed = next(film_id for film_id, rating in known.items() if film_id // 1000 == 2 and rating)
+    known[changed] = 0.5 if known[changed] != 0.5 else 1.0
+    ratings = user.user_films_rated_delta(user.User(fixtures.USERNAME), known)
+
+    assert fake.requested == [1, 2, 3]
+    assert len(ratings) == 30
+
+
+def test_delta_stops_at_the_end_of_the_films(site, backend):
+    fake = site(by_date_page)
+    user.user_films_rated_delta(user.User(fixtures.USERNAME), {})
+    assert fake.requested == list(range(1, PAGES + 2))
+
+
+def test_full_scrape_when_due():
+    db = ParsingStorage(in_memory=True)
+    db.cursor.execute("INSERT INTO users (user, last_updated) VALUES (?, 0)", (fixtures.USERNAME,))
+    db.insert_rating_rows(RatingScraper.rating_rows(extract.extract("rated_films", by_date_page(1),
+                                                                    fixtures.USERNAME)))
+
+    # Never fully scraped: due a full scrape even when incremental
+    rs, full_scrape = scrape.rating_scraper_for(db, fixtures.USERNAME, incremental=True)
+    assert full_scrape and rs.scraping_function is user.user_films_rated
+
+    db.refresh_user(fixtures.USERNAME, full_scrape=True)
+    rs, full_scrape = scrape.rating_scraper_for(db, fixtures.USERNAME, incremental=True)
+    assert not full_scrape and rs.scraping_function is user.user_films_rated_delta
+
+    rs, full_scrape = scrape.rating_scraper_for(db, fixtures.USERNAME, incremental=False)
+    assert full_scrape
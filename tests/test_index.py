@@ -0,0 +1,106 @@
+import numpy as np
+from scipy import sparse
+import scrape
+from suggest.index import NeighbourIndex
+from suggest.ratings import RatingMatrix
+from utils.storage import ParsingStorage
+
+
+def random_matrix(seed=0, n_users=120, n_films=80, density=0.3):
+    rng = np.random.default_rng(seed)
+    ratings = sparse.random(n_users, n_films, density=density, random_state=rng, format="csr",
+                            data_rvs=lambda n: rng.integers(1, 11, n) / 2)
+    return RatingMatrix([f"user{i:03d}" for i in range(n_users)], np.arange(1000, 1000 + n_films), ratings)
+
+
+def random_ratings(matrix, rng, n=30):
+    return {int(f): float(rng.integers(1, 11)) / 2 for f in rng.choice(matrix.film_ids, n, replace=False)}
+
+
+def assert_agree(index, rebuilt, k):
+    assert sorted(index.users) == sorted(rebuilt.users)
+    for u in rebuilt.users:
+        expected = rebuilt.query(u, k)
+        actual = index.query(u, k)
+        assert [s[0] for s in actual] == [s[0] for s in expected], u
+        np.testing.assert_allclose([s[1] for s in actual], [s[1] for s in expected], rtol=1e-5)
+
+
+def test_update_user_matches_build():
+    matrix = random_matrix()
+    index = NeighbourIndex.build(matrix, neighbours=10, min_overlap=3, slack=5)
+    rng = np.random.default_rng(1)
+    for username in ["user005", "user050", "user005", "user119"]:
+        index.update_user(matrix, username, random_ratings(matrix, rng))
+
+    rebuilt = NeighbourIndex.build(matrix, neighbours=10, min_overlap=3, slack=5)
+    assert_agree(index, rebuilt, 10)
+
+
+def test_update_user_adds_new_users():
+    matrix = random_matrix()
+    index = NeighbourIndex.build(matrix, neighbours=10, min_overlap=3, metric="pearson")
+    rng = np.random.default_rng(2)
+    index.update_user(matrix, "newcomer", random_ratings(matrix, rng, 40))
+
+    assert "newcomer" in matrix.user_index
+    rebuilt = NeighbourIndex.build(matrix, neighbours=10, min_overlap=3, metric="pearson")
+    assert_agree(index, rebuilt, 10)
+
+
+def test_short_lists_are_rescored():
+    matrix = random_matrix(n_users=30)
+    index = NeighbourIndex.build(matrix, neighbours=5, min_overlap=3, slack=0)
+    neighbour = index.users[index.neighbours[0, 0]]
+    # Nothing in common with anyone any more: they leave every list they were in
+    index.update_user(matrix, neighbour, {})
+
+    assert neighbour not in [s[0] for s in index.query("user000", 5)]
+    assert len(index.query("user000", 5)) == 5
+
+
+def test_save_load(tmp_path):
+    matrix = random_matrix()
+    index = NeighbourIndex.build(matrix, neighbours=10, min_overlap=3)
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    loaded = NeighbourIndex.load(path)
+    assert loaded.keep == 10
+    assert loaded.neighbours.shape == index.neighbours.shape
+    assert loaded.query("user000") == index.query("user000")
+
+
+def test_set_user_matches_fresh_matrix():
+    matrix = random_matrix()
+    rng = np.random.default_rng(3)
+    updates = {"user007": random_ratings(matrix, rng), "user000": {}, "newcomer": random_ratings(matrix, rng, 12)}
+    for username, ratings in updates.items():
+        matrix.set_user(username, ratings)
+
+    rows = sparse.lil_matrix(random_matrix().ratings)
+    rows.resize(len(matrix.users), len(matrix.film_ids))
+    for username, ratings in updates.items():
+        i = matrix.user_index[username]
+        rows[i, :] = 0
+        for film_id, rating in ratings.items():
+            rows[i, int(np.searchsorted(matrix.film_ids, film_id))] = rating
+    fresh = RatingMatrix(matrix.users, matrix.film_ids, rows.tocsr())
+
+    for name in ("ratings", "centered", "centered_sq", "rated"):
+        np.testing.assert_allclose(getattr(matrix, name).toarray(), getattr(fresh, name).toarray(), atol=1e-5)
+    np.testing.assert_allclose(matrix.means, fresh.means, rtol=1e-5)
+    np.testing.assert_allclose(matrix.norms, fresh.norms, rtol=1e-5)
+
+
+def test_suggest_falls_back_to_matrix_beyond_index_keep(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    matrix = random_matrix()
+    db = ParsingStorage()
+    db.insert_rating_rows([(None, matrix.users[u], "", "", int(matrix.film_ids[f]), float(matrix.ratings[u, f]), 0)
+                           for u, f in zip(*matrix.ratings.nonzero())])
+    db.close()
+    NeighbourIndex.build(matrix, neighbours=5, min_overlap=3, slack=2).save()
+
+    assert len(scrape.cli_suggest("user000", k=5, min_overlap=3)) == 5
+    suggestions = scrape.cli_suggest("user000", k=20, min_overlap=3)
+    assert [s[0] for s in suggestions] == [s[0] for s in matrix.suggest("user000", k=20, min_overlap=3)]
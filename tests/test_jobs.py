@@ -0,0 +1,76 @@
+import time
+import pytest
+from utils.jobs import JobQueue, DONE, FAILED, LEASED, QUEUED
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = JobQueue(str(tmp_path / "jobs.db"), lease_seconds=60, max_attempts=2)
+    yield q
+    q.close()
+
+
+def expire_leases(queue):
+    queue.cursor.execute("UPDATE jobs SET lease_expires = ?", (time.time() - 1,))
+
+
+def test_claim_in_order_and_once(queue):
+    assert queue.enqueue(["a", "b", "c"]) == 3
+    # Already queued
+    assert queue.enqueue(["a"]) == 0
+    assert queue.claim("w1", n=2) == ["a", "b"]
+    assert queue.claim("w2", n=2) == ["c"]
+    assert queue.claim("w3") == []
+    assert queue.counts() == {LEASED: 3}
+
+
+def test_complete_and_requeue(queue):
+    queue.enqueue(["a"])
+    queue.claim("w1")
+    assert not queue.complete("w2", "a")
+    assert queue.complete("w1", "a")
+    assert queue.counts() == {DONE: 1}
+    assert queue.enqueue(["a"]) == 1
+    assert queue.counts() == {QUEUED: 1}
+
+
+def test_expired_lease_is_reclaimed(queue):
+    queue.enqueue(["a"])
+    assert queue.claim("w1") == ["a"]
+    assert queue.heartbeat("w1") == 1
+    assert queue.claim("w2") == []
+
+    expire_leases(queue)
+    assert queue.claim("w2") == ["a"]
+    # w1 lost the lease
+    assert not queue.complete("w1", "a")
+    assert queue.complete("w2", "a")
+
+
+def test_max_attempts(queue):
+    queue.enqueue(["a", "b"])
+    queue.claim("w1", n=2)
+    assert queue.fail("w1", "a", "boom")
+    expire_leases(queue)
+    # b's expired lease is its first attempt, so it can be claimed again
+    assert sorted(queue.claim("w2", n=2)) == ["a", "b"]
+
+    # Second attempts: a fails outright, b's lease expires again
+    assert queue.fail("w2", "a", "boom")
+    expire_leases(queue)
+    assert queue.claim("w3") == []
+    assert queue.counts() == {FAILED: 2}
+    queue.cursor.execute("SELECT user, attempts, last_error FROM jobs ORDER BY user")
+    assert queue.cursor.fetchall() == [("a", 2, "boom"), ("b", 2, "lease expired")]
+
+
+def test_failed_enqueue_rolls_back(queue):
+    def usernames():
+        yield "a"
+        raise RuntimeError("bad input")
+
+    with pytest.raises(RuntimeError):
+        queue.enqueue(usernames())
+    assert not queue.connection.in_transaction
+    assert queue.counts() == {}
+    assert queue.enqueue(["a"]) == 1
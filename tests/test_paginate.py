@@ -0,0 +1,63 @@
+from benchmarks import fixtures
+from scraping import extract, paginate
+from scraping.user import User, user_followers, user_following
+
+
+def url_for_page(n):
+    return f"https://letterboxd.com/{fixtures.USERNAME}/films/page/{n}/"
+
+
+def rated_films(html):
+    return extract.extract("rated_films", html, fixtures.USERNAME)
+
+
+def test_paginator_pages_fanned_out_in_order(site, backend):
+    pages = 12
+    fake = site(lambda n: fixtures.rated_films_page(n, n=3, pages=pages))
+    results = list(paginate.iter_pages(url_for_page, rated_films, workers=2))
+
+    assert [page_no for page_no, _ in results] == list(range(1, pages + 1))
+    assert sorted(fake.requested) == list(range(1, pages + 1))
+    assert fake.peak <= 2
+
+
+def test_window_bounds_pages_fetched_ahead(site, backend):
+    fake = site(lambda n: fixtures.rated_films_page(n, n=3, pages=50))
+    pages = paginate.iter_pages(url_for_page, rated_films, workers=2)
+    for _ in range(3):
+        next(pages)
+    pages.close()
+    # The first page, then at most workers * WINDOW_PER_WORKER ahead of the consumer
+    assert len(fake.requested) <= 3 + 2 * paginate.WINDOW_PER_WORKER
+
+
+def test_no_paginator_probes_until_empty_page(site, backend):
+    fake = site(lambda n: fixtures.rated_films_page(n, n=3 if n <= 4 else 0))
+    results = paginate.paginate(url_for_page, rated_films)
+
+    assert len(results) == 4 * 3
+    assert fake.requested == [1, 2, 3, 4, 5]
+
+
+def test_no_paginator_empty_first_page(site, backend):
+    fake = site(lambda n: fixtures.rated_films_page(n, n=0))
+    assert paginate.paginate(url_for_page, rated_films) == []
+    assert fake.requested == [1]
+
+
+def test_follows_read_past_first_page(site, backend):
+    pages = 4
+    fake = site(lambda n: fixtures.follows_page(n, pages=pages) if n <= pages else fixtures.follows_page(n, n=0))
+    following = user_following(User(fixtures.USERNAME))
+
+    assert len(following) == pages * fixtures.FOLLOWS_PER_PAGE
+    assert following[0] == "member100" and following[-1] == f"member{pages * 100 + fixtures.FOLLOWS_PER_PAGE - 1}"
+    assert fake.requested == list(range(1, pages + 2))
+
+
+def test_follows_max_pages(site, backend):
+    fake = site(lambda n: fixtures.follows_page(n, pages=10, direction="followers"))
+    followers = user_followers(User(fixtures.USERNAME), max_pages=2)
+
+    assert len(followers) == 2 * fixtures.FOLLOWS_PER_PAGE
+    assert fake.requested == [1, 2]
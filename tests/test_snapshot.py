@@ -0,0 +1,59 @@
+import numpy as np
+from suggest.ratings import RatingMatrix
+from suggest.snapshot import Snapshot, load_matrix, write_snapshot
+from utils.storage import ParsingStorage
+
+
+def rating_rows():
+    rng = np.random.default_rng(0)
+    rows = []
+    for u in range(20):
+        for f in rng.choice(50, 15, replace=False):
+            # Some films logged without a rating, and user000 rates nothing
+            rating = None if u == 0 or rng.random() < 0.2 else float(rng.integers(1, 11)) / 2
+            rows.append((None, f"user{u:03d}", f"Film {f}", f"/film/film-{f}/", int(f) + 100, rating, 1000 + u))
+    return rows
+
+
+def make_db():
+    db = ParsingStorage(in_memory=True)
+    db.insert_rating_rows(rating_rows())
+    return db
+
+
+def assert_same_matrix(a: RatingMatrix, b: RatingMatrix):
+    assert a.users == b.users
+    np.testing.assert_array_equal(a.film_ids, b.film_ids)
+    np.testing.assert_array_equal(a.ratings.toarray(), b.ratings.toarray())
+    np.testing.assert_allclose(a.norms, b.norms, rtol=1e-6)
+
+
+def test_snapshot_matrix_matches_db(tmp_path):
+    db = make_db()
+    path = str(tmp_path / "snapshot")
+    meta = write_snapshot(db, path)
+    assert meta["ratings"] == db.count_ratings(rated_only=False)
+    assert meta["stars"] == db.count_ratings(rated_only=True)
+
+    snapshot = Snapshot(path)
+    matrix = snapshot.to_matrix()
+    assert_same_matrix(matrix, RatingMatrix.from_db(db))
+    assert "user000" not in matrix.user_index
+    # Built over the mmaps, not copies of them
+    assert np.shares_memory(matrix.ratings.data, snapshot.stars)
+    assert np.shares_memory(matrix.ratings.indices, snapshot.star_films)
+    assert np.shares_memory(matrix.ratings.indptr, snapshot.star_offsets)
+
+
+def test_load_matrix_falls_back_when_stale(tmp_path, caplog):
+    caplog.set_level("INFO")
+    db = make_db()
+    path = str(tmp_path / "snapshot")
+    write_snapshot(db, path)
+    load_matrix(db, path)
+    assert "Loading ratings from snapshot" in caplog.text
+
+    db.insert_rating_rows([(None, "user001", "New", "/film/new/", 999, 4.0, 5000)])
+    matrix = load_matrix(db, path)
+    assert "out of date" in caplog.text
+    assert 999 in matrix.film_ids
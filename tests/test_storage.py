@@ -0,0 +1,197 @@
+import sqlite3
+import pytest
+from scraping.scraper import rating_id
+from utils import storage
+from utils.storage import ParsingStorage, OutdatedSchemaError, SCHEMA_VERSION
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "scrape_store.db")
+    monkeypatch.setattr(storage, "SCRAPE_DB", path)
+    return path
+
+
+def make_v0_db(path):
+    """ The original layout: a ratings row per scrape, under random ids """
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE users(id INTEGER PRIMARY KEY, user TEXT, last_updated INTEGER)")
+    connection.execute("CREATE TABLE ratings(id INTEGER PRIMARY KEY, user TEXT, film_title TEXT, film_url TEXT, "
+                       "film_id INTEGER, film_rating REAL, last_updated INTEGER)")
+    connection.executemany("INSERT INTO users (id, user, last_updated) VALUES (?, ?, ?)",
+                           [(1, "alice", 300), (2, "bob", 300)])
+    connection.executemany("INSERT INTO ratings (id, user, film_title, film_url, film_id, film_rating, last_updated) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?)", [
+                               (11, "alice", "Film 1", "/film/1/", 1, 3.0, 100),
+                               (12, "alice", "Film 1", "/film/1/", 1, 4.0, 200),
+                               (13, "alice", "Film 2", "/film/2/", 2, None, 100),
+                               (14, "bob", "Film 1", "/film/1/", 1, 2.5, 100),
+                               (15, "bob", "Film 1", "/film/1/", 1, 2.5, 300),
+                           ])
+    connection.commit()
+    connection.close()
+
+
+def test_outdated_schema_needs_migrate(db_path):
+    make_v0_db(db_path)
+    with pytest.raises(OutdatedSchemaError):
+        ParsingStorage()
+
+
+def test_migrate_from_v0(db_path):
+    make_v0_db(db_path)
+    db = ParsingStorage(migrate=True)
+    assert db.schema_version() == SCHEMA_VERSION
+
+    db.cursor.execute("SELECT id, user, film_id, film_rating, last_updated FROM ratings ORDER BY user, film_id")
+    assert db.cursor.fetchall() == [
+        (rating_id(1, "alice"), "alice", 1, 4.0, 200),
+        (rating_id(2, "alice"), "alice", 2, None, 100),
+        (rating_id(1, "bob"), "bob", 1, 2.5, 300),
+    ]
+    db.cursor.execute("SELECT user, last_full_scrape, rating_count, profile_stats FROM users ORDER BY user")
+    assert db.cursor.fetchall() == [("alice", 0, 2, None), ("bob", 0, 1, None)]
+    # Now unique on (user, film_id)
+    with pytest.raises(sqlite3.IntegrityError):
+        db.cursor.execute("INSERT INTO ratings (user, film_id) VALUES ('bob', 1)")
+    db.close()
+
+    # Already migrated: opens without migrate
+    ParsingStorage().close()
+
+
+def upsert(db, rating, last_updated, title="Film 1"):
+    db.insert_rating_rows([(rating_id(1, "alice"), "alice", title, "/film/1/", 1, rating, last_updated)])
+    db.cursor.execute("SELECT film_title, film_rating, last_updated FROM ratings WHERE user = 'alice'")
+    rows = db.cursor.fetchall()
+    assert len(rows) == 1
+    return rows[0]
+
+
+def test_upsert_only_touches_changed_ratings():
+    db = ParsingStorage(in_memory=True)
+    assert upsert(db, 3.0, 100) == ("Film 1", 3.0, 100)
+    # Same rating re-scraped: the row keeps when it last changed
+    assert upsert(db, 3.0, 200, title="Film One") == ("Film 1", 3.0, 100)
+    assert upsert(db, 3.5, 300, title="Film One") == ("Film One", 3.5, 300)
+    # Rating removed, then re-scraped without one; NULLs compare equal
+    assert upsert(db, None, 400) == ("Film 1", None, 400)
+    assert upsert(db, None, 500) == ("Film 1", None, 400)
+    assert db.ratings_version() == {"ratings": 1, "last_updated": 400}
+
+
+NOW = 1_700_000_000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ Sets the time ParsingStorage sees, as epoch seconds """
+    class Clock(storage.datetime):
+        now = NOW
+
+        @classmethod
+        def utcnow(cls):
+            return storage.datetime.utcfromtimestamp(cls.now)
+
+    monkeypatch.setattr(storage, "datetime", Clock)
+    return Clock
+
+
+def add_user(db, username, last_updated=0, change_rate=None, ratings=0, ratings_updated=0):
+    db.cursor.execute("INSERT INTO users (user, last_updated, change_rate, rating_count) VALUES (?, ?, ?, ?)",
+                      (username, last_updated, change_rate, ratings))
+    db.insert_rating_rows([(None, username, "", "", film_id, 3.0, ratings_updated) for film_id in range(ratings)])
+
+
+def rerate(db, username, films, when):
+    db.insert_rating_rows([(None, username, "", "", film_id, 4.5, when) for film_id in range(films)])
+
+
+def schedule(db, username):
+    db.cursor.execute("SELECT change_rate, next_refresh FROM users WHERE user = ?", (username,))
+    change_rate, next_refresh = db.cursor.fetchone()
+    return change_rate, (next_refresh - NOW) / storage.DAY
+
+
+def test_unchanged_user_backs_off(clock):
+    db = ParsingStorage(in_memory=True)
+    week_ago = NOW - 7 * storage.DAY
+    add_user(db, "steady", last_updated=week_ago, change_rate=2.0, ratings=100, ratings_updated=week_ago - 1)
+    add_user(db, "dormant", last_updated=week_ago, ratings=100, ratings_updated=week_ago - 1)
+
+    db.refresh_user("steady", full_scrape=False)
+    change_rate, days = schedule(db, "steady")
+    # Nothing changed: the rate decays towards 0, so the next refresh is further off than the rate alone implied
+    assert change_rate == pytest.approx((1 - storage.CHANGE_RATE_ALPHA) * 2.0)
+    assert days == pytest.approx(storage.REFRESH_TARGET_RATINGS / change_rate, abs=1e-4)
+    assert days > storage.REFRESH_TARGET_RATINGS / 2.0
+
+    db.refresh_user("dormant", full_scrape=False)
+    assert schedule(db, "dormant") == (0.0, storage.MAX_REFRESH_DAYS)
+
+
+def test_changed_user_is_pulled_forward(clock):
+    db = ParsingStorage(in_memory=True)
+    week_ago = NOW - 7 * storage.DAY
+    add_user(db, "busy", last_updated=week_ago, ratings=100, ratings_updated=week_ago - 1)
+    rerate(db, "busy", 35, NOW - storage.DAY)
+
+    db.refresh_user("busy", full_scrape=False)
+    change_rate, days = schedule(db, "busy")
+    assert change_rate == pytest.approx(35 / 7)
+    assert days == pytest.approx(storage.REFRESH_TARGET_RATINGS / change_rate, abs=1e-4)
+    assert days < storage.DEFAULT_REFRESH_DAYS
+
+    # A burst far above the target is still refreshed at most daily
+    clock.now += 2 * storage.DAY
+    rerate(db, "busy", 100, clock.now - 1)
+    db.refresh_user("busy", full_scrape=False)
+    db.cursor.execute("SELECT next_refresh FROM users WHERE user = 'busy'")
+    assert db.cursor.fetchone()[0] == clock.now + storage.MIN_REFRESH_DAYS * storage.DAY
+
+
+def test_stale_users_order(clock):
+    db = ParsingStorage(in_memory=True)
+    long_ago = NOW - 30 * storage.DAY
+    add_user(db, "never")
+    add_user(db, "slow", last_updated=long_ago, change_rate=0.1, ratings=50)
+    add_user(db, "fast", last_updated=long_ago, change_rate=5.0, ratings=50)
+    add_user(db, "huge", last_updated=long_ago, change_rate=5.0, ratings=5000)
+    add_user(db, "not_due", last_updated=NOW - storage.DAY)
+    add_user(db, "scheduled_later", last_updated=long_ago)
+    db.cursor.execute("UPDATE users SET next_refresh = ? WHERE user = 'scheduled_later'", (NOW + 1,))
+    db.cursor.execute("UPDATE users SET next_refresh = ? WHERE user IN ('slow', 'fast', 'huge')", (NOW - 1,))
+
+    # Never scraped first, then by expected new ratings per page a full scrape costs
+    assert db.get_stale_users() == ["never", "fast", "huge", "slow"]
+
+
+def test_needs_full_scrape(clock):
+    db = ParsingStorage(in_memory=True)
+    add_user(db, "alice", last_updated=NOW - storage.DAY, ratings=10)
+    assert db.needs_full_scrape("alice")
+
+    db.refresh_user("alice", full_scrape=True)
+    assert not db.needs_full_scrape("alice")
+
+    # Incremental refreshes don't reset the clock on the periodic full re-scrape
+    clock.now += (storage.FULL_SCRAPE_DAYS - 1) * storage.DAY
+    db.refresh_user("alice", full_scrape=False)
+    assert not db.needs_full_scrape("alice")
+    clock.now += 2 * storage.DAY
+    db.refresh_user("alice", full_scrape=False)
+    assert db.needs_full_scrape("alice")
+
+
+def test_incremental_cost_only_once_full_scrape_is_recent(clock):
+    db = ParsingStorage(in_memory=True)
+    long_ago = NOW - 30 * storage.DAY
+    add_user(db, "small", last_updated=long_ago, change_rate=1.0, ratings=50)
+    add_user(db, "big", last_updated=long_ago, change_rate=1.0, ratings=5000)
+    db.cursor.execute("UPDATE users SET next_refresh = ?", (NOW - 1,))
+    assert db.get_stale_users(incremental=True) == ["small", "big"]
+
+    # big's last full scrape is recent, so an incremental refresh only costs the pages its new ratings fill
+    db.cursor.execute("UPDATE users SET last_full_scrape = ? WHERE user = 'big'", (NOW - storage.DAY,))
+    assert db.get_stale_users(incremental=True) == ["big", "small"]
+    assert db.get_stale_users(incremental=False) == ["small", "big"]
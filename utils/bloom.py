@@ -0,0 +1,64 @@
+"""
+Bloom filter: a compact set that answers "definitely not seen" or "probably seen".
+
+Used as the follow-graph crawler's seen-set, so millions of usernames cost about 10 bits each instead of a DB lookup
+per username. It serializes to bytes for storing in the scrape DB (see ParsingStorage.save_bloom).
+"""
+import hashlib
+import logging
+import math
+
+
+logger = logging.getLogger(__name__)
+
+CAPACITY = 1_000_000
+ERROR_RATE = 0.01
+
+
+class BloomFilter:
+    def __init__(self, capacity=CAPACITY, error_rate=ERROR_RATE, bits: bytes = None, count=0):
+        """
+        :param capacity: items the filter is sized for; past it, the false-positive rate climbs above error_rate
+        :param bits: a serialized bit array (see to_bytes) to restore
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # Optimal sizing, per https://en.wikipedia.org/wiki/Bloom_filter#Optimal_number_of_hash_functions
+        self.m = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.k = max(1, round(self.m / capacity * math.log(2)))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.m + 7) // 8)
+        if len(self.bits) != (self.m + 7) // 8:
+            raise Exception(f"Bloom filter bits don't match capacity={capacity}, error_rate={error_rate}")
+        self.count = count
+
+    def _positions(self, item: str):
+        # Kirsch-Mitzenmacher double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def add(self, item: str) -> bool:
+        """ Add item. :return: True if it was (definitely) new """
+        new = False
+        for pos in self._positions(item):
+            byte, bit = divmod(pos, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                new = True
+        if new:
+            self.count += 1
+            if self.count == self.capacity + 1:
+                logger.warning(f"Bloom filter is past its capacity of {self.capacity}: "
+                               f"false positives will exceed {self.error_rate:.1%}")
+        return new
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos // 8] & (1 << (pos % 8)) for pos in self._positions(item))
+
+    def __len__(self) -> int:
+        """ Items added (approximately: an item colliding with earlier ones entirely isn't counted) """
+        return self.count
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.bits)
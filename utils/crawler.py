@@ -0,0 +1,96 @@
+"""
+Breadth-first crawl of the Letterboxd follow graph, to discover users beyond the popular-members listings.
+
+Starting from seed users, each user taken off the frontier has their following and followers lists scraped (several
+users at once, on a thread pool); the edges go into the follows table, and every user seen for the first time joins
+the users table (so the rating scrapes pick them up) and the frontier, one hop further from the seeds.
+
+The frontier lives in the crawl_frontier table and the seen-set is a Bloom filter saved alongside it, both updated in
+the same transaction as each batch's edges, so a crawl can be stopped and resumed at any point without re-fetching
+users it has already expanded. Users only leave the frontier once expanded, so raising the depth limit on a later run
+carries on from where the previous one stopped.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from scraping import user
+from utils.bloom import BloomFilter
+
+
+logger = logging.getLogger(__name__)
+
+CRAWL_WORKERS = 4
+CRAWL_BATCH = 50
+CRAWL_DEPTH = 2
+# Following/followers pages (25 users each) fetched per user, so a handful of huge accounts can't stall the crawl
+MAX_FOLLOW_PAGES = 20
+MAX_ATTEMPTS = 3
+BLOOM_NAME = "follow_crawl"
+BLOOM_CAPACITY = 2_000_000
+
+
+class FollowCrawler:
+    def __init__(self, db, max_depth=CRAWL_DEPTH, workers=CRAWL_WORKERS, batch_size=CRAWL_BATCH,
+                 max_pages=MAX_FOLLOW_PAGES, bloom_capacity=BLOOM_CAPACITY):
+        """
+        :param max_depth: expand users fewer than this many hops from a seed; users at max_depth are discovered
+            (added to users and the frontier) but not expanded
+        :param bloom_capacity: sizes a new seen-set; an existing one is loaded as it was saved
+        """
+        self.db = db
+        self.max_depth = max_depth
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_pages = max_pages
+        self.bloom = db.load_bloom(BLOOM_NAME) or BloomFilter(bloom_capacity)
+        self.crawled = 0
+        self.discovered = 0
+        self.failed = 0
+
+    def seed(self, usernames) -> int:
+        """ Put users on the frontier at depth 0, unless the crawl has seen them already. :return: users added """
+        seeds = [(u.lower(), 0) for u in usernames if self.bloom.add(u.lower())]
+        self.db.store_crawl_batch([], [], seeds, BLOOM_NAME, self.bloom, MAX_ATTEMPTS)
+        return len(seeds)
+
+    def _fetch(self, username: str):
+        userinfo = user.User(username)
+        return (user.user_following(userinfo, max_pages=self.max_pages),
+                user.user_followers(userinfo, max_pages=self.max_pages))
+
+    def run(self, max_users=None) -> dict:
+        """ Expand frontier users breadth-first until none are left within max_depth, or max_users are done """
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="crawl") as pool:
+            while max_users is None or self.crawled < max_users:
+                n = self.batch_size if max_users is None else min(self.batch_size, max_users - self.crawled)
+                batch = self.db.get_crawl_frontier(n, self.max_depth)
+                if not batch:
+                    break
+                futures = [pool.submit(self._fetch, username) for username, _, _ in batch]
+
+                crawled, failed, discovered = [], [], []
+                for (username, depth, attempts), future in zip(batch, futures):
+                    try:
+                        following, followers = future.result()
+                    except Exception as e:
+                        logger.error(f"Couldn't fetch follows of '{username}' (attempt {attempts + 1}): {e}")
+                        failed.append(username)
+                        continue
+                    crawled.append((username, following, followers))
+                    for neighbour in following + followers:
+                        if self.bloom.add(neighbour):
+                            discovered.append((neighbour, depth + 1))
+                self.db.store_crawl_batch(crawled, failed, discovered, BLOOM_NAME, self.bloom, MAX_ATTEMPTS)
+
+                self.crawled += len(crawled)
+                self.failed += len(failed)
+                self.discovered += len(discovered)
+                logger.info(f"Crawled {self.crawled} users ({self.failed} failed), discovered {self.discovered}; "
+                            f"{self.db.count_crawl_frontier(self.max_depth)} left within depth {self.max_depth}")
+
+        stats = {"crawled": self.crawled, "failed": self.failed, "discovered": self.discovered,
+                 "frontier": self.db.count_crawl_frontier(), "seen": len(self.bloom),
+                 "seconds": time.perf_counter() - start}
+        logger.info(f"Follow crawl finished: {stats}")
+        return stats
@@ -0,0 +1,91 @@
+"""
+Film metadata loader for the films table.
+
+Each film's page and details/ page are fetched once (Movie keeps the pages it has fetched) and each is parsed in a
+single pass by the film_metadata and film_details extractors. Films fetched in the last FILM_TTL_DAYS are skipped.
+Pages are fetched on a thread pool over the shared session in scraping.fetch, while the calling thread owns the DB
+connection and writes finished films in batches.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from scraping.movie import Movie, movie_details
+from utils.storage import FILM_TTL_DAYS
+
+
+logger = logging.getLogger(__name__)
+
+FILM_WORKERS = 4
+WRITE_BATCH = 200
+
+
+def film_slug(film_url: str) -> str:
+    """ "/film/the-thing/" -> "the-thing" """
+    return film_url.strip("/").split("/")[-1]
+
+
+def parse_year(year: str):
+    return int(year) if year and year.isdigit() else None
+
+
+def parse_average_rating(rating: str):
+    """ "3.45 out of 5" -> 3.45, or None for films without enough ratings """
+    try:
+        return float(rating.split()[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def load_film(film_id: int, film_title: str, film_url: str) -> dict:
+    """ Fetch and parse one film into a row for ParsingStorage.insert_films """
+    movie = Movie(film_url)
+    details = movie_details(movie)
+    if hasattr(movie, "director"):
+        directors = [movie.director]
+    else:
+        directors = getattr(movie, "directors", [])
+    return {
+        "film_id": film_id,
+        "slug": film_slug(film_url),
+        "title": film_title,
+        "year": parse_year(movie.year),
+        "average_rating": parse_average_rating(movie.rating),
+        "fetched_at": int(datetime.utcnow().timestamp()),
+        "directors": directors,
+        "genres": movie.genres,
+        "countries": details["Country"],
+        "studios": details["Studio"],
+        "languages": details["Language"],
+    }
+
+
+def enrich_films(db, max_films=None, workers=FILM_WORKERS, write_batch=WRITE_BATCH, ttl_days=FILM_TTL_DAYS) -> tuple:
+    """
+    Load every rated film that's missing from the films table (or older than ttl_days), up to max_films
+    :return: (films loaded, films that failed)
+    """
+    films = db.get_films_to_enrich(ttl_days)
+    if max_films:
+        films = films[:max_films]
+    logger.info(f"Enriching {len(films)} films with {workers} workers")
+
+    loaded, failed, batch = 0, 0, []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(load_film, *film): film for film in films}
+        for future in as_completed(futures):
+            film_id, _, film_url = futures[future]
+            try:
+                batch.append(future.result())
+            except Exception as e:
+                logger.error(f"Couldn't load film {film_id} ({film_url}): {e}")
+                failed += 1
+                continue
+            if len(batch) >= write_batch:
+                db.insert_films(batch)
+                loaded += len(batch)
+                batch.clear()
+    if batch:
+        db.insert_films(batch)
+        loaded += len(batch)
+    logger.info(f"Loaded {loaded} films, {failed} failed")
+    return loaded, failed
@@ -0,0 +1,164 @@
+"""
+Durable per-user scrape job queue, stored in the scrape DB so several worker processes can drain it without
+scraping the same user twice.
+
+A worker claims a job by taking a time-limited lease on it and keeps the lease alive with heartbeats while it works.
+A worker that crashes stops heartbeating, its leases expire, and the next claim by any worker picks those jobs up
+again. Each claim counts as an attempt; jobs that keep failing are parked as "failed" after MAX_ATTEMPTS.
+
+Workers on other machines need the DB file on storage with working sqlite locking (not a typical network share).
+"""
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from utils.storage import SCRAPE_DB, BUSY_TIMEOUT
+
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 10 * 60
+HEARTBEAT_SECONDS = 60
+MAX_ATTEMPTS = 3
+
+JOBS_TABLE = ("jobs(user TEXT PRIMARY KEY, state TEXT NOT NULL, attempts INTEGER DEFAULT 0, lease_owner TEXT, "
+              "lease_expires REAL, enqueued_at REAL, updated_at REAL, last_error TEXT)")
+
+QUEUED, LEASED, DONE, FAILED = "queued", "leased", "done", "failed"
+
+
+def worker_id() -> str:
+    """ Unique name for this process, across machines sharing the DB """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    def __init__(self, path=SCRAPE_DB, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Autocommit, with explicit BEGIN IMMEDIATE where a read has to be followed by a write atomically.
+        # The heartbeat thread shares the connection, behind the lock.
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                          check_same_thread=False)
+        self.cursor = self.connection.cursor()
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {JOBS_TABLE}")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs(state, enqueued_at)")
+
+    @contextmanager
+    def _immediate(self):
+        """ A BEGIN IMMEDIATE transaction, committed at the end or rolled back if anything in it fails """
+        self.cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            self.cursor.execute("COMMIT")
+        except BaseException:
+            self.cursor.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, usernames) -> int:
+        """
+        Queue a scrape for each user, unless one is already queued or leased; users queued together are claimed in
+        the order given. :return: jobs (re)queued
+        """
+        now = time.time()
+        with self._lock, self._immediate():
+            before = self.connection.total_changes
+            self.cursor.executemany("INSERT INTO jobs (user, state, attempts, enqueued_at, updated_at) "
+                                    "VALUES (?, ?, 0, ?, ?) "
+                                    "ON CONFLICT(user) DO UPDATE SET state = excluded.state, attempts = 0, "
+                                    "lease_owner = NULL, lease_expires = NULL, last_error = NULL, "
+                                    "enqueued_at = excluded.enqueued_at, updated_at = excluded.updated_at "
+                                    f"WHERE jobs.state IN ('{DONE}', '{FAILED}')",
+                                    ((u, QUEUED, now, now) for u in usernames))
+            queued = self.connection.total_changes - before
+        return queued
+
+    def claim(self, owner: str, n=1) -> list:
+        """
+        Lease up to n jobs to owner, oldest first: queued ones, and leased ones whose lease has expired.
+        Expired jobs that have used up their attempts are marked failed instead.
+        :return: the claimed usernames
+        """
+        now = time.time()
+        with self._lock, self._immediate():
+            self.cursor.execute(f"UPDATE jobs SET state = '{FAILED}', lease_owner = NULL, updated_at = ?, "
+                                "last_error = COALESCE(last_error, 'lease expired') "
+                                f"WHERE state = '{LEASED}' AND lease_expires < ? AND attempts >= ?",
+                                (now, now, self.max_attempts))
+            self.cursor.execute(f"SELECT user FROM jobs WHERE state = '{QUEUED}' "
+                                f"OR (state = '{LEASED}' AND lease_expires < ?) ORDER BY enqueued_at, rowid LIMIT ?",
+                                (now, n))
+            users = [row[0] for row in self.cursor.fetchall()]
+            for u in users:
+                self.cursor.execute(f"UPDATE jobs SET state = '{LEASED}', lease_owner = ?, lease_expires = ?, "
+                                    "attempts = attempts + 1, updated_at = ? WHERE user = ?",
+                                    (owner, now + self.lease_seconds, now, u))
+        return users
+
+    def heartbeat(self, owner: str) -> int:
+        """ Extend every lease owner holds. :return: leases extended """
+        now = time.time()
+        with self._lock:
+            self.cursor.execute("UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE lease_owner = ? "
+                                f"AND state = '{LEASED}'", (now + self.lease_seconds, now, owner))
+            return self.cursor.rowcount
+
+    def complete(self, owner: str, username: str) -> bool:
+        """ Mark owner's job for username done. False if the lease was lost (expired and re-claimed) meanwhile. """
+        with self._lock:
+            self.cursor.execute(f"UPDATE jobs SET state = '{DONE}', lease_owner = NULL, lease_expires = NULL, "
+                                f"updated_at = ? WHERE user = ? AND lease_owner = ? AND state = '{LEASED}'",
+                                (time.time(), username, owner))
+            return self.cursor.rowcount == 1
+
+    def fail(self, owner: str, username: str, error: str) -> bool:
+        """
+        Give a job back for retry, at the back of the queue, or park it as failed once it has used up its attempts
+        """
+        now = time.time()
+        with self._lock:
+            self.cursor.execute(f"UPDATE jobs SET state = CASE WHEN attempts >= ? THEN '{FAILED}' ELSE '{QUEUED}' "
+                                "END, lease_owner = NULL, lease_expires = NULL, last_error = ?, enqueued_at = ?, "
+                                f"updated_at = ? WHERE user = ? AND lease_owner = ? AND state = '{LEASED}'",
+                                (self.max_attempts, error, now, now, username, owner))
+            return self.cursor.rowcount == 1
+
+    def counts(self) -> dict:
+        """ {state: number of jobs} """
+        with self._lock:
+            self.cursor.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+            return dict(self.cursor.fetchall())
+
+    def close(self):
+        self.connection.close()
+
+
+class Heartbeat:
+    """ Context manager extending owner's leases every interval seconds on a background thread """
+    def __init__(self, queue: JobQueue, owner: str, interval=HEARTBEAT_SECONDS):
+        self.queue = queue
+        self.owner = owner
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="job-heartbeat", daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.queue.heartbeat(self.owner)
+            except sqlite3.Error as e:
+                # Keep trying: the lease only lapses if we miss heartbeats for a whole LEASE_SECONDS
+                logger.warning(f"Heartbeat for {self.owner} failed: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join()
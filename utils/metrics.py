@@ -0,0 +1,224 @@
+"""
+Run metrics: latency histograms and counters for the scrape hot paths (HTTP fetches, HTML extraction, result
+structuring, storage calls), labelled by URL class or operation, and dumped at the end of a run as a JSON summary
+and a Prometheus text-format file (e.g. for node_exporter's textfile collector).
+"""
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = "metrics"
+PREFIX = "letterboxd_scrape_"
+
+# Seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# First matching pattern wins
+URL_CLASSES = [
+    (re.compile(r"letterboxd\.com/film/[^/]+/details/$"), "film_details"),
+    (re.compile(r"letterboxd\.com/film/[^/]+/$"), "film"),
+    (re.compile(r"/films/diary/"), "diary"),
+    (re.compile(r"/films/(by/[^/]+/)?(page/\d+/)?$"), "films_grid"),
+    (re.compile(r"/members/"), "members"),
+    (re.compile(r"/(following|followers)/"), "follows"),
+    (re.compile(r"/list/"), "list"),
+    (re.compile(r"letterboxd\.com/[A-Za-z0-9_]+/$"), "profile"),
+]
+
+HELP = {
+    "http_request_seconds": "Wall time of a single HTTP request, body included",
+    "http_ttfb_seconds": "Time to response headers, connection setup included (requests' Response.elapsed)",
+    "http_body_seconds": "Time spent reading the response body after the headers",
+    "http_requests_total": "HTTP responses by status",
+    "http_response_bytes_total": "Response body bytes (decompressed)",
+    "http_errors_total": "Requests that failed with a connection error or timeout",
+    "http_cache_total": "Page lookups through the response cache, by outcome",
+    "http_challenges_total": "Cloudflare challenge pages served instead of the page asked for",
+    "http_congestion_total": "Responses seen by the congestion controller, by the signal they carried",
+    "extract_seconds": "HTML -> results extraction time",
+    "structure_seconds": "Time structuring scraped results into DB objects",
+    "structure_rows_total": "Rows structured into DB objects",
+    "storage_seconds": "Time spent in ParsingStorage calls",
+    "precheck_total": "Users pre-checked against their profile counters, by outcome",
+}
+
+
+def url_class(url: str) -> str:
+    for pattern, name in URL_CLASSES:
+        if pattern.search(url):
+            return name
+    return "other"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """ Upper bound of the bucket holding the q-th quantile (inf if it's past the last bucket) """
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.started_at = time.time()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            key = self._key(name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def inc(self, name: str, value=1, **labels):
+        with self._lock:
+            key = self._key(name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.started_at = time.time()
+
+    def summary(self) -> dict:
+        with self._lock:
+            histograms = [
+                {"name": name, "labels": dict(labels), "count": h.count, "sum": h.sum,
+                 "mean": h.sum / h.count if h.count else 0.0,
+                 "p50": h.quantile(0.5), "p90": h.quantile(0.9), "p99": h.quantile(0.99),
+                 "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.counts))}
+                for (name, labels), h in self.histograms.items()
+            ]
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in self.counters.items()]
+        # Biggest consumers of the run's time first
+        histograms.sort(key=lambda h: h["sum"], reverse=True)
+        counters.sort(key=lambda c: (c["name"], sorted(c["labels"].items())))
+        return {
+            "started_at": datetime.utcfromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "duration_s": time.time() - self.started_at,
+            "histograms": histograms,
+            "counters": counters,
+        }
+
+    def prometheus(self) -> str:
+        def label_str(labels, extra=()):
+            pairs = [f'{k}="{v}"' for k, v in tuple(labels) + tuple(extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for (n, labels), h in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip([str(b) for b in h.buckets] + ["+Inf"], h.counts):
+                        cumulative += count
+                        lines.append(f"{PREFIX}{name}_bucket{label_str(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{PREFIX}{name}_sum{label_str(labels)} {h.sum}")
+                    lines.append(f"{PREFIX}{name}_count{label_str(labels)} {h.count}")
+            for name in sorted({n for n, _ in self.counters}):
+                lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{PREFIX}{name}{label_str(labels)} {value}")
+        lines.append(f"# TYPE {PREFIX}run_duration_seconds gauge")
+        lines.append(f"{PREFIX}run_duration_seconds {time.time() - self.started_at}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, directory=METRICS_DIR, name="scrape") -> tuple:
+        """
+        Write <name>_<timestamp>.json and <name>.prom (overwritten each run, as textfile collectors expect)
+        :return: (json path, prom path)
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.utcfromtimestamp(self.started_at).strftime("%Y%m%d_%H%M%S")
+        json_path = os.path.join(directory, f"{name}_{stamp}.json")
+        with open(json_path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        prom_path = os.path.join(directory, f"{name}.prom")
+        with open(prom_path + ".tmp", "w") as f:
+            f.write(self.prometheus())
+        os.replace(prom_path + ".tmp", prom_path)
+        return json_path, prom_path
+
+    def log_summary(self, top=8):
+        """ Log where the run's time went, by total time per histogram """
+        for h in self.summary()["histograms"][:top]:
+            labels = ",".join(f"{k}={v}" for k, v in h["labels"].items())
+            logger.info(f"  {h['name']}[{labels}]: {h['count']} x {1000 * h['mean']:.1f}ms = {h['sum']:.3f}s "
+                        f"(p90 <= {h['p90']}s)")
+
+
+REGISTRY = Registry()
+
+
+def observe(name: str, value: float, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+def inc(name: str, value=1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+
+def timer(name: str, **labels):
+    return REGISTRY.timer(name, **labels)
+
+
+def timed(name: str, **labels):
+    """ Decorator recording each call's duration in histogram name """
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with REGISTRY.timer(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
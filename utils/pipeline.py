@@ -0,0 +1,256 @@
+"""
+Staged fetch -> parse -> write pipeline for --update-film-ratings.
+
+  fetch: threads walking each stale user's ratings pages over the pooled session in scraping.fetch
+  parse: a process pool turning page HTML into rating rows, so extraction runs on every core
+  write: a single thread owning the DB connection, upserting rows in batched transactions
+
+The queues between stages are bounded, so if the writer stalls, the fetchers block on handing over pages instead of
+piling them up in memory.
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from scraping import extract, user
+from scraping.scraper import RatingScraper
+from utils.storage import ParsingStorage
+
+
+logger = logging.getLogger(__name__)
+
+FETCH_WORKERS = 4
+PARSE_WORKERS = os.cpu_count() or 2
+WRITE_BATCH = 5000
+# A batch that fails to write is rolled back and retried, backing off WRITE_RETRY_DELAY seconds more each time
+WRITE_ATTEMPTS = 3
+WRITE_RETRY_DELAY = 1.0
+# Pages waiting on (or done with) parsing, per parse worker, before fetchers have to wait for the writer
+QUEUE_SLOTS_PER_WORKER = 4
+# Rated-films grids are built from these; a page without one is past the user's last page
+RATED_PAGE_MARKER = "poster-viewingdata"
+
+
+def parse_ratings_page(html: str, username: str, backend: str):
+    """ Page HTML -> (rows for ParsingStorage.insert_rating_rows, CPU seconds spent). Runs in the parse pool. """
+    start = time.process_time()
+    rows = RatingScraper.rating_rows(extract.extract("rated_films", html, username, backend=backend))
+    return rows, time.process_time() - start
+
+
+def rows_already_known(rows: list, known: dict) -> bool:
+    """ scraping.user.page_already_known, for parse_ratings_page rows """
+    return all(row[4] in known and known[row[4]] == row[5] for row in rows)
+
+
+class StageStats:
+    def __init__(self, name: str, unit: str, workers: int):
+        self.name = name
+        self.unit = unit
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items=0, busy=0.0, blocked=0.0):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+            self.blocked += blocked
+
+    def report(self, wall: float) -> str:
+        utilization = 100 * self.busy / (wall * self.workers) if wall else 0.0
+        return (f"{self.name:<5} {self.items:>8} {self.unit:<5} {self.items / wall if wall else 0.0:9.1f}/s  "
+                f"busy={self.busy:.1f}s ({utilization:.0f}% of {self.workers})  blocked={self.blocked:.1f}s")
+
+
+class RatingsPipeline:
+    def __init__(self, fetch_workers=FETCH_WORKERS, parse_workers=PARSE_WORKERS, write_batch=WRITE_BATCH,
+                 user_pause=0.0, index_updater=None):
+        """
+        :param user_pause: each fetch worker sleeps user_pause-2*user_pause seconds between users
+        :param index_updater: suggest.index.IndexUpdater to re-score users in once their ratings are written
+        """
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.write_batch = write_batch
+        self.user_pause = user_pause
+        self.index_updater = index_updater
+        self.stats = {
+            "fetch": StageStats("fetch", "pages", fetch_workers),
+            "parse": StageStats("parse", "pages", parse_workers),
+            "write": StageStats("write", "rows", 1),
+        }
+        self.wall = 0.0
+        self._users = queue.Queue(maxsize=fetch_workers)
+        self._parsed = queue.Queue(maxsize=QUEUE_SLOTS_PER_WORKER * parse_workers)
+        self._failed = set()
+
+    def run(self, usernames, incremental=False) -> dict:
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+            # Start the parse processes before any of our threads exist
+            pool.submit(int).result()
+
+            writer = threading.Thread(target=self._write, name="pipeline-write")
+            writer.start()
+            fetchers = [threading.Thread(target=self._fetch, args=(pool,), name=f"pipeline-fetch-{i}")
+                        for i in range(self.fetch_workers)]
+            for fetcher in fetchers:
+                fetcher.start()
+
+            db = ParsingStorage()
+            for username in usernames:
+                self._users.put(self._plan(db, username, incremental))
+            db.close()
+            for _ in fetchers:
+                self._users.put(None)
+            for fetcher in fetchers:
+                fetcher.join()
+            self._parsed.put(None)
+            writer.join()
+
+        self.wall = time.perf_counter() - start
+        logger.info(f"Pipeline finished {len(usernames)} users in {self.wall:.1f}s")
+        for stats in self.stats.values():
+            logger.info(f"  {stats.report(self.wall)}")
+        return self.stats
+
+    @staticmethod
+    def _plan(db, username: str, incremental: bool):
+        """ (username, full_scrape, known ratings or None), deciding like scrape.rating_scraper_for """
+        if incremental and not db.needs_full_scrape(username):
+            known = db.get_user_ratings(username)
+            if known:
+                return username, False, known
+        return username, True, None
+
+    def _hand_over(self, item):
+        start = time.perf_counter()
+        self._parsed.put(item)
+        self.stats["fetch"].add(blocked=time.perf_counter() - start)
+
+    def _fetch(self, pool):
+        while True:
+            plan = self._users.get()
+            if plan is None:
+                return
+            username, full_scrape, known = plan
+            logger.debug(f"Fetching film ratings for user '{username}'...")
+            try:
+                self._fetch_user(pool, username, full_scrape, known)
+            except Exception as e:
+                logger.error(f"Couldn't fetch film ratings for user '{username}': {e}")
+                self._hand_over(("failed", username))
+            else:
+                self._hand_over(("done", username, full_scrape))
+            if self.user_pause:
+                time.sleep(self.user_pause * (1 + random.random()))
+
+    def _fetch_user(self, pool, username: str, full_scrape: bool, known):
+        userinfo = user.User(username)
+        url_for_page = user.films_page_url if full_scrape else user.films_by_date_page_url
+        page_no = 0
+        while True:
+            page_no += 1
+            start = time.perf_counter()
+            html = userinfo.get_page(url_for_page(userinfo.username, page_no))
+            self.stats["fetch"].add(items=1, busy=time.perf_counter() - start)
+            if RATED_PAGE_MARKER not in html:
+                return
+
+            future = pool.submit(parse_ratings_page, html, userinfo.username, extract.BACKEND)
+            self._hand_over(("page", username, future))
+            if known is not None:
+                # Incremental scrapes stop at the first page with nothing new, so they need this page parsed
+                rows, _ = future.result()
+                if not rows or rows_already_known(rows, known):
+                    return
+
+    def _write(self):
+        db = ParsingStorage()
+        batch, finished, counts = [], [], {}
+        while True:
+            try:
+                item = self._parsed.get(timeout=1.0 if batch or finished else None)
+            except queue.Empty:
+                self._flush(db, batch, finished, counts)
+                continue
+            if item is None:
+                break
+
+            kind, username = item[0], item[1]
+            if kind == "page":
+                try:
+                    rows, cpu_time = item[2].result()
+                except Exception as e:
+                    logger.error(f"Couldn't parse a ratings page for user '{username}': {e}")
+                    self._failed.add(username)
+                    continue
+                self.stats["parse"].add(items=1, busy=cpu_time)
+                batch.extend(rows)
+                counts[username] = counts.get(username, 0) + len(rows)
+            elif kind == "done":
+                finished.append((username, item[2]))
+            else:
+                self._failed.add(username)
+                counts.pop(username, None)
+
+            if len(batch) >= self.write_batch or (finished and self._parsed.empty()):
+                self._flush(db, batch, finished, counts)
+
+        self._flush(db, batch, finished, counts)
+        db.close()
+
+    def _flush(self, db, batch: list, finished: list, counts: dict):
+        """
+        Write the batched rows in one transaction, then mark the users whose pages have all been written. A failed
+        write is rolled back and retried; if it keeps failing, every user it touched is left unmarked (failed), so
+        they're picked up again on the next run.
+        """
+        start = time.perf_counter()
+        rows = len(batch)
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                self._write_batch(db, batch, finished, counts)
+                break
+            except Exception as e:
+                db.connection.rollback()
+                if attempt < WRITE_ATTEMPTS:
+                    logger.warning(f"Failed to write {len(batch)} rating rows (attempt {attempt} of {WRITE_ATTEMPTS}), "
+                                   f"retrying: {e}")
+                    time.sleep(WRITE_RETRY_DELAY * attempt)
+                    continue
+                affected = {row[1] for row in batch} | {username for username, _ in finished}
+                logger.exception(f"Failed to write {len(batch)} rating rows; not marking {len(affected)} users as "
+                                 f"updated")
+                self._failed.update(affected)
+                for username in affected:
+                    counts.pop(username, None)
+        self.stats["write"].add(items=rows, busy=time.perf_counter() - start)
+        batch.clear()
+        finished.clear()
+
+    def _write_batch(self, db, batch: list, finished: list, counts: dict):
+        """ One attempt at _flush: each step that commits is taken off batch/finished, so a retry doesn't redo it """
+        if batch:
+            db.insert_rating_rows(batch)
+            batch.clear()
+        while finished:
+            username, full_scrape = finished[0]
+            count = counts.get(username, 0)
+            if username in self._failed:
+                logger.warning(f"Not marking '{username}' as updated: some of their pages failed")
+            else:
+                if not count:
+                    logger.error(f"Couldn't get film ratings for user '{username}'")
+                    db.remove_user(username)
+                db.refresh_user(username, full_scrape)
+            finished.pop(0)
+            counts.pop(username, None)
+            if self.index_updater and count and username not in self._failed:
+                self.index_updater.update(db, username)
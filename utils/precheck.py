@@ -0,0 +1,76 @@
+"""
+Cheap change detection before re-scraping a user's ratings: one request for their profile page instead of every page
+of their films.
+
+The profile carries the user's film counter and ratings histogram (ratings per half star). Logging or rating a film
+changes the counters, and re-rating one moves a rating between histogram buckets, which the fingerprint (a digest of
+the whole histogram) catches. When both match what the profile showed before the user's last finished scrape, the
+deep scrape is skipped and the user is just marked refreshed. Users that can't be vouched for (no stored counters
+yet, a profile that doesn't parse) are scraped as before.
+"""
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from scraping import user
+from utils import metrics
+
+
+logger = logging.getLogger(__name__)
+
+PRECHECK_WORKERS = 4
+
+
+def profile_stats(username: str) -> dict:
+    """ {"films": n, "ratings": n, "fingerprint": digest of the counters and ratings histogram} from the profile """
+    counts = user.user_profile_counts(user.User(username))
+    if counts["films"] is None:
+        raise Exception(f"No film counter on the profile of '{username}'")
+    fingerprint = hashlib.sha1(json.dumps(counts, sort_keys=True).encode()).hexdigest()[:16]
+    return {"films": counts["films"], "ratings": counts["ratings"], "fingerprint": fingerprint}
+
+
+def _fetch_stats(username: str):
+    try:
+        return profile_stats(username)
+    except Exception as e:
+        logger.warning(f"Couldn't pre-check '{username}', scraping them in full: {e}")
+        return None
+
+
+def record(db, username: str, stats) -> bool:
+    """
+    Mark the user refreshed if their profile stats are unchanged, otherwise keep the stats for their coming scrape
+    :param stats: profile_stats(username), or None if the profile couldn't be read
+    :return: whether the user still needs a deep scrape
+    """
+    if stats is None:
+        metrics.inc("precheck_total", outcome="failed")
+        return True
+    unchanged = stats == db.get_profile_stats(username)
+    db.set_pending_profile_stats(username, stats)
+    if unchanged:
+        metrics.inc("precheck_total", outcome="unchanged")
+        db.refresh_user(username, full_scrape=False)
+        return False
+    metrics.inc("precheck_total", outcome="changed")
+    return True
+
+
+def precheck_user(db, username: str) -> bool:
+    """ Pre-check one user. :return: whether they need a deep scrape """
+    return record(db, username, _fetch_stats(username))
+
+
+def precheck(db, usernames, workers=PRECHECK_WORKERS) -> list:
+    """
+    Pre-check a batch of users, fetching their profiles concurrently; unchanged ones are marked refreshed
+    :return: the users that still need a deep scrape, in the order given
+    """
+    usernames = list(usernames)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="precheck") as pool:
+        all_stats = list(pool.map(_fetch_stats, usernames))
+    changed = [username for username, stats in zip(usernames, all_stats) if record(db, username, stats)]
+    logger.info(f"Pre-check: {len(usernames) - len(changed)} of {len(usernames)} users unchanged since their last "
+                f"scrape; {len(changed)} to scrape")
+    return changed
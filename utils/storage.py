@@ -1,6 +1,9 @@
 from datetime import datetime, timedelta
+import json
 import sqlite3
-from scraping.scraper import RatingObject, ScrapedUserObject
+from scraping.scraper import RatingObject, ScrapedUserObject, rating_id
+from utils import metrics
+from utils.bloom import BloomFilter
 import logging
 
 
@@ -8,54 +11,495 @@ import logging
 logger = logging.getLogger(__name__)
 SCRAPE_DB = "scrape_store.db"
 
+# WAL + synchronous=NORMAL only fsyncs at checkpoints rather than on every commit
+SYNCHRONOUS = "NORMAL"
+# Negative values are in KiB, per the sqlite docs
+CACHE_SIZE = -64000
+# How long to wait on another process (e.g. another --worker) holding the DB's write lock, in seconds
+BUSY_TIMEOUT = 30
+
+# Incremental refreshes only see new/changed ratings near the top of a user's films; a full re-scrape at least
+# this often picks up edits to older ratings
+FULL_SCRAPE_DAYS = 28
+
+# Bumped whenever the on-disk layout changes; stored in sqlite's PRAGMA user_version.
+#   0: original layout, one ratings row per (user, film_id, scrape time)
+#   1: ratings unique on (user, film_id), upserted in place, with covering lookup indexes
+#   2: users.last_full_scrape, for incremental rating refreshes
+#   3: users.change_rate, next_refresh and rating_count, for adaptive refresh scheduling
+#   4: users.profile_stats and pending_profile_stats, for skipping scrapes of unchanged users
+SCHEMA_VERSION = 4
+
+# profile_stats: the profile counters (see utils.precheck) as of the user's last finished scrape;
+# pending_profile_stats: those seen by the latest pre-check, promoted to profile_stats once a scrape finishes
+USERS_TABLE = ("users(id INTEGER PRIMARY KEY, user TEXT, last_updated INTEGER, last_full_scrape INTEGER DEFAULT 0, "
+               "change_rate REAL, next_refresh INTEGER, rating_count INTEGER DEFAULT 0, profile_stats TEXT, "
+               "pending_profile_stats TEXT)")
+
+# Adaptive refresh scheduling: each scrape measures how many ratings were new or changed since the previous one,
+# folds that into an exponentially weighted per-day change rate, and schedules the next refresh for when about
+# REFRESH_TARGET_RATINGS more are expected (within MIN/MAX_REFRESH_DAYS). Users without a rate yet are refreshed
+# every DEFAULT_REFRESH_DAYS, like the old fixed cutoff.
+DAY = 24 * 60 * 60
+DEFAULT_REFRESH_DAYS = 7
+MIN_REFRESH_DAYS = 1
+MAX_REFRESH_DAYS = 60
+REFRESH_TARGET_RATINGS = 10
+CHANGE_RATE_ALPHA = 0.3
+# Films per page of a user's films grid, for estimating how many requests a scrape costs
+RATINGS_PER_PAGE = 72
+
+RATINGS_TABLE = ("ratings(id INTEGER PRIMARY KEY, user TEXT NOT NULL, film_title TEXT, film_url TEXT, "
+                 "film_id INTEGER NOT NULL, film_rating REAL, last_updated INTEGER, UNIQUE(user, film_id))")
+
+# Last page committed by a full scrape still in progress, so an interrupted one can pick up where it stopped
+SCRAPE_PROGRESS_TABLE = "scrape_progress(user TEXT PRIMARY KEY, page INTEGER, updated_at INTEGER)"
+# Older progress is ignored: by then enough new films have been logged to shift every page's contents
+RESUME_HOURS = 24
+
+# Film metadata from each film's page and its details/ page. List columns hold JSON arrays.
+FILMS_TABLE = ("films(film_id INTEGER PRIMARY KEY, slug TEXT UNIQUE, title TEXT, year INTEGER, directors TEXT, "
+               "genres TEXT, average_rating REAL, countries TEXT, studios TEXT, languages TEXT, fetched_at INTEGER)")
+FILM_LIST_COLUMNS = ("directors", "genres", "countries", "studios", "languages")
+# Film pages change rarely; refetch them this often (the HTTP cache keeps them as long)
+FILM_TTL_DAYS = 30
+
+# Per-user genre/decade/country/director profiles (see suggest.taste), as JSON. A row is valid until the user is
+# re-scraped (refresh_user drops it) or the films table changes (films_version, the newest films.fetched_at)
+TASTE_PROFILES_TABLE = "taste_profiles(user TEXT PRIMARY KEY, profile TEXT, films_version INTEGER, computed_at INTEGER)"
+
+# Follow-graph edges (follower follows followee), from the follow-graph crawl (see utils.crawler)
+FOLLOWS_TABLE = ("follows(follower TEXT NOT NULL, followee TEXT NOT NULL, updated_at INTEGER, "
+                 "PRIMARY KEY(follower, followee)) WITHOUT ROWID")
+FOLLOWS_INDEX = "CREATE INDEX IF NOT EXISTS follows_by_followee ON follows(followee, follower)"
+# Users the crawl has discovered but not expanded yet, with their distance from the seed users
+CRAWL_FRONTIER_TABLE = ("crawl_frontier(user TEXT PRIMARY KEY, depth INTEGER NOT NULL, attempts INTEGER DEFAULT 0, "
+                        "enqueued_at INTEGER)")
+# Serialized utils.bloom.BloomFilters, by name
+BLOOM_TABLE = "bloom_filters(name TEXT PRIMARY KEY, capacity INTEGER, error_rate REAL, count INTEGER, bits BLOB)"
+
+RATINGS_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ratings_by_user ON ratings(user, film_id, film_rating)",
+    "CREATE INDEX IF NOT EXISTS ratings_by_film ON ratings(film_id, user, film_rating)",
+]
+
+# Only touch a row when the rating actually changed, so last_updated records when it was last changed
+UPSERT_RATING = ("INSERT INTO ratings (id, user, film_title, film_url, film_id, film_rating, last_updated) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                 "ON CONFLICT(user, film_id) DO UPDATE SET film_rating = excluded.film_rating, "
+                 "film_title = excluded.film_title, film_url = excluded.film_url, "
+                 "last_updated = excluded.last_updated "
+                 "WHERE ratings.film_rating IS NOT excluded.film_rating")
+
+
+class OutdatedSchemaError(Exception):
+    """ Raised when the DB on disk predates SCHEMA_VERSION """
+
 
 class ParsingStorage:
-    def __init__(self, in_memory=False):
+    def __init__(self, in_memory=False, synchronous=SYNCHRONOUS, cache_size=CACHE_SIZE, migrate=False):
         if in_memory:
             self.connection = sqlite3.connect(':memory:')
         else:
-            self.connection = sqlite3.connect(SCRAPE_DB)
+            self.connection = sqlite3.connect(SCRAPE_DB, timeout=BUSY_TIMEOUT)
 
         self.cursor = self.connection.cursor()
+        self.set_pragmas(synchronous, cache_size)
         # if tables don't exist, create them
-        self.create_parsing_table()
+        self.create_parsing_table(migrate)
+
+    def set_pragmas(self, synchronous=SYNCHRONOUS, cache_size=CACHE_SIZE):
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        self.cursor.execute(f"PRAGMA synchronous={synchronous}")
+        self.cursor.execute(f"PRAGMA cache_size={int(cache_size)}")
 
-    def create_parsing_table(self):
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS users(id INTEGER PRIMARY KEY, "
-                            "user TEXT, last_updated INTEGER)")
+    def create_parsing_table(self, migrate=False):
+        self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {USERS_TABLE}")
+        self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {SCRAPE_PROGRESS_TABLE}")
+        self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {FILMS_TABLE}")
+        self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {TASTE_PROFILES_TABLE}")
+        self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {FOLLOWS_TABLE}")
+        self.cursor.execute(FOLLOWS_INDEX)
+        self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {CRAWL_FRONTIER_TABLE}")
+        self.cursor.execute(f"CREATE TABLE IF NOT EXISTS {BLOOM_TABLE}")
 
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS ratings(id INTEGER PRIMARY KEY, user TEXT, film_title TEXT,"
-                            "film_url TEXT, film_id INTEGER, film_rating REAL, last_updated INTEGER)")
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'ratings'")
+        if not self.cursor.fetchone():
+            self.cursor.execute(f"CREATE TABLE {RATINGS_TABLE}")
+            for index in RATINGS_INDEXES:
+                self.cursor.execute(index)
+            self.set_schema_version(SCHEMA_VERSION)
+            self.connection.commit()
 
+        version = self.schema_version()
+        if version < SCHEMA_VERSION:
+            if not migrate:
+                raise OutdatedSchemaError(f"DB schema is at version {version}, expected {SCHEMA_VERSION}. "
+                                          f"Run 'scrape.py --migrate-db' to upgrade it.")
+            self.migrate(version)
+
+    def schema_version(self) -> int:
+        self.cursor.execute("PRAGMA user_version")
+        return self.cursor.fetchone()[0]
+
+    def set_schema_version(self, version: int):
+        self.cursor.execute(f"PRAGMA user_version = {int(version)}")
+
+    def migrate(self, from_version: int):
+        """ One-shot upgrade of an existing DB to SCHEMA_VERSION """
+        logger.warning(f"Migrating DB schema from version {from_version} to {SCHEMA_VERSION}")
+        self.cursor.execute("BEGIN")
+        if from_version < 1:
+            self._dedupe_ratings()
+        if from_version < 2:
+            self.cursor.execute("ALTER TABLE users ADD COLUMN last_full_scrape INTEGER DEFAULT 0")
+        if from_version < 3:
+            self.cursor.execute("ALTER TABLE users ADD COLUMN change_rate REAL")
+            self.cursor.execute("ALTER TABLE users ADD COLUMN next_refresh INTEGER")
+            self.cursor.execute("ALTER TABLE users ADD COLUMN rating_count INTEGER DEFAULT 0")
+            self.cursor.execute("UPDATE users SET rating_count = (SELECT COUNT(*) FROM ratings "
+                                "WHERE ratings.user = users.user)")
+        if from_version < 4:
+            self.cursor.execute("ALTER TABLE users ADD COLUMN profile_stats TEXT")
+            self.cursor.execute("ALTER TABLE users ADD COLUMN pending_profile_stats TEXT")
+        self.set_schema_version(SCHEMA_VERSION)
+        self.connection.commit()
+        # Give back the pages freed by the dedupe
+        self.cursor.execute("VACUUM")
+
+    def _dedupe_ratings(self):
+        """ v0 -> v1: keep only the most recent scrape of each (user, film_id), under its stable ID """
+        self.cursor.execute("SELECT COUNT(*) FROM ratings")
+        before = self.cursor.fetchone()[0]
+
+        self.connection.create_function("rating_id", 2, rating_id, deterministic=True)
+        self.cursor.execute(f"CREATE TABLE {RATINGS_TABLE.replace('ratings(', 'ratings_v1(', 1)}")
+        # sqlite fills bare columns from the row holding MAX(last_updated)
+        self.cursor.execute("INSERT INTO ratings_v1 (id, user, film_title, film_url, film_id, film_rating, last_updated) "
+                            "SELECT rating_id(film_id, user), user, film_title, film_url, film_id, film_rating, "
+                            "MAX(last_updated) FROM ratings GROUP BY user, film_id")
+        self.cursor.execute("DROP TABLE ratings")
+        self.cursor.execute("ALTER TABLE ratings_v1 RENAME TO ratings")
+        for index in RATINGS_INDEXES:
+            self.cursor.execute(index)
+
+        self.cursor.execute("SELECT COUNT(*) FROM ratings")
+        after = self.cursor.fetchone()[0]
+        logger.info(f"Deduplicated ratings table: {before} -> {after} rows")
+
+    @metrics.timed("storage_seconds", op="insert_rating")
     def insert_rating(self, ro: RatingObject):
-        self.cursor.execute("INSERT OR IGNORE INTO ratings (id, user, film_title, film_url, film_id, film_rating, last_updated) "
-                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        self.cursor.execute(UPSERT_RATING,
                             (ro.id, ro.user, ro.film_title, ro.film_url, ro.film_id, ro.film_rating, ro.last_updated))
 
         self.connection.commit()
 
+    def insert_ratings(self, ratings):
+        """ Insert an iterable of RatingObjects in a single transaction """
+        self.insert_rating_rows((ro.id, ro.user, ro.film_title, ro.film_url, ro.film_id, ro.film_rating,
+                                 ro.last_updated) for ro in ratings)
+
+    @metrics.timed("storage_seconds", op="insert_rating_rows")
+    def insert_rating_rows(self, rows):
+        """ insert_ratings, for (id, user, film_title, film_url, film_id, film_rating, last_updated) tuples """
+        with self.connection:
+            self.cursor.executemany(UPSERT_RATING, rows)
+
+    @metrics.timed("storage_seconds", op="insert_ratings_page")
+    def insert_ratings_page(self, username, page_no, rows):
+        """ Insert one page of a user's insert_rating_rows rows and record the page as done, in a single transaction """
+        with self.connection:
+            self.cursor.executemany(UPSERT_RATING, rows)
+            self.cursor.execute("INSERT OR REPLACE INTO scrape_progress (user, page, updated_at) VALUES (?, ?, ?)",
+                                (username, page_no, int(datetime.utcnow().timestamp())))
+
+    @metrics.timed("storage_seconds", op="get_scrape_progress")
+    def get_scrape_progress(self, username) -> int:
+        """ Last page committed by an interrupted full scrape of the user in the last RESUME_HOURS, or 0 """
+        cutoff = int((datetime.utcnow() - timedelta(hours=RESUME_HOURS)).timestamp())
+        self.cursor.execute("SELECT page FROM scrape_progress WHERE user = ? AND updated_at >= ?", (username, cutoff))
+        row = self.cursor.fetchone()
+        return row[0] if row else 0
+
+    @metrics.timed("storage_seconds", op="insert_member")
     def insert_member(self, suo: ScrapedUserObject):
         self.cursor.execute("INSERT OR IGNORE INTO users (id, user, last_updated) VALUES (?, ?, ?)",
                             (suo.id, suo.user, suo.last_updated))
 
         self.connection.commit()
 
-    def get_stale_users(self):
-        """ Returns list of all users not updated in the last 7 days """
-        stale_timestamp = int((datetime.utcnow() - timedelta(7)).timestamp())
-        logger.debug(f"{stale_timestamp=}")
-        self.cursor.execute(f"SELECT user FROM users where last_updated < {stale_timestamp}")
-        users = self.cursor.fetchall()
-        users_strs = [u[0] for u in users]
+    @metrics.timed("storage_seconds", op="insert_members")
+    def insert_members(self, members):
+        """ Insert an iterable of ScrapedUserObjects in a single transaction """
+        with self.connection:
+            self.cursor.executemany("INSERT OR IGNORE INTO users (id, user, last_updated) VALUES (?, ?, ?)",
+                                    ((suo.id, suo.user, suo.last_updated) for suo in members))
+
+    @metrics.timed("storage_seconds", op="get_stale_users")
+    def get_stale_users(self, incremental=False):
+        """
+        Returns list of all users due a film rating update (see refresh_user), most worthwhile first: users never
+        scraped, then by expected new ratings per page request. A full scrape costs every page of the user's films;
+        an incremental one (see needs_full_scrape) roughly the pages the new ratings fill.
+        """
+        now = int(datetime.utcnow().timestamp())
+        full_scrape_cutoff = now - FULL_SCRAPE_DAYS * DAY
+        self.cursor.execute("SELECT user, last_updated, last_full_scrape, change_rate, rating_count FROM users "
+                            "WHERE COALESCE(next_refresh, last_updated + ?) <= ?", (DEFAULT_REFRESH_DAYS * DAY, now))
+        scored = []
+        for user, last_updated, last_full_scrape, change_rate, rating_count in self.cursor.fetchall():
+            if not last_updated:
+                scored.append((float("inf"), user))
+                continue
+            if change_rate is None:
+                change_rate = REFRESH_TARGET_RATINGS / DEFAULT_REFRESH_DAYS
+            expected = change_rate * (now - last_updated) / DAY
+            if incremental and (last_full_scrape or 0) >= full_scrape_cutoff:
+                pages = 1 + expected / RATINGS_PER_PAGE
+            else:
+                pages = 1 + (rating_count or 0) / RATINGS_PER_PAGE
+            scored.append((expected / pages, user))
+        scored.sort(key=lambda s: s[0], reverse=True)
+
+        users_strs = [user for _, user in scored]
         logger.info(f"Found {len(users_strs)} members in DB needing a film rating update")
         return users_strs
 
-    def refresh_user(self, username):
-        # Update the users table with the new 'last_updated' value
+    @metrics.timed("storage_seconds", op="get_user_ratings")
+    def get_user_ratings(self, username) -> dict:
+        """ {film_id: film_rating} of everything stored for the user """
+        self.cursor.execute("SELECT film_id, film_rating FROM ratings WHERE user = ?", (username,))
+        return dict(self.cursor.fetchall())
+
+    def iter_rating_triples(self, chunk_size=100_000, rated_only=True):
+        """
+        Yields lists of (user, film_id, film_rating) ordered by user, then film_id
+        :param rated_only: skip films the user logged without a star rating
+        """
+        where = "WHERE film_rating > 0 " if rated_only else ""
+        yield from self._iter_chunks(f"SELECT user, film_id, film_rating FROM ratings {where}ORDER BY user, film_id",
+                                     chunk_size)
+
+    def iter_films(self, chunk_size=100_000):
+        """ Yields lists of (film_id, film_title, film_url) for every distinct film in ratings, ordered by film_id """
+        yield from self._iter_chunks("SELECT film_id, MAX(film_title), MAX(film_url) FROM ratings "
+                                     "GROUP BY film_id ORDER BY film_id", chunk_size)
+
+    @metrics.timed("storage_seconds", op="get_films_to_enrich")
+    def get_films_to_enrich(self, ttl_days=FILM_TTL_DAYS):
+        """
+        [(film_id, film_title, film_url)] of rated films missing from the films table, or fetched more than ttl_days
+        ago
+        """
+        cutoff = int((datetime.utcnow() - timedelta(ttl_days)).timestamp())
+        self.cursor.execute("SELECT r.film_id, MAX(r.film_title), MAX(r.film_url) FROM ratings r "
+                            "LEFT JOIN films f ON f.film_id = r.film_id WHERE f.film_id IS NULL OR f.fetched_at < ? "
+                            "GROUP BY r.film_id ORDER BY r.film_id", (cutoff,))
+        return self.cursor.fetchall()
+
+    @metrics.timed("storage_seconds", op="insert_films")
+    def insert_films(self, films):
+        """ Upsert an iterable of films table dicts (list columns as lists) in a single transaction """
+        columns = ("film_id", "slug", "title", "year", "average_rating", "fetched_at") + FILM_LIST_COLUMNS
+        placeholders = ", ".join("?" * len(columns))
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns[1:])
+        with self.connection:
+            self.cursor.executemany(f"INSERT INTO films ({', '.join(columns)}) VALUES ({placeholders}) "
+                                    f"ON CONFLICT(film_id) DO UPDATE SET {updates}",
+                                    (tuple(f[c] for c in columns[:6]) + tuple(json.dumps(f[c]) for c in columns[6:])
+                                     for f in films))
+
+    def get_film(self, film_id) -> dict:
+        """ The film's films table row as a dict (list columns decoded), or None """
+        cursor = self.connection.execute("SELECT * FROM films WHERE film_id = ?", (film_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        film = dict(zip((d[0] for d in cursor.description), row))
+        for column in FILM_LIST_COLUMNS:
+            film[column] = json.loads(film[column]) if film[column] else []
+        return film
+
+    def iter_film_metadata(self, chunk_size=100_000):
+        """ Yields lists of (film_id, year, directors, genres, countries) from the films table (list columns as JSON) """
+        yield from self._iter_chunks("SELECT film_id, year, directors, genres, countries FROM films ORDER BY film_id",
+                                     chunk_size)
+
+    def films_version(self) -> int:
+        """ Changes whenever films are (re)loaded into the films table """
+        self.cursor.execute("SELECT MAX(fetched_at) FROM films")
+        return self.cursor.fetchone()[0] or 0
+
+    @metrics.timed("storage_seconds", op="get_taste_profile")
+    def get_taste_profile(self, username, films_version) -> dict:
+        """ The user's cached taste profile, or None if there's none computed against films_version """
+        self.cursor.execute("SELECT profile FROM taste_profiles WHERE user = ? AND films_version = ?",
+                            (username, films_version))
+        row = self.cursor.fetchone()
+        return json.loads(row[0]) if row else None
+
+    @metrics.timed("storage_seconds", op="save_taste_profile")
+    def save_taste_profile(self, username, profile: dict, films_version):
+        with self.connection:
+            self.cursor.execute("INSERT OR REPLACE INTO taste_profiles (user, profile, films_version, computed_at) "
+                                "VALUES (?, ?, ?, ?)",
+                                (username, json.dumps(profile), films_version, int(datetime.utcnow().timestamp())))
+
+    def get_follows(self, username) -> tuple:
+        """ (users username follows, users following username) """
+        self.cursor.execute("SELECT followee FROM follows WHERE follower = ?", (username,))
+        following = [row[0] for row in self.cursor.fetchall()]
+        self.cursor.execute("SELECT follower FROM follows WHERE followee = ?", (username,))
+        return following, [row[0] for row in self.cursor.fetchall()]
+
+    def iter_follows(self, chunk_size=100_000):
+        """ Yields lists of (follower, followee) edges """
+        yield from self._iter_chunks("SELECT follower, followee FROM follows", chunk_size)
+
+    @metrics.timed("storage_seconds", op="get_crawl_frontier")
+    def get_crawl_frontier(self, n, max_depth) -> list:
+        """ [(user, depth, attempts)] of up to n frontier users shallower than max_depth, breadth-first """
+        self.cursor.execute("SELECT user, depth, attempts FROM crawl_frontier WHERE depth < ? "
+                            "ORDER BY depth, attempts, enqueued_at LIMIT ?", (max_depth, n))
+        return self.cursor.fetchall()
+
+    def count_crawl_frontier(self, max_depth=None) -> int:
+        if max_depth is None:
+            self.cursor.execute("SELECT COUNT(*) FROM crawl_frontier")
+        else:
+            self.cursor.execute("SELECT COUNT(*) FROM crawl_frontier WHERE depth < ?", (max_depth,))
+        return self.cursor.fetchone()[0]
+
+    @metrics.timed("storage_seconds", op="store_crawl_batch")
+    def store_crawl_batch(self, crawled, failed, discovered, bloom_name, bloom, max_attempts):
+        """
+        Record one batch of the follow-graph crawl in a single transaction
+        :param crawled: [(username, following, followers)] of users expanded; they leave the frontier
+        :param failed: usernames whose fetch failed; they're retried until they've had max_attempts
+        :param discovered: [(username, depth)] of users seen for the first time; they join the frontier and users
+        :param bloom: the crawl's seen-set, saved as bloom_name
+        """
+        now = int(datetime.utcnow().timestamp())
+        with self.connection:
+            for username, following, followers in crawled:
+                self.cursor.executemany("INSERT OR REPLACE INTO follows (follower, followee, updated_at) "
+                                        "VALUES (?, ?, ?)", ((username, f, now) for f in following))
+                self.cursor.executemany("INSERT OR REPLACE INTO follows (follower, followee, updated_at) "
+                                        "VALUES (?, ?, ?)", ((f, username, now) for f in followers))
+            self.cursor.executemany("DELETE FROM crawl_frontier WHERE user = ?", ((c[0],) for c in crawled))
+            self.cursor.executemany("UPDATE crawl_frontier SET attempts = attempts + 1 WHERE user = ?",
+                                    ((username,) for username in failed))
+            self.cursor.execute("DELETE FROM crawl_frontier WHERE attempts >= ?", (max_attempts,))
+            self.cursor.executemany("INSERT OR IGNORE INTO crawl_frontier (user, depth, enqueued_at) VALUES (?, ?, ?)",
+                                    ((username, depth, now) for username, depth in discovered))
+            self.cursor.executemany("INSERT OR IGNORE INTO users (id, user, last_updated) VALUES (?, ?, ?)",
+                                    ((suo.id, suo.user, suo.last_updated)
+                                     for suo in (ScrapedUserObject(username) for username, _ in discovered)))
+            self.save_bloom(bloom_name, bloom)
+
+    def load_bloom(self, name):
+        """ The BloomFilter saved as name, or None """
+        self.cursor.execute("SELECT capacity, error_rate, count, bits FROM bloom_filters WHERE name = ?", (name,))
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        capacity, error_rate, count, bits = row
+        return BloomFilter(capacity, error_rate, bits=bits, count=count)
+
+    def save_bloom(self, name, bloom: BloomFilter):
+        """ Save bloom as name, as part of the caller's transaction (e.g. store_crawl_batch's) """
+        self.cursor.execute("INSERT OR REPLACE INTO bloom_filters (name, capacity, error_rate, count, bits) "
+                            "VALUES (?, ?, ?, ?, ?)", (name, bloom.capacity, bloom.error_rate, bloom.count,
+                                                       bloom.to_bytes()))
+
+    def count_ratings(self, rated_only=True) -> int:
+        self.cursor.execute("SELECT COUNT(*) FROM ratings" + (" WHERE film_rating > 0" if rated_only else ""))
+        return self.cursor.fetchone()[0]
+
+    def ratings_version(self) -> dict:
+        """ {"ratings": row count, "last_updated": latest last_updated}, which moves whenever ratings change """
+        self.cursor.execute("SELECT COUNT(*), MAX(last_updated) FROM ratings")
+        count, last_updated = self.cursor.fetchone()
+        return {"ratings": count, "last_updated": last_updated or 0}
+
+    def _iter_chunks(self, query, chunk_size):
+        # A cursor of its own, so callers can keep using self.cursor while iterating
+        cursor = self.connection.cursor()
+        cursor.execute(query)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+    @metrics.timed("storage_seconds", op="needs_full_scrape")
+    def needs_full_scrape(self, username) -> bool:
+        """ True if the user's ratings haven't been fully re-scraped in the last FULL_SCRAPE_DAYS """
+        cutoff = int((datetime.utcnow() - timedelta(FULL_SCRAPE_DAYS)).timestamp())
+        self.cursor.execute("SELECT last_full_scrape FROM users WHERE user = ?", (username,))
+        row = self.cursor.fetchone()
+        return not row or (row[0] or 0) < cutoff
+
+    @metrics.timed("storage_seconds", op="get_profile_stats")
+    def get_profile_stats(self, username) -> dict:
+        """ The profile counters stored by the user's last finished scrape, or None """
+        self.cursor.execute("SELECT profile_stats FROM users WHERE user = ?", (username,))
+        row = self.cursor.fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    @metrics.timed("storage_seconds", op="set_pending_profile_stats")
+    def set_pending_profile_stats(self, username, stats: dict):
+        """ Profile counters seen just before a scrape, to become the user's profile_stats once it finishes """
+        with self.connection:
+            self.cursor.execute("UPDATE users SET pending_profile_stats = ? WHERE user = ?",
+                                (json.dumps(stats, sort_keys=True), username))
+
+    @metrics.timed("storage_seconds", op="refresh_user")
+    def refresh_user(self, username, full_scrape=True):
+        """
+        Record a finished scrape of the user, update their change rate and schedule their next refresh.
+        Profile counters from a pre-check before the scrape become the ones the next pre-check compares against;
+        without one, the next pre-check can't vouch for the user.
+        """
         last_updated = int(datetime.utcnow().timestamp())
-        self.cursor.execute(f"UPDATE users SET last_updated = {last_updated} WHERE user = '{username}';")
+        self.cursor.execute("SELECT last_updated, change_rate FROM users WHERE user = ?", (username,))
+        row = self.cursor.fetchone()
+        previous, change_rate = row if row else (0, None)
+
+        # Upserts only touch a rating's last_updated when it's new or changed
+        self.cursor.execute("SELECT COUNT(*), TOTAL(last_updated > ?) FROM ratings WHERE user = ?",
+                            (previous or 0, username))
+        rating_count, changed = self.cursor.fetchone()
+        if previous:
+            # At least an hour, so back-to-back scrapes don't blow the rate up
+            observed = changed / (max(last_updated - previous, 60 * 60) / DAY)
+            if change_rate is None:
+                change_rate = observed
+            else:
+                change_rate = CHANGE_RATE_ALPHA * observed + (1 - CHANGE_RATE_ALPHA) * change_rate
+
+        if change_rate is None:
+            refresh_days = DEFAULT_REFRESH_DAYS
+        elif change_rate <= 0:
+            refresh_days = MAX_REFRESH_DAYS
+        else:
+            refresh_days = min(max(REFRESH_TARGET_RATINGS / change_rate, MIN_REFRESH_DAYS), MAX_REFRESH_DAYS)
+        self.cursor.execute("UPDATE users SET last_updated = ?, change_rate = ?, next_refresh = ?, rating_count = ? "
+                            "WHERE user = ?",
+                            (last_updated, change_rate, int(last_updated + refresh_days * DAY), rating_count,
+                             username))
+        if full_scrape:
+            self.cursor.execute("UPDATE users SET last_full_scrape = ? WHERE user = ?", (last_updated, username))
+        self.cursor.execute("UPDATE users SET profile_stats = pending_profile_stats, pending_profile_stats = NULL "
+                            "WHERE user = ?", (username,))
+        # The scrape finished, so there's nothing left to resume
+        self.cursor.execute("DELETE FROM scrape_progress WHERE user = ?", (username,))
+        if changed or not previous:
+            # The cached taste profile no longer matches the user's ratings
+            self.cursor.execute("DELETE FROM taste_profiles WHERE user = ?", (username,))
         self.connection.commit()
 
+    @metrics.timed("storage_seconds", op="remove_user")
     def remove_user(self, username):
         # Update the users table with the new 'last_updated' value
         logger.warning(f"Deleting user {username}")